@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.contrib.admin.models import LogEntry, DELETION
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import F
 from django.urls import reverse
 from django.forms.widgets import *
 
@@ -17,6 +18,40 @@ class AddressAdmin(admin.ModelAdmin):
         }
 
 
+class SearchLogAdmin(admin.ModelAdmin):
+    """Statistics of the searches in list views: sort on 'Slowest' or 'Searches' for the worst ones"""
+
+    list_display = ['view', 'key', 'mode', 'count', 'results', 'get_avg_ms', 'max_ms', 'get_sql_ms', 'get_render_ms', 'saved']
+    list_filter = ['view']
+    search_fields = ['key', 'mode']
+    ordering = ['-max_ms']
+    readonly_fields = ['view', 'key', 'mode', 'count', 'results', 'total_ms', 'max_ms', 'sql_ms', 'render_ms', 'created', 'saved']
+
+    def get_queryset(self, request):
+        # Averages can be sorted on too
+        qs = super(SearchLogAdmin, self).get_queryset(request)
+        return qs.annotate(avg_ms=F('total_ms') / F('count'), avg_sql_ms=F('sql_ms') / F('count'), 
+                           avg_render_ms=F('render_ms') / F('count'))
+
+    def get_avg_ms(self, obj):
+        return round(obj.avg_ms, 1)
+    get_avg_ms.short_description = "Average (ms)"
+    get_avg_ms.admin_order_field = "avg_ms"
+
+    def get_sql_ms(self, obj):
+        return round(obj.avg_sql_ms, 1)
+    get_sql_ms.short_description = "SQL (ms)"
+    get_sql_ms.admin_order_field = "avg_sql_ms"
+
+    def get_render_ms(self, obj):
+        return round(obj.avg_render_ms, 1)
+    get_render_ms.short_description = "Render (ms)"
+    get_render_ms.admin_order_field = "avg_render_ms"
+
+    def has_add_permission(self, request):
+        return False
+
+
 # Register your models here.
 admin.site.register(Address, AddressAdmin)
-
+admin.site.register(SearchLog, SearchLogAdmin)
@@ -3,3 +3,16 @@ from django.apps import AppConfig
 
 class basicConfig(AppConfig):
     name = 'lentensermons.basic'
+
+    def ready(self):
+        from django.core import checks
+        from django.db.models.signals import post_save, post_delete, m2m_changed
+        from .views import bump_count_generation, check_basic_lists
+
+        # Validate the searches/filters/order_heads of all list views at startup
+        checks.register(check_basic_lists)
+
+        # Any change in the data invalidates cached result sizes
+        post_save.connect(bump_count_generation, dispatch_uid="basic_count_save")
+        post_delete.connect(bump_count_generation, dispatch_uid="basic_count_delete")
+        m2m_changed.connect(bump_count_generation, dispatch_uid="basic_count_m2m")
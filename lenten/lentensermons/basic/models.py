@@ -1,10 +1,11 @@
 """Models for the BASIC app.
 
 """
+from django.conf import settings
 from django.db import models, transaction
 from django.contrib.auth.models import User, Group
-from django.db.models import Q
-from django.db.models.functions import Lower
+from django.db.models import Q, F, Value
+from django.db.models.functions import Lower, Greatest
 from django.db.models.query import QuerySet 
 from django.utils import timezone
 
@@ -100,3 +101,61 @@ class Address(models.Model):
         return bResult
 
 
+
+class SearchLog(models.Model):
+    """Rolled-up statistics of the searches done in list views: one row per view and filter key"""
+
+    # [1] The list view
+    view = models.CharField("View", max_length = MAX_TEXT_LEN)
+    # [1] The normalised filter key (e.g: "descr=#peccat#; title=*vita*")
+    key = models.TextField("Filter key")
+    # [1] The kind of lookup used for each filter (e.g: "descr:word; title:suffix")
+    mode = models.TextField("Mode", default="")
+
+    # [1] Number of searches, and the number of results of the last one
+    count = models.IntegerField("Searches", default=0)
+    results = models.IntegerField("Results", default=0)
+    # [1] Total and maximum duration of the whole request, total time in SQL and in rendering (ms)
+    total_ms = models.FloatField("Total (ms)", default=0.0)
+    max_ms = models.FloatField("Slowest (ms)", default=0.0)
+    sql_ms = models.FloatField("SQL (ms)", default=0.0)
+    render_ms = models.FloatField("Render (ms)", default=0.0)
+
+    # [1] First and last time of this search
+    created = models.DateTimeField(default=get_current_datetime)
+    saved = models.DateTimeField(default=get_current_datetime, db_index=True)
+
+    class Meta:
+        unique_together = ['view', 'key']
+
+    def __str__(self):
+        sBack = "{}: {}".format(self.view, self.key)
+        return sBack
+
+    def add_search(view, key, mode, results, ms, sql_ms, render_ms):
+        """Add one search to the statistics"""
+
+        bResult = True
+        oErr = ErrHandle()
+        try:
+            with transaction.atomic():
+                obj = SearchLog.objects.filter(view=view, key=key).first()
+                if obj is None:
+                    obj = SearchLog.objects.create(view=view, key=key, mode=mode, count=1, results=results, 
+                        total_ms=ms, max_ms=ms, sql_ms=sql_ms, render_ms=render_ms)
+                    # Keep the table bounded: remove the searches that have not been done for the longest time
+                    iSize = getattr(settings, "SEARCH_LOG_SIZE", 0)
+                    if iSize > 0 and obj.id % 100 == 0:
+                        lKeep = SearchLog.objects.order_by('-saved').values_list('id', flat=True)[:iSize]
+                        SearchLog.objects.exclude(id__in=list(lKeep)).delete()
+                else:
+                    SearchLog.objects.filter(id=obj.id).update(
+                        mode=mode, count=F('count') + 1, results=results, total_ms=F('total_ms') + ms,
+                        max_ms=Greatest(F('max_ms'), Value(ms)), sql_ms=F('sql_ms') + sql_ms, 
+                        render_ms=F('render_ms') + render_ms, saved=get_current_datetime())
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("SearchLog/add_search")
+            bResult = False
+
+        return bResult
@@ -971,6 +971,49 @@ var ru = (function ($, ru) {
         }
       },
 
+      /**
+       *  init_facets
+       *      Show the number of results next to the options of select2 list selections
+       *      The counts are in the JSON element with id [sId]: select id => { option id: count }
+       *
+       */
+      init_facets: function (sId) {
+        var oFacets = null,
+            elJson = null,
+            observer = null;
+
+        try {
+          elJson = document.getElementById(sId);
+          if (elJson === null || typeof MutationObserver === "undefined") { return; }
+          oFacets = JSON.parse(elJson.textContent);
+
+          // Select2 results have an id like: select2-{select id}-result-{xxxx}-{option id}
+          observer = new MutationObserver(function (mutations) {
+            $(".select2-results__options[id$='-results'] > li.select2-results__option[id]").each(function (idx, el) {
+              var sSelect = "",
+                  sOption = "",
+                  oCount = null,
+                  iCount = 0,
+                  elCount = null;
+
+              if ($(el).children(".facet-count").length > 0) { return; }
+              sSelect = $(el).parent().attr("id").replace(/^select2-/, "").replace(/-results$/, "");
+              oCount = oFacets[sSelect];
+              if (oCount === undefined) { return; }
+              sOption = el.id.substring(el.id.lastIndexOf("-") + 1);
+              iCount = (oCount[sOption] === undefined) ? 0 : oCount[sOption];
+              elCount = document.createElement("span");
+              elCount.className = "badge facet-count" + ((iCount === 0) ? " facet-zero" : "");
+              elCount.textContent = iCount;
+              el.appendChild(elCount);
+            });
+          });
+          observer.observe(document.body, { childList: true, subtree: true });
+        } catch (ex) {
+          private_methods.errMsg("init_facets", ex);
+        }
+      },
+
       /**
        *  init_events
        *      Bind main necessary events
@@ -1735,6 +1778,7 @@ var ru = (function ($, ru) {
             dtype = "",
             sMsg = "",
             method = "normal",
+            sAction = "",
             data = [];
 
         try {
@@ -1767,6 +1811,7 @@ var ru = (function ($, ru) {
           // Get the download type and put it in the <input>
           dtype = $(elStart).attr("downloadtype");
           $(frm).find("#downloadtype").val(dtype);
+          sAction = frm.attr("action");
 
           switch (method) {
             case "erwin":
@@ -1792,6 +1837,9 @@ var ru = (function ($, ru) {
               } else {
                 // Do a plain submit of the form
                 oBack = frm.submit();
+                // Make sure a next search of the form does not download again
+                frm.attr("action", sAction);
+                $(frm).find("#downloadtype").val("");
               }
               break;
           }
@@ -6,6 +6,8 @@ Replace this with more appropriate tests for your application.
 """
 
 import django
+import re
+from django.db.models import Q
 from django.test import TestCase
 
 # TODO: Configure your database in settings.py and sync before running tests.
@@ -23,3 +25,510 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class SearchTermTest(TestCase):
+    """The cheap lookups made for PASSIM-style wildcard searches must find the same as their regexes"""
+
+    texts = ["Peccatum", "peccatum mortale", "De peccato", "IMPECCATUM est", "in die cinerum", "Die Dominica",
+             "dominica in passione", "gratia Dei", "Gratia_dei", "100% peccatum", "peccat", "peccat.", 
+             "peccatorum\nmors", "Ægidius peccator", "sanctus peccatum", "peccatum-mortale", "a", "", 
+             "vita et mors", "mors et vita", "Christus", "antichristus", "christ", "amor dei", "amores"]
+    patterns = ["peccat*", "*peccatum", "*peccat*", "pecca?um*", "*die*", "in die*", "peccat", "*", "a",
+                "p*t*m", "*%*", "*_dei", "gratia?dei", "*mors*vita*", "d[ei]*", "ægid*", "*[0-9]*",
+                "#peccat", "peccat#", "#peccat#", "peccat#*", "#peccat#*", "christ#", "#christ#", 
+                "christ#*", "#christ", "mors# vita#", "vita# #mors", "vita mors#", "pecca*tum#", 
+                "die# in#", "a#", "#mors  vita#", "pec.at#", "peccat@#"]
+
+    @classmethod
+    def setUpTestData(cls):
+        from lentensermons.basic.models import Address
+        cls.ids = {}
+        for sText in cls.texts:
+            obj = Address.objects.create(ip="127.0.0.1", reason="test", path=sText)
+            cls.ids[obj.id] = sText
+
+    def get_ids(self, q):
+        from lentensermons.basic.models import Address
+        return set(Address.objects.filter(q).values_list("id", flat=True))
+
+    def test_sequence(self):
+        """A search in one field: the regex of adapt_search() is the reference"""
+
+        from lentensermons.basic.views import adapt_search, get_search_q
+        for sPattern in self.patterns:
+            q_regex = Q(path__iregex=adapt_search(sPattern))
+            self.assertEqual(self.get_ids(get_search_q("path", sPattern)), self.get_ids(q_regex), sPattern)
+
+    def test_orfields(self):
+        """A search in 'orfields': all of the word regexes of adapt_search() must match"""
+
+        from lentensermons.basic.views import adapt_search
+        for sPattern in self.patterns:
+            q_regex = Q()
+            for sRegex in adapt_search(sPattern, orfields=[]):
+                q_regex &= Q(path__iregex=sRegex)
+            q_cheap = adapt_search(sPattern, orfields=["path"])
+            self.assertEqual(self.get_ids(q_cheap), self.get_ids(q_regex), sPattern)
+
+    def test_regex(self):
+        """The (simplified) regexes of the terms match the same texts as the original ones"""
+
+        from lentensermons.basic.views import adapt_search, classify_search
+        for sPattern in self.patterns:
+            lRegex = adapt_search(sPattern, orfields=[])
+            lTerm = classify_search(sPattern, sequence=False)
+            for sText in self.texts:
+                bOriginal = all(re.search(x, sText, re.I) != None for x in lRegex)
+                bTerms = all(re.search(x.regex, sText, re.I) != None for x in lTerm)
+                self.assertEqual(bTerms, bOriginal, "{} in {}".format(sPattern, sText))
+
+    def test_kinds(self):
+        """Each pattern gets the cheapest kind of lookup"""
+
+        from lentensermons.basic.views import classify_search
+        lExpected = [("peccat*", ["prefix"]), ("*peccatum", ["suffix"]), ("*peccat*", ["contains"]),
+                     ("peccat", ["exact"]), ("p*t*m", ["like"]), ("gratia?dei", ["like"]), 
+                     ("d[ei]*", ["regex"]), ("ægid*", ["regex"]), ("#peccat", ["contains"]),
+                     ("peccat#", ["word"]), ("#peccat#", ["wordend"]), ("peccat#*", ["wordstart"]),
+                     ("#peccat#*", ["regex"]), ("mors# vita#", ["word", "word"]), ("pec.at#", ["regex"])]
+        for sPattern, lKind in lExpected:
+            self.assertEqual([x.kind for x in classify_search(sPattern, sequence=False)], lKind, sPattern)
+        # Several words of a '#' search in one field follow each other
+        self.assertEqual([x.kind for x in classify_search("mors# vita#")], ["regex"])
+
+    def test_normalised(self):
+        """A field with lower case search keys gives the same results with plain comparisons"""
+
+        from lentensermons.basic.views import get_search_q
+        from lentensermons.seeker.models import get_latinkey
+        lLower = set(x for x, sText in self.ids.items() if sText == sText.lower())
+        for sPattern in self.patterns:
+            q_normal = get_search_q("path", sPattern, normalised=True)
+            q_plain = get_search_q("path", sPattern)
+            self.assertEqual(self.get_ids(q_normal) & lLower, self.get_ids(q_plain) & lLower, sPattern)
+        # Spelling variants of Latin get the same search key
+        self.assertEqual(get_latinkey("Vitæ  Æternæ"), get_latinkey("vite eterne"))
+        self.assertEqual(get_latinkey("Jesus & Maria"), "iesus et maria")
+
+    def test_guard(self):
+        """Search values that are too expensive are refused before they are compiled"""
+
+        from lentensermons.basic.views import check_search_value
+        for sPattern in ["#peccat#", "peccat*", "mors# vita#", "d[ei]*", "p*t*m", "#mors  vita#"]:
+            self.assertEqual(check_search_value(sPattern), "", sPattern)
+        for sPattern in ["#*#", "#a#*", "a" * 300, "#a?b?c?d?e#", "#pec.at# #pec.at# #pec.at# #pec.at#"]:
+            self.assertNotEqual(check_search_value(sPattern, sequence=False), "", sPattern)
+
+    def test_hits(self):
+        """The hit counts of SearchHits agree with the regexes of the old descr column"""
+
+        from types import SimpleNamespace
+        from lentensermons.basic.views import SearchHits, classify_search
+        from lentensermons.seeker.models import get_latinkey
+        lObj = [SimpleNamespace(path=x) for x in self.texts]
+        # Plain search: the number of occurrences (also when the value has capitals)
+        for sPattern in ["peccat", "Peccatum", "die", "a", "100% p"]:
+            lHits = SearchHits(sPattern, ["path"]).get_hits(lObj)
+            for obj, lHit in zip(lObj, lHits):
+                self.assertEqual(lHit[0][0], len(re.findall(re.escape(sPattern.lower()), obj.path.lower())), sPattern)
+        # Wildcard and '#' search: a text has hits if all the terms match it
+        for sPattern in self.patterns:
+            if "*" not in sPattern and "#" not in sPattern: continue
+            lRegex = [re.compile(x.regex) for x in classify_search(sPattern, sequence=False)]
+            lHits = SearchHits(sPattern, ["path"]).get_hits(lObj)
+            for obj, lHit in zip(lObj, lHits):
+                # NOTE: an empty text never has hits (the old column counted it for e.g. '*')
+                bOld = obj.path != "" and all(x.search(obj.path.lower()) != None for x in lRegex)
+                self.assertEqual(lHit[0][0] > 0, bOld, "{} in {}".format(sPattern, obj.path))
+                if bOld and len(lRegex) == 1 and "#" in sPattern:
+                    # One word: each occurrence is a hit
+                    iOld = len([x for x in lRegex[0].finditer(obj.path.lower()) if x.end() > x.start()])
+                    self.assertEqual(lHit[0][0], max(iOld, 1), "{} in {}".format(sPattern, obj.path))
+        # A field with a normalised search key is searched with the normalised value
+        lObj = [SimpleNamespace(title=x, latintitle=get_latinkey(x)) for x in ["Vitæ æternæ", "De vita", "Iesus et vite"]]
+        oNormal = {"title": ("latintitle", get_latinkey)}
+        for sPattern, lExpected in [("vitæ", [1, 0, 1]), ("vite#", [1, 0, 1]), ("jesus", [0, 0, 1]), ("*vit*", [1, 1, 1])]:
+            lHits = SearchHits(sPattern, ["title"], normal=oNormal).get_hits(lObj)
+            self.assertEqual([x[0][0] for x in lHits], lExpected, sPattern)
+        self.assertEqual([x[0][0] for x in SearchHits("vite", ["title"]).get_hits(lObj)], [0, 0, 1])
+
+    def test_budget(self):
+        """Only searches with costly lookups get a time budget: other queries are never interrupted"""
+
+        from django.db import connection
+        from lentensermons.basic.utils import QueryBudget
+        from lentensermons.basic.views import is_costly_search
+        for sMode in ["", "title:exact", "title:prefix; author:list"]:
+            self.assertFalse(is_costly_search(sMode), sMode)
+        for sMode in ["title:contains", "title:prefix; descr:word+wordstart", "title:regex"]:
+            self.assertTrue(is_costly_search(sMode), sMode)
+        sSql = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i+1 FROM n WHERE i < 200000) SELECT count(*) FROM n"
+        # Without a search, the budget is not started
+        with QueryBudget(0.001) as oBudget:
+            with connection.cursor() as cursor:
+                cursor.execute(sSql)
+                self.assertEqual(cursor.fetchone()[0], 200000)
+        self.assertFalse(oBudget.exceeded)
+        if connection.vendor == "sqlite":
+            with QueryBudget(0.001) as oBudget:
+                oBudget.start()
+                with self.assertRaises(django.db.OperationalError):
+                    with connection.cursor() as cursor:
+                        cursor.execute(sSql)
+                        cursor.fetchone()
+            self.assertTrue(oBudget.exceeded)
+
+
+class FulltextQueryTest(TestCase):
+    """The full-text query of a search may only narrow down: it must find all texts that the regex finds"""
+
+    patterns = SearchTermTest.patterns + ["#d[abcd]x#", r"#ab\wcd#", "dies|irae#", "colou?r#", "colo#", 
+                                          "vit(a|ae)#", "pecca{1,2}tum#", "pec+atum#", r"peccat\.#", "die[sm]# in#"]
+    texts = SearchTermTest.texts + ["dabx", "abxcd", "ab_cd", "dies", "irae", "color", "colour", "vitae", 
+                                    "peccatum", "peccaatum", "pecatum", "peccccatum", "in diem"]
+
+    def get_matches(self, sTable, sQuery):
+        from django.db import connection
+        if sQuery == "":
+            return set(range(len(self.texts)))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT rowid FROM "{}" WHERE "{}" MATCH %s'.format(sTable, sTable), [sQuery])
+            return set(x[0] for x in cursor.fetchall())
+
+    def test_superset(self):
+        """For plain, wildcard and '#' searches (also with regex characters), with both tokenizers"""
+
+        import unittest
+        from django.db import connection
+        from lentensermons.basic.views import adapt_search
+        from lentensermons.tagtext.models import get_fulltext_query, get_fulltext_tokenizer
+        if connection.vendor != "sqlite":
+            raise unittest.SkipTest("Only SQLite has a full-text index")
+        lTokenizer = ["unicode61"]
+        if get_fulltext_tokenizer() == "trigram": lTokenizer.append("trigram")
+        for sTokenizer in lTokenizer:
+            sTable = "test_fts_{}".format(sTokenizer)
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE VIRTUAL TABLE \"{}\" USING fts5(body, tokenize='{}')".format(sTable, sTokenizer))
+                cursor.executemany('INSERT INTO "{}"(rowid, body) VALUES (%s, %s)'.format(sTable), list(enumerate(self.texts)))
+            for sPattern in self.patterns + ["peccatum", "die"]:
+                if "#" in sPattern:
+                    lRegex = adapt_search(sPattern, orfields=[])
+                elif "*" in sPattern:
+                    lRegex = [adapt_search(sPattern)]
+                else:
+                    lRegex = [re.escape(sPattern)]
+                lExpected = set(idx for idx, sText in enumerate(self.texts) 
+                                if all(re.search(x, sText, re.I) != None for x in lRegex))
+                sQuery = get_fulltext_query(sPattern, sTokenizer)
+                lFound = self.get_matches(sTable, sQuery)
+                self.assertTrue(lExpected <= lFound, "{} ({}): {} misses {}".format(
+                    sPattern, sTokenizer, sQuery, [self.texts[x] for x in lExpected - lFound]))
+        # Regex words without certain literals are not narrowed down
+        for sPattern in ["#d[abcd]x#", r"#ab\wcd#", "dies|irae#"]:
+            self.assertEqual(get_fulltext_query(sPattern), "", sPattern)
+
+    def test_rebuild(self):
+        """Rebuilding the index keeps its table, since other processes have cached that it is ready"""
+
+        import unittest
+        from django.db import connection
+        from lentensermons.seeker.models import Sermon
+        if not Sermon.fulltext_ready():
+            raise unittest.SkipTest("No full-text index")
+        sTable = Sermon.get_fulltext_table()
+        Sermon.fulltext_rebuild()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name=%s", [sTable])
+            self.assertEqual(cursor.fetchone()[0], 1)
+        q_fts = Sermon.fulltext_filter(Sermon.get_fulltext_fields()[:1], "peccatum")
+        self.assertEqual(Sermon.objects.filter(q_fts).count(), 0)
+
+
+class CountGenerationTest(TestCase):
+    """Cached counts and result ids become outdated after a change in the data, in all processes"""
+
+    def test_shared(self):
+        """The data generation is kept in the cache that is shared by the worker processes"""
+
+        from django.core.cache import caches
+        from django.http import QueryDict
+        from lentensermons.basic.views import get_count_generation, bump_count_generation, get_count_key
+        qd = QueryDict("sermo-title=peccat*")
+        sKey = get_count_key("SermonListView", qd)
+        generation = get_count_generation()
+        bump_count_generation()
+        self.assertEqual(get_count_generation(), generation + 1)
+        self.assertNotEqual(get_count_key("SermonListView", qd), sKey)
+        self.assertEqual(caches['basic_shared'].get("basic_count_generation"), generation + 1)
+
+    def test_volatile(self):
+        """Logging a search (or indexing tag occurrences) does not make the cached counts outdated"""
+
+        from lentensermons.basic.models import SearchLog
+        from lentensermons.basic.views import get_count_generation
+        from lentensermons.tagtext.models import TagOccurrence
+        generation = get_count_generation()
+        SearchLog.add_search("SermonListView", "title=peccat*", "title:prefix", 3, 10.0, 2.0, 5.0)
+        TagOccurrence.objects.create(tagtype="seeker.tagkeyword", tagid=1, model="seeker.sermon", objid=1, field="summary")
+        TagOccurrence.objects.all().delete()
+        self.assertEqual(get_count_generation(), generation)
+
+    def test_result_ids(self):
+        """Ordering on a many-to-many path gives doubles: the id list is still complete, or None if too long"""
+
+        from lentensermons.basic.views import get_result_ids
+        from lentensermons.seeker.models import Author, TagKeyword, Tgroup
+        Tgroup.objects.create(name="New")
+        lTag = [TagKeyword.objects.create(name=x) for x in ["a", "b"]]
+        for idx in range(5):
+            author = Author.objects.create(name="Author {}".format(idx))
+            if idx < 3: author.infotags.set(lTag)
+        qs = Author.objects.order_by("-infotags__name", "id")
+        self.assertEqual(len(qs.values_list("id", flat=True)), 8)
+        lExpected = []
+        for id in qs.values_list("id", flat=True):
+            if id not in lExpected: lExpected.append(id)
+        self.assertEqual(len(lExpected), 5)
+        self.assertEqual(get_result_ids(qs, "test_result_ids_3", 3), None)
+        self.assertEqual(get_result_ids(qs, "test_result_ids_5", 5), lExpected)
+        self.assertEqual(get_result_ids(qs, "test_result_ids_5", 5), lExpected)
+
+
+class SortKeyTest(TestCase):
+    """Ordering on the precomputed sort keys gives the order of the fields that they replace"""
+
+    def test_names(self):
+        """A sort name orders like Lower() of the name (for names without accents)"""
+
+        from django.db.models.functions import Lower
+        from lentensermons.seeker.models import Author
+        for sName in ["beta", "Alpha", "gamma", "Delta", "alpha b", "ALPHA C", "epsilon", "Beta a"]:
+            Author.objects.create(name=sName)
+        for bDesc in [False, True]:
+            order_old = Lower("name").desc() if bDesc else Lower("name")
+            order_new = "-sortname" if bDesc else "sortname"
+            self.assertEqual(list(Author.objects.order_by(order_new).values_list("id", flat=True)),
+                             list(Author.objects.order_by(order_old).values_list("id", flat=True)))
+
+    def test_codes(self):
+        """A sort code orders like the (collection, edition, sermon) numbers, also where these are NULL"""
+
+        from django.db import connection
+        from lentensermons.seeker.models import get_sortcode
+        lNumbers = [(1, 2, 3), (1, None, 3), (1, 2, None), (None, 1, 1), (2, 1, 1), (1, 10, 2), (1, None, None),
+                    (None, None, 5), (12, 1, 1), (1, 2, 10), (None, None, None), (1, 1, 1)]
+        sValues = ", ".join(["(%s, %s, %s, %s, %s)"] * len(lNumbers))
+        lParams = []
+        for idx, lNum in enumerate(lNumbers):
+            lParams.extend([idx, *lNum, get_sortcode(lNum)])
+        for sDir in ["ASC", "DESC"]:
+            lOrder = []
+            for sOrder in ["column2 {0}, column3 {0}, column4 {0}".format(sDir), "column5 {}".format(sDir)]:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT column1 FROM (VALUES {}) ORDER BY {}".format(sValues, sOrder), lParams)
+                    lOrder.append([x[0] for x in cursor.fetchall()])
+            self.assertEqual(lOrder[1], lOrder[0], sDir)
+
+
+class KeysetTest(TestCase):
+    """Keyset pagination must give the same pages as the numbered pagination of the count"""
+
+    paths = ["b", None, "a", "b", "c", None, "a", "b", "d", "c", "b", None, "e", "a", "b", "c", None, "b", "d",
+             "a", "c", "b", None]
+    page_size = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        from lentensermons.basic.models import Address
+        for sPath in cls.paths:
+            Address.objects.create(ip="127.0.0.1", reason="keyset", path=sPath)
+
+    def get_expected(self, bDesc):
+        """The ids in the order of the keyset: NULL last in both directions, ties by ascending id"""
+
+        from lentensermons.basic.models import Address
+        lObj = list(Address.objects.filter(reason="keyset").order_by("id"))
+        if bDesc:
+            lObj.sort(key=lambda x: x.path or "", reverse=True)
+        else:
+            lObj.sort(key=lambda x: (x.path is None, x.path or ""))
+        return [x.id for x in lObj]
+
+    def get_page(self, order, sCursor):
+        from lentensermons.basic.models import Address
+        from lentensermons.basic.views import keyset_paginate
+        qs = Address.objects.filter(reason="keyset").order_by(order)
+        paginator, page, rows, bPaginated = keyset_paginate(qs, self.page_size, sCursor, qs.count())
+        return page
+
+    def test_cursor(self):
+        """Cursors survive a round trip, and invalid ones are refused"""
+
+        from lentensermons.basic.views import encode_cursor, decode_cursor
+        oCursor = decode_cursor(encode_cursor("p", 3, ["\U0010ffff", 12, "Ægidius"]))
+        self.assertEqual(oCursor, dict(d="p", n=3, v=["\U0010ffff", 12, "Ægidius"]))
+        for sCursor in [None, "", "k", "kxyz", "12", encode_cursor("x", 1, [])]:
+            self.assertIsNone(decode_cursor(sCursor), sCursor)
+
+    def test_forward(self):
+        """Following the 'next' cursors walks through all rows, with NULL keys and ties"""
+
+        for order in ["path", "-path"]:
+            lExpected = self.get_expected(order[0] == "-")
+            lId = []
+            sCursor = ""
+            number = 0
+            while True:
+                page = self.get_page(order, sCursor)
+                number += 1
+                self.assertEqual(page.number, number, order)
+                self.assertEqual(page.start_index(), len(lId) + 1, order)
+                lId.extend([x.id for x in page])
+                if not page.has_next(): break
+                sCursor = page.next_cursor
+            self.assertEqual(lId, lExpected, order)
+
+    def test_backward(self):
+        """The 'last' cursor and the 'previous' cursors give the pages of the numbering by count"""
+
+        for order in ["path", "-path"]:
+            lExpected = self.get_expected(order[0] == "-")
+            num_pages = (len(lExpected) + self.page_size - 1) // self.page_size
+            page = self.get_page(order, self.get_page(order, "").last_cursor)
+            for number in range(num_pages, 0, -1):
+                self.assertEqual(page.number, number, order)
+                iStart = (number - 1) * self.page_size
+                self.assertEqual([x.id for x in page], lExpected[iStart:iStart + self.page_size], order)
+                self.assertEqual(page.start_index(), iStart + 1, order)
+                if number > 1:
+                    page = self.get_page(order, page.previous_cursor)
+            self.assertFalse(page.has_previous())
+
+
+class TagtextTest(TestCase):
+    """Saving a tagged text links its tags, also the new ones"""
+
+    def setUp(self):
+        from lentensermons.seeker.models import Tgroup, TagKeyword, SearchIndex
+        # The index table is made again in the transaction of each test
+        SearchIndex.available = None
+        Tgroup.objects.create(name="New")
+        self.mors = TagKeyword.objects.create(name="mors")
+
+    def get_info(self, *lNew):
+        import json
+        lPart = [dict(type="text", value="De"), dict(type="tag", value="mors", tagid=self.mors.id)]
+        for sNew in lNew:
+            lPart.extend([dict(type="text", value="et"), dict(type="new", value=sNew)])
+        return json.dumps(lPart)
+
+    def test_new_tags(self):
+        """New tags get an id in the text and in the m2m links, with and without ids from bulk inserts"""
+
+        import json
+        from unittest import mock
+        from django.db import connection
+        from lentensermons.seeker.models import Author, TagKeyword, SearchIndex
+        for bReturn in [True, False]:
+            with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert", bReturn):
+                sPax, sVita = ("pacem", "vitam") if bReturn else ("gratiam", "gloriam")
+                author = Author.objects.create(name="Author {}".format(bReturn), info=self.get_info(sPax, sVita))
+            oTag = { x.name: x.id for x in TagKeyword.objects.filter(name__in=["mors", sPax, sVita]) }
+            self.assertEqual(len(oTag), 3)
+            self.assertTrue(all(x != None for x in oTag.values()))
+            lStored = [(x['value'], x['tagid']) for x in json.loads(Author.objects.get(id=author.id).info) if x['type'] == "tag"]
+            self.assertEqual(lStored, [("mors", oTag["mors"]), (sPax, oTag[sPax]), (sVita, oTag[sVita])])
+            self.assertEqual(set(author.infotags.values_list("id", flat=True)), set(oTag.values()))
+            if SearchIndex.is_available():
+                lHit = [x for x in SearchIndex.search(sPax) if x['kind'] == "tagkeyword"]
+                self.assertEqual([x[0] for x in lHit[0]['hits']], [oTag[sPax]])
+
+    def test_retag(self):
+        """Retagging in bulk gives the same texts and links as process_tags(), and reports the chunks that fail"""
+
+        from unittest import mock
+        from lentensermons.seeker.models import Author, TagKeyword
+        lAuthor = [Author.objects.create(name="Author {}".format(x)) for x in range(3)]
+        lInfo = [self.get_info("pacem"), self.get_info(), "Flat text"]
+        for author, sInfo in zip(lAuthor, lInfo):
+            # Without save(), so that nothing is processed yet
+            Author.objects.filter(id=author.id).update(info=sInfo)
+        lFailed = []
+        with mock.patch.object(Author, "retag", side_effect=ValueError("test")):
+            Author.retag_all(chunk=2, failed=lFailed)
+        self.assertEqual([x[:2] for x in lFailed], [(lAuthor[0].id, lAuthor[1].id), (lAuthor[2].id, lAuthor[2].id)])
+        Author.retag_all(chunk=2)
+        for author, sInfo in zip(lAuthor, lInfo):
+            obj = Author.objects.get(id=author.id)
+            expected = Author(name=obj.name, info=sInfo)
+            expected.save()
+            bOkay, sText = expected.process_tags("info", expected.infotags, TagKeyword)
+            self.assertTrue(bOkay)
+            self.assertEqual(obj.info, sText)
+            self.assertEqual(set(obj.infotags.values_list("id", flat=True)), set(expected.infotags.values_list("id", flat=True)))
+            self.assertEqual(obj.get_info_display, expected.get_info_display)
+
+    def test_save_fields(self):
+        """Saving only some fields keeps the sort keys up to date, and a rollback drops the pending adapt_related()"""
+
+        from django.db import transaction
+        from lentensermons.seeker.models import Author, get_sortkey
+        author = Author.objects.create(name="Alpha", info=self.get_info())
+        author.name = "Zeta"
+        author.save(update_fields=["name"])
+        self.assertEqual(Author.objects.get(id=author.id).sortname, get_sortkey("Zeta"))
+
+        with self.captureOnCommitCallbacks() as lCallback:
+            try:
+                with transaction.atomic():
+                    other = Author.objects.create(name="Beta")
+                    raise ValueError("rollback")
+            except ValueError:
+                pass
+            author.save()
+        self.assertEqual(len(lCallback), 1)
+        self.assertEqual(list(lCallback[0].objects), [(Author, author.id)])
+
+    def test_occurrences(self):
+        """The index of the tag occurrences follows saving, retagging and deleting (also in bulk)"""
+
+        from lentensermons.seeker.models import Author, TagKeyword
+        from lentensermons.tagtext.models import TagOccurrence
+        author = Author.objects.create(name="Alpha", info=self.get_info("pacem"))
+        pax = TagKeyword.objects.get(name="pacem")
+        oCounts = TagOccurrence.get_counts(TagKeyword, [self.mors.id, pax.id])
+        self.assertEqual(oCounts, {self.mors.id: {("seeker.author", "info"): 1}, pax.id: {("seeker.author", "info"): 1}})
+        self.assertEqual(TagOccurrence.get_objects(TagKeyword, self.mors.id), {("seeker.author", "info"): [author.id]})
+        oSnippets = TagOccurrence.get_snippets(TagKeyword, pax.id, Author, "info", [author.id])
+        self.assertEqual([x[0] for x in oSnippets[author.id]], ["pacem"])
+
+        # Retagging in bulk: the 'pacem' tag is gone from the text
+        Author.objects.filter(id=author.id).update(info=self.get_info())
+        Author.retag(list(Author.objects.filter(id=author.id)))
+        self.assertEqual(TagOccurrence.get_objects(TagKeyword, pax.id), {})
+        self.assertEqual(TagOccurrence.get_objects(TagKeyword, self.mors.id), {("seeker.author", "info"): [author.id]})
+
+        # Deleting a tag, and deleting objects through a queryset
+        other = Author.objects.create(name="Beta", info=self.get_info("gratiam"))
+        TagKeyword.objects.filter(name="gratiam").delete()
+        self.assertEqual(TagOccurrence.objects.filter(objid=other.id, tagid=self.mors.id).count(), 1)
+        self.assertEqual(TagOccurrence.objects.filter(objid=other.id).count(), 1)
+        Author.objects.all().delete()
+        self.assertEqual(TagOccurrence.objects.count(), 0)
+
+    def test_rendered(self):
+        """Storing the rendered HTML on display keeps the cached counts and result ids valid"""
+
+        from lentensermons.basic.views import get_count_generation
+        from lentensermons.seeker.models import Author
+        author = Author.objects.create(name="Alpha", info=self.get_info("pacem"))
+        Author.objects.filter(id=author.id).update(rendered=None)
+        obj = Author.objects.get(id=author.id)
+        generation = get_count_generation()
+        self.assertIn("mors", obj.get_info_display)
+        self.assertNotEqual(Author.objects.get(id=author.id).rendered, None)
+        Author.objects.filter(id=author.id).update(rendered=None)
+        self.assertEqual(Author.rendered_rebuild(), 1)
+        self.assertEqual(get_count_generation(), generation)
@@ -1,4 +1,8 @@
 import sys
+import json
+import time
+from django.conf import settings
+from django.db import connection
 
 class ErrHandle:
     """Error handling"""
@@ -49,3 +53,155 @@ class ErrHandle:
 
     def get_error_stack(self):
         return " ".join(self.loc_errStack)
+
+
+class PhaseTimer:
+    """Timing of the phases of one request, including the number and duration of SQL queries
+    
+    Calling lap() ends the current phase and starts the next one.
+    The result goes to a Server-Timing header (settings.SERVER_TIMING: only for staff users, or with DEBUG)
+    and/or to a log line (settings.SERVER_TIMING_LOG).
+    """
+
+    def __init__(self, name="", enabled=None):
+        self.name = name
+        if enabled is None:
+            enabled = getattr(settings, "SERVER_TIMING", False) or getattr(settings, "SERVER_TIMING_LOG", False)
+        self.enabled = enabled
+        self.phases = {}
+        self.current = None
+        self.start = None
+
+    def lap(self, name):
+        """End the current phase and start phase [name] (a phase may occur more than once)"""
+
+        if not self.enabled: return None
+        now = time.perf_counter()
+        if self.current != None:
+            self.current['dur'] += now - self.start
+        if name is None:
+            self.current = None
+        else:
+            if name not in self.phases:
+                self.phases[name] = dict(dur=0.0, queries=0, sql=0.0)
+            self.current = self.phases[name]
+        self.start = now
+        return None
+
+    def execute(self, execute, sql, params, many, context):
+        """Database execute wrapper: count the query and its duration in the current phase"""
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if self.current != None:
+                self.current['queries'] += 1
+                self.current['sql'] += time.perf_counter() - start
+
+    def dispatch(self, dispatch, request, *args, **kwargs):
+        """Time the [dispatch] of a view and add the result to its response"""
+
+        if not self.enabled:
+            return dispatch(request, *args, **kwargs)
+        with connection.execute_wrapper(self.execute):
+            self.lap("view")
+            response = dispatch(request, *args, **kwargs)
+            if hasattr(response, "render") and not getattr(response, "is_rendered", True):
+                # Template responses are rendered lazily: make sure this is timed too
+                self.lap("render")
+                response.render()
+            self.lap(None)
+        return self.finish(request, response)
+
+    def get_ms(self, name):
+        """Get the duration of phase [name] in milliseconds"""
+
+        oPhase = self.phases.get(name)
+        return 0.0 if oPhase is None else oPhase['dur'] * 1000
+
+    def get_totals(self):
+        """Get the total duration, number of queries and SQL time of all phases"""
+
+        oTotals = dict(ms=0.0, queries=0, sql_ms=0.0)
+        for oPhase in self.phases.values():
+            oTotals['ms'] += oPhase['dur'] * 1000
+            oTotals['queries'] += oPhase['queries']
+            oTotals['sql_ms'] += oPhase['sql'] * 1000
+        return oTotals
+
+    def finish(self, request, response):
+        """Add the timing of the phases to [response] and/or to the log"""
+
+        lTiming = []
+        oLog = dict(view=self.name, method=request.method, path=request.path, phases={})
+        fTotal = 0.0
+        iQueries = 0
+        for name, oPhase in self.phases.items():
+            fTotal += oPhase['dur']
+            iQueries += oPhase['queries']
+            lTiming.append('{};dur={:.1f};desc="{} sql {:.1f}ms"'.format(
+                name, oPhase['dur'] * 1000, oPhase['queries'], oPhase['sql'] * 1000))
+            oLog['phases'][name] = dict(ms=round(oPhase['dur'] * 1000, 1), queries=oPhase['queries'], 
+                                        sql_ms=round(oPhase['sql'] * 1000, 1))
+        lTiming.append('total;dur={:.1f};desc="{} sql"'.format(fTotal * 1000, iQueries))
+        oLog['ms'] = round(fTotal * 1000, 1)
+        oLog['queries'] = iQueries
+        if getattr(settings, "SERVER_TIMING", False):
+            # The timings are internal details: anonymous users do not get to see them
+            user = getattr(request, "user", None)
+            if settings.DEBUG or (user != None and user.is_staff):
+                response['Server-Timing'] = ", ".join(lTiming)
+        if getattr(settings, "SERVER_TIMING_LOG", False):
+            ErrHandle().Status("Timing: {}".format(json.dumps(oLog)))
+        return response
+
+
+class QueryBudget:
+    """Time budget for each SQL query: a query that takes longer than [ms] is interrupted
+    
+    Only works for SQLite, through its progress handler (called every [steps] VM instructions).
+    The budget only counts once start() has been called: use the object as a context manager.
+    An interrupted query raises an OperationalError ('interrupted'), and sets [exceeded].
+    """
+
+    def __init__(self, ms=0, steps=1000):
+        self.ms = ms
+        self.steps = steps
+        self.active = False
+        self.deadline = None
+        self.exceeded = False
+        self.wrapper = None
+
+    def __enter__(self):
+        if self.ms and connection.vendor == "sqlite":
+            connection.ensure_connection()
+            connection.connection.set_progress_handler(self.progress, self.steps)
+            self.wrapper = connection.execute_wrapper(self.execute)
+            self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.wrapper != None:
+            self.wrapper.__exit__(exc_type, exc_value, traceback)
+            self.wrapper = None
+            if connection.connection != None:
+                connection.connection.set_progress_handler(None, 0)
+        return False
+
+    def start(self):
+        """Start counting: from now on, queries are interrupted when they take too long"""
+
+        self.active = True
+
+    def execute(self, execute, sql, params, many, context):
+        # NOTE: the deadline stays, since the rows of a query are only fetched after the execute
+        self.deadline = time.perf_counter() + self.ms / 1000 if self.active else None
+        return execute(sql, params, many, context)
+
+    def progress(self):
+        if self.deadline != None and time.perf_counter() > self.deadline:
+            self.exceeded = True
+            self.deadline = None
+            return 1
+        return 0
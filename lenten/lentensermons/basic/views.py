@@ -3,30 +3,53 @@ Definition of views for the BASIC app.
 """
 
 from django.apps import apps
+from django.conf import settings
 from django.contrib.auth.models import User, Group
+from django.core.cache import cache, caches, InvalidCacheBackendError
 # from django.core.urlresolvers import reverse
 from django.urls import reverse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db import transaction
-from django.db.models import Q, Prefetch, Count, F
-from django.db.models.functions import Lower
+from django.db import transaction, DatabaseError, connection
+from django.db.models import Q, Prefetch, Count, F, Value, CharField, TextField, IntegerField, \
+    FloatField, DecimalField, ForeignKey, Lookup
+from django.db.models.expressions import OrderBy
+from django.db.models.functions import Lower, Coalesce
 from django.db.models.query import QuerySet 
 from django.forms.models import model_to_dict
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse, FileResponse
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse, FileResponse, \
+    StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.template.loader import render_to_string
+from django.utils.functional import cached_property
+from django.utils.html import strip_tags
 from django.views.generic.detail import DetailView
 from django.views.generic.base import RedirectView
 from django.views.generic import ListView, View
 
 import json
+import base64
+import copy
+import csv
+import html
+import tempfile
+from collections import namedtuple
+from types import MappingProxyType
 import fnmatch
+import hashlib
+import itertools
 import re
 import os
 from datetime import datetime
 
+# XLSX export is only available if openpyxl has been installed
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
 # provide error handling
-from .utils import ErrHandle
+from .utils import ErrHandle, PhaseTimer, QueryBudget
+from .models import SearchLog
 
 
 # Some constants that can be used
@@ -40,6 +63,27 @@ bDebug = False
 # Opening the pages for non-authenticated users
 bNeedAuthentication = False
 
+# Result sizing: how long (seconds) a calculated count may be re-used
+count_timeout = 300
+# Parameters that do not influence the size of a result set
+count_skip_keys = ['page', 'paginate_by', 'o', 'w', 'csrfmiddlewaretoken']
+# Models whose saving does *not* invalidate cached counts (app_label.model_name): their rows do not feed list queries
+count_volatile = ['sessions.session', 'admin.logentry', 'seeker.visit', 'seeker.action', 'seeker.status', 'seeker.profile',
+                  'seeker.information', 'basic.searchlog', 'basic.address', 'tagtext.tagoccurrence']
+# Kinds of lookups (see classify_search) that may scan whole tables: searches with these get a time budget
+search_costly_kinds = ['contains', 'suffix', 'like', 'regex', 'word', 'wordend', 'wordstart']
+# Result id lists: parameters that do not influence the (ordered) list of ids
+result_skip_keys = ['page', 'paginate_by', 'w', 'csrfmiddlewaretoken']
+# Result id lists: how long (seconds) an ordered id list may be re-used
+result_timeout = 600
+# Export of list results: labels and content types per download type
+export_formats = {
+    'csv':    dict(label="CSV (comma-separated)", content_type="text/csv"),
+    'tsv':    dict(label="TSV (tab-separated)",   content_type="text/tab-separated-values"),
+    'ndjson': dict(label="JSON (one line per item)", content_type="application/x-ndjson"),
+    'xlsx':   dict(label="Excel", content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    }
+
 # General functions serving the list and details views
 
 def get_application_name():
@@ -80,20 +124,24 @@ def user_is_authenticated(request, bStrict = False):
     return response
 
 def user_is_ingroup(request, sGroup):
-    # Is this user part of the indicated group?
-    username = request.user.username
-    user = User.objects.filter(username=username).first()
-    # glist = user.groups.values_list('name', flat=True)
+    # The group list is only calculated once per request
+    glist = getattr(request, "basic_group_list", None)
+    if glist is None:
+        # Is this user part of the indicated group?
+        username = request.user.username
+        user = User.objects.filter(username=username).first()
+        # glist = user.groups.values_list('name', flat=True)
 
-    # Only look at group if the user is known
-    if user == None:
-        glist = []
-    else:
-        glist = [x.name for x in user.groups.all()]
+        # Only look at group if the user is known
+        if user == None:
+            glist = []
+        else:
+            glist = [x.name for x in user.groups.all()]
 
-        # Only needed for debugging
-        if bDebug:
-            ErrHandle().Status("User [{}] is in groups: {}".format(user, glist))
+            # Only needed for debugging
+            if bDebug:
+                ErrHandle().Status("User [{}] is in groups: {}".format(user, glist))
+        request.basic_group_list = glist
     # Evaluate the list
     bIsInGroup = (sGroup in glist)
     return bIsInGroup
@@ -126,6 +174,14 @@ def user_may_edit(request):
     return bFound
 
 
+def reverse_maker(viewname):
+    """Return a function that gives the URL of [viewname] for one id, calling reverse() only once"""
+
+    sMarker = "987654321"
+    sUrl = reverse(viewname, args=[sMarker])
+    sBefore, sAfter = sUrl.split(sMarker, 1)
+    return lambda id: "{}{}{}".format(sBefore, id, sAfter)
+
 def get_breadcrumbs(request, name, is_menu, lst_crumb=[], **kwargs):
     """Process one visit and return updated breadcrumbs"""
 
@@ -209,7 +265,17 @@ def adapt_search(val, regex_function=None, orfields=None):
     if len(val) > 0:
         # Make sure we only start searching lower case
         val =val.lower()
-        if "#" in val:
+        if orfields:
+            # It should be a Q term: any of the fields, each with the cheapest lookups for the search terms
+            s_q_lst = ""
+            for orfield in orfields:
+                s_q = get_search_q(orfield, val, sequence=False)
+                if s_q_lst == "":
+                    s_q_lst = ( s_q )
+                else:
+                    s_q_lst = s_q_lst | ( s_q )
+            val = ( s_q_lst )
+        elif "#" in val:
             # Break it up into words
             arWord = val.split(" ")
             for idx, item in enumerate(arWord):
@@ -229,24 +295,9 @@ def adapt_search(val, regex_function=None, orfields=None):
             if orfields == None:
                 # Combine: in order
                 val = " ".join(arWord)
-            elif orfields == []:
+            else:
                 # Return the list
                 val = arWord
-            else:
-                s_q_lst = ""
-                for orfield in orfields:
-                    s_q_terms = ""
-                    for term in arWord:
-                        s_q = Q(**{"{}__iregex".format(orfield): term})
-                        if s_q_terms == "":
-                            s_q_terms = s_q
-                        else:
-                            s_q_terms = s_q_terms & s_q
-                    if s_q_lst == "":
-                        s_q_lst = ( s_q_terms )
-                    else:
-                        s_q_lst = s_q_lst | ( s_q_terms )
-                val = ( s_q_lst )
         else:
             val = fnmatch.translate(val)
             if val[0] != '^':
@@ -254,49 +305,347 @@ def adapt_search(val, regex_function=None, orfields=None):
             if val[-1] != "$":
                 val = "{}$".format(val)
             if orfields != None:
-                if orfields == []:
-                    # Make sure this is a list
-                    val = [ val ]
-                else:
-                    # It should be a Q term
-                    s_q_lst = ""
-                    for orfield in orfields:
-                        s_q = Q(**{"{}__iregex".format(orfield): val})
-                        if s_q_lst == "":
-                            s_q_lst = ( s_q )
-                        else:
-                            s_q_lst = s_q_lst | ( s_q )
-                    val = ( s_q_lst )
+                # Make sure this is a list
+                val = [ val ]
 
         # Is there a regex function?
         if regex_function != None and orfields == None:
             val = regex_function(val)
     return val
 
-def make_search_list(filters, oFields, search_list, qd, lstExclude):
-    """Using the information in oFields and search_list, produce a revised filters array and a lstQ for a Queryset"""
+class ILike(Lookup):
+    """Case-insensitive LIKE with a ready-made pattern (% and _ are wildcards, \\ escapes)"""
+
+    lookup_name = "ilike"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        if connection.vendor == "sqlite":
+            # NOTE: LIKE is case-insensitive in SQLite (for ASCII)
+            sSql = "%s LIKE %s ESCAPE '\\'" % (lhs, rhs)
+        else:
+            sSql = "UPPER(%s) LIKE UPPER(%s) ESCAPE '\\'" % (lhs, rhs)
+        return sSql, lhs_params + rhs_params
+
+CharField.register_lookup(ILike)
+TextField.register_lookup(ILike)
+
+# One term of a search value: the cheapest kind of lookup that gives the same result as its regex
+SearchTerm = namedtuple("SearchTerm", ["kind", "value", "regex"])
+
+# The lookup used for each kind of search term ('word...' kinds also need their regex)
+search_kinds = {'exact': 'iexact', 'prefix': 'istartswith', 'suffix': 'iendswith', 'contains': 'icontains', 
+                'like': 'ilike', 'word': 'icontains', 'wordstart': 'icontains', 'wordend': 'icontains'}
+
+def classify_search(val, sequence=True):
+    """Divide the PASSIM-style search value [val] into SearchTerms that all must match
+    
+    The kind of a term is one of: exact, prefix, suffix, contains, like (only * and ?), 
+    word, wordstart, wordend (whole word, start or end of a word) or regex (anything else).
+    The [regex] of a term means the same as the regex made by adapt_search().
+    With [sequence] the words of a '#' search must follow each other (as in the regex of 
+    adapt_search), otherwise each word is a separate term (as with 'orfields').
+    
+    NOTE: the cheap kinds are only used for ASCII values, since SQLite's LIKE only
+          ignores the case of ASCII letters
+    """
 
-    def enable_filter(filter_id, head_id=None):
-        for item in filters:
-            if filter_id in item['id']:
-                item['enabled'] = True
-                # Break from my loop
+    lTerm = []
+    val = val.strip().lower()
+    if "#" in val:
+        # Each word of the value has its own regex
+        lWord = val.split(" ")
+        lRegex = adapt_search(val, orfields=[])
+        if sequence and len(lWord) > 1:
+            return [SearchTerm("regex", val, " ".join(lRegex))]
+        for sWord, sRegex in zip(lWord, lRegex):
+            # A lone * (i.e. not #*) is ignored
+            sWord = re.sub(r'(?<!#)\*', '', sWord)
+            oMatch = re.fullmatch(r'(#?)([a-z0-9]+)(#\*|#?)', sWord)
+            if oMatch == None:
+                lTerm.append(SearchTerm("regex", sWord, sRegex))
+            else:
+                sStart, sText, sEnd = oMatch.groups()
+                if sEnd == "":
+                    # Occurs anywhere
+                    lTerm.append(SearchTerm("contains", sText, sText))
+                elif sEnd == "#":
+                    if sStart == "":
+                        lTerm.append(SearchTerm("word", sText, r'\b{}\b'.format(sText)))
+                    else:
+                        lTerm.append(SearchTerm("wordend", sText, r'{}\b'.format(sText)))
+                elif sStart == "":
+                    lTerm.append(SearchTerm("wordstart", sText, r'\b{}'.format(sText)))
+                else:
+                    # This means a literal '#' at the start
+                    lTerm.append(SearchTerm("regex", sWord, sRegex))
+    else:
+        # A wildcard pattern (* ? [...]) that matches the whole field
+        sRegex = adapt_search(val)
+        sKind = "regex"
+        sValue = val
+        if len(val) > 0 and "[" not in val and all(ord(x) < 128 for x in val):
+            iStar = val.count("*")
+            if "?" in val:
+                sKind = "like"
+            elif iStar == 0:
+                sKind = "exact"
+            elif iStar == 1 and val.endswith("*"):
+                sKind, sValue = "prefix", val[:-1]
+            elif iStar == 1 and val.startswith("*"):
+                sKind, sValue = "suffix", val[1:]
+            elif iStar == 2 and len(val) > 2 and val.startswith("*") and val.endswith("*"):
+                sKind, sValue = "contains", val[1:-1]
+            else:
+                sKind = "like"
+            if sKind == "like":
+                sValue = val.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                sValue = sValue.replace("*", "%").replace("?", "_")
+        lTerm.append(SearchTerm(sKind, sValue, sRegex))
+    return lTerm
+
+def get_search_q(field, val, regex_function=None, sequence=True, normalised=False):
+    """Get a Q-object to search [field] for the PASSIM-style value [val], using the cheapest lookups possible
+    
+    Regular expressions are only used when nothing else gives the same result.
+    With a [regex_function] the regex of adapt_search() is always used.
+    A [normalised] field contains lower case search keys only: then exact and prefix 
+    searches are plain comparisons, which can use the index of the field.
+    """
+
+    if regex_function != None:
+        return Q(**{"{}__iregex".format(field): adapt_search(val, regex_function)})
+    s_q = Q()
+    for term in classify_search(val, sequence):
+        if term.kind == "regex":
+            s_q &= Q(**{"{}__iregex".format(field): term.regex})
+        elif normalised and term.kind == "exact":
+            s_q &= Q(**{field: term.value})
+        elif normalised and term.kind == "prefix":
+            s_q &= Q(**{"{}__gte".format(field): term.value, "{}__lt".format(field): term.value + "\U0010ffff"})
+        else:
+            s_q &= Q(**{"{}__{}".format(field, search_kinds[term.kind]): term.value})
+            if term.kind.startswith("word"):
+                # Only the rows that contain the word need to be checked by the regex
+                s_q &= Q(**{"{}__iregex".format(field): term.regex})
+    return s_q
+
+# Resolved search key paths per (model, field path)
+search_paths = {}
+
+def get_search_key(model, path):
+    """Get (path to the search key, normalisation function) for the field [path] of [model], or None
+    
+    A model may define a dictionary 'search_keys' that maps a text field onto a field
+    that contains its normalised search key, as made by the model's get_search_key().
+    """
+
+    sKey = (model, path)
+    if sKey in search_paths:
+        return search_paths[sKey]
+    oBack = None
+    try:
+        if model != None and path:
+            parts = path.split("__")
+            current = model
+            for part in parts[:-1]:
+                field = current._meta.get_field(part)
+                current = field.related_model
+                if current is None: break
+            if current != None:
+                sField = getattr(current, "search_keys", {}).get(parts[-1])
+                if sField != None:
+                    oBack = ("__".join(parts[:-1] + [sField]), current.get_search_key)
+    except:
+        oBack = None
+    search_paths[sKey] = oBack
+    return oBack
+
+# One compiled entry of the 'searches' specification of a BasicList
+SearchItem = namedtuple("SearchItem", ["filter_type", "head_id", "filter_index", "head_index",
+    "keyS", "keyId", "keyFk", "keyList", "infield", "dbfield", "fkfields", "orfields", 
+    "keyType", "code_function", "regex_function", "external", "facet_path", "fulltext", "normal"])
+
+# The compiled plan of a BasicList: searches, filter-id map, order columns and any problems found
+SearchPlan = namedtuple("SearchPlan", ["items", "filter_index", "order_columns", "head_filters", "problems"])
+
+# Lookups that may end a 'dbfield' specification
+search_lookups = ['exact', 'iexact', 'gt', 'gte', 'lt', 'lte', 'in', 'contains', 'icontains', 
+                  'startswith', 'istartswith', 'regex', 'iregex', 'isnull']
+
+def check_field_path(model, path):
+    """Check whether [path] (e.g. 'collection__authors__name') can be resolved from [model]"""
+
+    bBack = True
+    if model != None and path:
+        current = model
+        parts = path.split("__")
+        for idx, part in enumerate(parts):
+            try:
+                field = current._meta.get_field(part)
+            except:
+                # Only a lookup at the end is allowed
+                bBack = (idx == len(parts) - 1 and idx > 0 and part in search_lookups)
+                break
+            if field.is_relation and field.related_model != None:
+                current = field.related_model
+            elif idx < len(parts) - 1:
+                # Only a lookup can follow a plain field
+                bBack = (idx == len(parts) - 2 and parts[-1] in search_lookups)
                 break
+    return bBack
+
+def compile_search_plan(filters, search_list, order_cols=None, order_heads=None, model=None):
+    """Turn the 'searches', 'filters' and 'order_heads' specification into an immutable SearchPlan
+    
+    Everything that does not depend on the request (splitting of field lists, 
+    finding the filter that belongs to a search item) is done here once.
+    Problems in the specification are collected in the plan's [problems].
+    """
+
+    def find_filter(filter_id):
+        # Same matching as used to be done at request time: first filter that contains the id
+        if filter_id != None and filter_id != "":
+            for idx, item in enumerate(filters):
+                if filter_id in item['id']:
+                    return idx
+        return None
+
+    items = []
+    problems = []
+    oFilterIndex = {}
+    for idx, item in enumerate(filters):
+        if 'id' not in item:
+            problems.append("filters[{}] has no 'id'".format(idx))
+        else:
+            oFilterIndex[item['id']] = idx
+
+    for part in search_list:
+        head_id = part.get('section')
+        head_index = find_filter(head_id)
+        for search_item in part.get('filterlist', []):
+            filter_type = search_item.get("filter")
+            fkfield = search_item.get("fkfield")
+            dbfield = search_item.get("dbfield")
+            orfield = search_item.get("orfield")
+            keyFk = search_item.get("keyFk")
+            keyList = search_item.get("keyList")
+            infield = search_item.get("infield")
+            keyType = search_item.get("keyType")
+            # A list selection can have facet counts: the path to the value that is selected
+            facet_path = None
+            if keyList and infield and search_item.get("facet", True):
+                if fkfield and "|" not in fkfield:
+                    facet_path = "{}__{}".format(fkfield, infield)
+                elif keyType == "fieldchoice" and dbfield:
+                    facet_path = dbfield
+            # Text searches in fields with a search key use the (normalised) key instead
+            normal = {}
+            if model != None and search_item.get("regex") == None:
+                lText = orfield.split(";") if orfield else []
+                if dbfield: lText.append(dbfield)
+                if fkfield and keyFk:
+                    lText += ["{}__{}".format(x, keyFk) for x in fkfield.split("|")]
+                for sPath in lText:
+                    oKey = get_search_key(model, sPath)
+                    if oKey != None: normal[sPath] = oKey
+            # A text search in 'orfield' can use the full-text index of the model, if it has one
+            fulltext = None
+            if orfield and model != None and hasattr(model, "fulltext_filter"):
+                lFts = model.get_fulltext_fields()
+                if all(normal.get(x, (x,))[0] in lFts for x in orfield.split(";")):
+                    fulltext = model
+            oItem = SearchItem(
+                filter_type = filter_type, head_id = head_id, 
+                filter_index = find_filter(filter_type), head_index = head_index,
+                keyS = search_item.get("keyS"), keyId = search_item.get("keyId"), keyFk = keyFk,
+                keyList = keyList, infield = infield, dbfield = dbfield,
+                fkfields = tuple(fkfield.split("|")) if fkfield else (),
+                orfields = tuple(orfield.split(";")) if orfield else (),
+                keyType = keyType, code_function = search_item.get("code"),
+                regex_function = search_item.get("regex"), external = search_item.get("external"),
+                facet_path = facet_path, fulltext = fulltext, normal = MappingProxyType(normal))
+            items.append(oItem)
+
+            # Validate this item
+            sName = "search '{}'".format(filter_type)
+            if filter_type == None:
+                problems.append("search item without 'filter': {}".format(search_item))
+            elif oItem.filter_index == None and head_id != "other":
+                # NOTE: the items in section 'other' are hidden filters without a filter of their own
+                problems.append("{} has no matching item in 'filters'".format(sName))
+            if not (fkfield or dbfield or orfield):
+                problems.append("{} needs one of 'fkfield', 'dbfield' or 'orfield'".format(sName))
+            if keyList and not infield:
+                problems.append("{} has a 'keyList' but no 'infield'".format(sName))
+            if keyType == "exists" and oItem.code_function == None:
+                problems.append("{} of keyType 'exists' needs a 'code' function".format(sName))
+            if model != None:
+                lPath = list(oItem.orfields)
+                if dbfield: lPath.append(dbfield)
+                for sFk in oItem.fkfields:
+                    lPath.append(sFk)
+                    if keyFk: lPath.append("{}__{}".format(sFk, keyFk))
+                if facet_path: lPath.append(facet_path)
+                for sPath in lPath:
+                    if not check_field_path(model, sPath):
+                        problems.append("{}: cannot resolve '{}' on {}".format(sName, sPath, model.__name__))
+
+    # Compile the order columns
+    order_columns = []
+    for sCol in (order_cols or []):
+        order_columns.append(tuple([x for x in sCol.split(";") if x != ""]))
+        if model != None:
+            for sPath in order_columns[-1]:
+                if not check_field_path(model, sPath.lstrip("-")):
+                    problems.append("order column '{}': cannot resolve on {}".format(sPath, model.__name__))
+
+    # Order heads that are linked to a filter (for 'autohide')
+    head_filters = []
+    for idx, oHead in enumerate(order_heads or []):
+        if 'filter' in oHead:
+            if oHead['filter'] in oFilterIndex:
+                head_filters.append((idx, oFilterIndex[oHead['filter']]))
+            else:
+                problems.append("order head '{}' refers to unknown filter '{}'".format(oHead.get('name'), oHead['filter']))
+        if 'order' in oHead and "=" in oHead['order']:
+            try:
+                iCol = int(oHead['order'].split("=")[1])
+                if iCol < 1 or iCol > len(order_columns):
+                    problems.append("order head '{}' refers to missing order column {}".format(oHead.get('name'), iCol))
+            except:
+                problems.append("order head '{}' has an invalid 'order'".format(oHead.get('name')))
+
+    plan = SearchPlan(items=tuple(items), filter_index=MappingProxyType(oFilterIndex), 
+                      order_columns=tuple(order_columns), head_filters=tuple(head_filters), 
+                      problems=tuple(problems))
+    return plan
+
+def apply_search_plan(plan, filters, oFields, qd, lstExclude):
+    """Bind the form values in oFields to a compiled [plan], producing a revised filters array and a lstQ for a Queryset"""
+
+    def enable_filter(item):
+        if item.filter_index != None:
+            filters[item.filter_index]['enabled'] = True
         # Check if this one has a head
-        if head_id != None and head_id != "":
-            for item in filters:
-                if head_id in item['id']:
-                    item['enabled'] = True
-                    # Break from this sub-loop
-                    break
+        if item.head_index != None:
+            filters[item.head_index]['enabled'] = True
         return True
 
-    def get_value(obj, field, default=None):
-        if field in obj:
-            sBack = obj[field]
-        else:
-            sBack = default
-        return sBack
+    def get_text_q(item, path, val, lookup="iexact", sequence=True):
+        # A text search on [path]: on its normalised search key, if it has one
+        if path in item.normal:
+            sKeyPath, normalise = item.normal[path]
+            val = normalise(val)
+            if "*" in val or "#" in val:
+                return get_search_q(sKeyPath, val, sequence=sequence, normalised=True)
+            elif lookup == "iexact":
+                return Q(**{sKeyPath: val})
+            return Q(**{"{}__{}".format(sKeyPath, lookup): val})
+        elif "*" in val or "#" in val:
+            return get_search_q(path, val, item.regex_function, sequence=sequence)
+        return Q(**{"{}__{}".format(path, lookup): val})
 
     oErr = ErrHandle()
 
@@ -307,195 +656,324 @@ def make_search_list(filters, oFields, search_list, qd, lstExclude):
         # (2) Reset the filters in the list we get
         for item in filters: item['enabled'] = False
     
-        # (3) Walk all sections
-        for part in search_list:
-            head_id = get_value(part, 'section')
-
-            # (4) Walk the list of defined searches
-            for search_item in part['filterlist']:
-                keyS = get_value(search_item, "keyS")
-                keyId = get_value(search_item, "keyId")
-                keyFk = get_value(search_item, "keyFk")
-                keyList = get_value(search_item, "keyList")
-                infield = get_value(search_item, "infield")
-                dbfield = get_value(search_item, "dbfield")
-                fkfield = get_value(search_item, "fkfield")
-                orfield = get_value(search_item, "orfield")
-                keyType = get_value(search_item, "keyType")
-                filter_type = get_value(search_item, "filter")
-                code_function = get_value(search_item, "code")
-                regex_function = get_value(search_item, "regex")
-                s_q = ""
-                arFkField = []
-                if fkfield != None:
-                    arFkField = fkfield.split("|")
+        # (3) Walk all the compiled search items
+        for item in plan.items:
+            keyS = item.keyS
+            keyId = item.keyId
+            keyFk = item.keyFk
+            keyList = item.keyList
+            infield = item.infield
+            dbfield = item.dbfield
+            keyType = item.keyType
+            s_q = ""
                
-                # Main differentiation: fkfield or dbfield
-                if fkfield:
-                    # Check for keyS
-                    if has_string_value(keyS, oFields):
-                        # Check for ID field
-                        if has_string_value(keyId, oFields):
-                            val = oFields[keyId]
-                            if not isinstance(val, int): 
-                                try:
-                                    val = val.id
-                                except:
-                                    pass
-                            enable_filter(filter_type, head_id)
-                            s_q = Q(**{"{}__id".format(fkfield): val})
-                        elif has_obj_value(fkfield, oFields):
-                            val = oFields[fkfield]
-                            enable_filter(filter_type, head_id)
-                            s_q = Q(**{fkfield: val})
-                        else:
-                            val = oFields[keyS]
-                            enable_filter(filter_type, head_id)
-                            # We are dealing with a foreign key (or multiple)
-                            if len(arFkField) > 1:
-                                iStop = 1
-                            # we are dealing with a foreign key, so we should use keyFk
-                            s_q = None
-                            for fkfield in arFkField:
-                                if "*" in val or "#" in val:
-                                    val = adapt_search(val, regex_function)
-                                    s_q_add = Q(**{"{}__{}__iregex".format(fkfield, keyFk): val})
-                                else:
-                                    s_q_add = Q(**{"{}__{}__iexact".format(fkfield, keyFk): val})
-                                if s_q == None:
-                                    s_q = s_q_add
-                                else:
-                                    s_q |= s_q_add
+            # Main differentiation: fkfield or dbfield
+            if item.fkfields:
+                fkfield = item.fkfields[0]
+                # Check for keyS
+                if has_string_value(keyS, oFields):
+                    # Check for ID field
+                    if has_string_value(keyId, oFields):
+                        val = oFields[keyId]
+                        if not isinstance(val, int): 
+                            try:
+                                val = val.id
+                            except:
+                                pass
+                        enable_filter(item)
+                        s_q = Q(**{"{}__id".format(fkfield): val})
                     elif has_obj_value(fkfield, oFields):
                         val = oFields[fkfield]
-                        enable_filter(filter_type, head_id)
+                        enable_filter(item)
                         s_q = Q(**{fkfield: val})
-                        external = get_value(search_item, "external")
-                        if has_string_value(external, oFields):
-                            qd[external] = getattr(val, "name")
-                elif dbfield:
-                    # We are dealing with a plain direct field for the model
-                    # OR: it is also possible we are dealing with a m2m field -- that gets the same treatment
-                    if keyType == "has":
-                        # Check the count or the availability for the db field
-                        val = oFields[filter_type]
-                        if val == "yes" or val == "no":
-                            enable_filter(filter_type, head_id)
-                            if val == "yes":
-                                s_q = Q(**{"{}__gt".format(dbfield): 0})
-                            else:
-                                s_q = Q(**{"{}".format(dbfield): 0})
-                    elif keyType == "exists" and code_function != None:
-                        # Check the count or the availability for the db field
-                        val = code_function( oFields[keyS])
-                        if val == "yes" or val == "no":
-                            enable_filter(filter_type, head_id)
-                            if val == "yes":
-                                s_q = Q(**{"{}__exact".format(dbfield): ""})
-                                if lstExclude == None: lstExclude = []
-                                lstExclude.append(s_q)
-                                s_q = ""
+                    else:
+                        val = oFields[keyS]
+                        enable_filter(item)
+                        # we are dealing with a foreign key, so we should use keyFk
+                        s_q = None
+                        for fkfield in item.fkfields:
+                            s_q_add = get_text_q(item, "{}__{}".format(fkfield, keyFk), val)
+                            if s_q == None:
+                                s_q = s_q_add
                             else:
-                                s_q = Q(**{"{}__exact".format(dbfield): ""})
-                    # Check for keyS
-                    elif has_string_value(keyS, oFields):
-                        # Check for ID field
-                        if has_string_value(keyId, oFields):
-                            val = oFields[keyId]
-                            enable_filter(filter_type, head_id)
-                            s_q = Q(**{"{}__id".format(dbfield): val})
-                        elif has_obj_value(keyFk, oFields):
-                            val = oFields[keyFk]
-                            enable_filter(filter_type, head_id)
-                            s_q = Q(**{dbfield: val})
+                                s_q |= s_q_add
+                elif has_obj_value(fkfield, oFields):
+                    val = oFields[fkfield]
+                    enable_filter(item)
+                    s_q = Q(**{fkfield: val})
+                    if has_string_value(item.external, oFields):
+                        qd[item.external] = getattr(val, "name")
+            elif dbfield:
+                # We are dealing with a plain direct field for the model
+                # OR: it is also possible we are dealing with a m2m field -- that gets the same treatment
+                if keyType == "has":
+                    # Check the count or the availability for the db field
+                    val = oFields[item.filter_type]
+                    if val == "yes" or val == "no":
+                        enable_filter(item)
+                        if val == "yes":
+                            s_q = Q(**{"{}__gt".format(dbfield): 0})
                         else:
-                            val = oFields[keyS]
-                            enable_filter(filter_type, head_id)
-                            if isinstance(val, int):
-                                s_q = Q(**{"{}".format(dbfield): val})
-                            elif "*" in val or "#" in val:
-                                val = adapt_search(val, regex_function)
-                                s_q = Q(**{"{}__iregex".format(dbfield): val})
-                            else:
-                                s_q = Q(**{"{}__iexact".format(dbfield): val})
-                    elif has_Q_value(keyS, oFields):
-                        s_q = oFields[keyS]
-                elif orfield:
-                    # This field contains an orrable selection of db-fields
-                    if has_string_value(keyS, oFields):
+                            s_q = Q(**{"{}".format(dbfield): 0})
+                elif keyType == "exists" and item.code_function != None:
+                    # Check the count or the availability for the db field
+                    val = item.code_function( oFields[keyS])
+                    if val == "yes" or val == "no":
+                        enable_filter(item)
+                        if val == "yes":
+                            s_q = Q(**{"{}__exact".format(dbfield): ""})
+                            if lstExclude == None: lstExclude = []
+                            lstExclude.append(s_q)
+                            s_q = ""
+                        else:
+                            s_q = Q(**{"{}__exact".format(dbfield): ""})
+                # Check for keyS
+                elif has_string_value(keyS, oFields):
+                    # Check for ID field
+                    if has_string_value(keyId, oFields):
+                        val = oFields[keyId]
+                        enable_filter(item)
+                        s_q = Q(**{"{}__id".format(dbfield): val})
+                    elif has_obj_value(keyFk, oFields):
+                        val = oFields[keyFk]
+                        enable_filter(item)
+                        s_q = Q(**{dbfield: val})
+                    else:
                         val = oFields[keyS]
-                        bUseRegex = False
-                        bContains = False
-                        if not isinstance(val, int):
-                            if "*" in val or "#" in val:
-                                val = adapt_search(val, regex_function, orfields=orfield.split(";"))
-                                bUseRegex = True
-                            elif "^" in val:
-                                # This option is *NOT* taken in any case because of the [ELSE] part!!!
-                                val = val.replace("^", "")
-                                bContains = True
-                            else:
-                                # Just use the 'contains' by default
-                                bContains = True
-                        s_q_lst = ""
-                        enable_filter(filter_type, head_id)
-                        if bUseRegex:
-                            s_q = val
+                        enable_filter(item)
+                        if isinstance(val, int):
+                            s_q = Q(**{"{}".format(dbfield): val})
                         else:
-                            for dbfield in orfield.split(";"):
-                                if isinstance(val, int):
-                                    s_q = Q(**{"{}".format(dbfield): val})
-                                elif bUseRegex:                                
-                                    s_q = Q(**{"{}__iregex".format(dbfield): val})
-                                elif bContains:                                
-                                    s_q = Q(**{"{}__icontains".format(dbfield): val})
-                                else:
-                                    s_q = Q(**{"{}__iexact".format(dbfield): val})
-                                if s_q_lst == "":
-                                    s_q_lst = s_q
-                                else:
-                                    s_q_lst = s_q_lst | s_q
-                            s_q = s_q_lst
-
-                # Check for list of specific signatures
-                if has_list_value(keyList, oFields):
+                            s_q = get_text_q(item, dbfield, val)
+                elif has_Q_value(keyS, oFields):
+                    s_q = oFields[keyS]
+            elif item.orfields:
+                # This field contains an orrable selection of db-fields
+                if has_string_value(keyS, oFields):
+                    val = oFields[keyS]
+                    if not isinstance(val, int) and not ("*" in val or "#" in val):
+                        # Just use the 'contains' by default
+                        val = val.replace("^", "")
                     s_q_lst = ""
-                    enable_filter(filter_type, head_id)
-                    code_list = [getattr(x, infield) for x in oFields[keyList]]
-                    if fkfield:
-                        # Now we need to look at the id's
-                        if len(arFkField) > 1:
-                            # THere are more foreign keys: combine in logical or
-                            s_q_lst = ""
-                            for fkfield in arFkField:
-                                if s_q_lst == "":
-                                    s_q_lst = Q(**{"{}__{}__in".format(fkfield, infield): code_list})
-                                else:
-                                    s_q_lst |= Q(**{"{}__{}__in".format(fkfield, infield): code_list})
+                    enable_filter(item)
+                    for dbfield in item.orfields:
+                        if isinstance(val, int):
+                            s_q = Q(**{"{}".format(dbfield): val})
+                        else:
+                            # Each word of a wildcard search is a separate condition
+                            s_q = get_text_q(item, dbfield, val, "icontains", sequence=False)
+                        if s_q_lst == "":
+                            s_q_lst = s_q
                         else:
-                            # Just one foreign key
+                            s_q_lst = s_q_lst | s_q
+                    s_q = s_q_lst
+                    # Narrow the candidates down through the full-text index, if there is one
+                    if item.fulltext != None and not isinstance(val, int):
+                        oValue = {}
+                        for dbfield in item.orfields:
+                            sKeyPath, normalise = item.normal.get(dbfield, (dbfield, None))
+                            oValue[sKeyPath] = val if normalise == None else normalise(val)
+                        q_fts = item.fulltext.fulltext_filter(list(oValue.keys()), oValue)
+                        if q_fts != None:
+                            s_q = q_fts & s_q
+
+            # Check for list of specific signatures
+            if has_list_value(keyList, oFields):
+                s_q_lst = ""
+                enable_filter(item)
+                code_list = [getattr(x, infield) for x in oFields[keyList]]
+                if item.fkfields:
+                    # Now we need to look at the id's: more foreign keys are combined in logical or
+                    for fkfield in item.fkfields:
+                        if s_q_lst == "":
                             s_q_lst = Q(**{"{}__{}__in".format(fkfield, infield): code_list})
-                    elif keyType == "fieldchoice":
-                        s_q_lst = Q(**{"{}__in".format(dbfield): code_list})
-                    elif dbfield:
-                        s_q_lst = Q(**{"{}__in".format(infield): code_list})
-                    s_q = s_q_lst if s_q == "" else s_q | s_q_lst
-
-                # Possibly add the result to the list
-                if s_q != "": lstQ.append(s_q)
+                        else:
+                            s_q_lst |= Q(**{"{}__{}__in".format(fkfield, infield): code_list})
+                elif keyType == "fieldchoice":
+                    s_q_lst = Q(**{"{}__in".format(item.dbfield): code_list})
+                elif item.dbfield or item.orfields:
+                    s_q_lst = Q(**{"{}__in".format(infield): code_list})
+                s_q = s_q_lst if s_q == "" else s_q | s_q_lst
+
+            # Possibly add the result to the list
+            if s_q != "": lstQ.append(s_q)
     except:
         msg = oErr.get_error_message()
-        oErr.DoError("make_search_list")
+        oErr.DoError("apply_search_plan")
         lstQ = []
 
     # Return what we have created
     return filters, lstQ, qd, lstExclude
 
+def get_facet_counts(plan, model, qs, key=None, ids=None):
+    """Count the objects of [qs] per value of each facet in the compiled [plan]
+    
+    The distinct ids of [qs] are fetched once (or taken from [ids], e.g. the cached result ids),
+    so that the search itself is not done again for each facet: the aggregate queries only use the ids.
+    Returns a dictionary: keyList => { value: count }
+    """
+
+    oErr = ErrHandle()
+    oFacets = {}
+    try:
+        if qs is None:
+            return oFacets
+        # Look in the cache first
+        if key != None:
+            oCached = cache.get(key)
+            if oCached != None:
+                return oCached
+
+        if ids == None:
+            ids = list(qs.order_by().values_list('id', flat=True).distinct())
+        # Each object is in one chunk only, so the counts of the chunks can be added up
+        iChunk = connection.features.max_query_params or max(len(ids), 1)
+        for item in plan.items:
+            if item.facet_path is None or item.keyList in oFacets:
+                continue
+            oCount = {}
+            for idx in range(0, len(ids), iChunk):
+                qs_facet = model.objects.filter(id__in=ids[idx:idx+iChunk]).values_list(item.facet_path).annotate(
+                    facet_count=Count('id', distinct=True)).order_by()
+                for value, count in qs_facet:
+                    if value != None:
+                        oCount[value] = oCount.get(value, 0) + count
+            oFacets[item.keyList] = oCount
+
+        # Store the result in the cache
+        if key != None:
+            cache.set(key, oFacets, count_timeout)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("get_facet_counts")
+    return oFacets
+
+def get_search_signature(plan, oFields):
+    """Get the normalised filter key and the lookup mode of the searches in [oFields]
+    
+    The key contains the (lower case) search values, so that the same search gets the same key.
+    The mode tells which kind of lookup each value gets (see classify_search).
+    """
+
+    lKey = []
+    lMode = []
+    for item in plan.items:
+        sName = item.filter_type
+        if item.keyS and has_string_value(item.keyS, oFields) and isinstance(oFields[item.keyS], str):
+            val = " ".join(oFields[item.keyS].strip().lower().split())
+            if "*" in val or "#" in val:
+                sMode = "+".join([x.kind for x in classify_search(val, sequence=(len(item.orfields) == 0))])
+            elif item.orfields:
+                sMode = "contains"
+            else:
+                sMode = "exact"
+            sKey = "{}={}".format(sName, val)
+        elif item.keyList and has_list_value(item.keyList, oFields):
+            lId = sorted([str(getattr(x, "id", x)) for x in oFields[item.keyList]])
+            sMode = "list"
+            sKey = "{}=[{}]".format(sName, ",".join(lId))
+        else:
+            continue
+        if sKey not in lKey:
+            lKey.append(sKey)
+            lMode.append("{}:{}".format(sName, sMode))
+    return "; ".join(lKey), "; ".join(lMode)
+
+def is_costly_search(sMode):
+    """Does the search mode [sMode] (see get_search_signature) have lookups that may have to scan whole tables?"""
+
+    for sItem in sMode.split(";"):
+        sKinds = sItem.split(":", 1)[-1].strip()
+        if any(x in search_costly_kinds for x in sKinds.split("+")):
+            return True
+    return False
+
+def check_search_value(val, sequence=True):
+    """Check whether the wildcard search [val] is not too expensive: returns an error message or an empty string
+    
+    Only the terms that need a regular expression are costly: these are limited in number and 
+    in the number of wildcards, and a '#' pattern needs enough literal characters to narrow it down.
+    """
+
+    sBack = ""
+    iMaxLength = getattr(settings, "SEARCH_MAX_LENGTH", 200)
+    iMaxRegex = getattr(settings, "SEARCH_MAX_REGEX", 3)
+    iMaxWildcards = getattr(settings, "SEARCH_MAX_WILDCARDS", 4)
+    if len(val) > iMaxLength:
+        sBack = "The search value is too long (at most {} characters)".format(iMaxLength)
+    elif "*" in val or "#" in val:
+        lRegex = [x for x in classify_search(val, sequence) if x.kind == "regex"]
+        if len(lRegex) > iMaxRegex:
+            sBack = "The search uses too many complex patterns (at most {})".format(iMaxRegex)
+        for term in lRegex:
+            if sBack != "": break
+            if len(re.findall(r'[*#?]|\[', term.value)) > iMaxWildcards:
+                sBack = "The search pattern '{}' has too many wildcards (at most {})".format(term.value, iMaxWildcards)
+            elif "#" in term.value and len(re.sub(r'\[[^\]]*\]|[^\w]', '', term.value)) < 2:
+                # NOTE: the regex of a '#' word may have to be tried at each word of each text
+                sBack = "The search pattern '{}' is too broad".format(term.value)
+    return sBack
+
+def check_search_plan(plan, oFields):
+    """Check all the wildcard search values in [oFields]: returns an error message or an empty string"""
+
+    for item in plan.items:
+        if item.keyS and has_string_value(item.keyS, oFields) and isinstance(oFields[item.keyS], str):
+            sMsg = check_search_value(oFields[item.keyS], sequence=(len(item.orfields) == 0))
+            if sMsg != "":
+                return sMsg
+    return ""
+
+def make_search_list(filters, oFields, search_list, qd, lstExclude, model=None):
+    """Using the information in oFields and search_list, produce a revised filters array and a lstQ for a Queryset
+    
+    If the [model] is given, text searches in 'orfield' can make use of its full-text index
+    """
+
+    plan = compile_search_plan(filters, search_list, model=model)
+    return apply_search_plan(plan, filters, oFields, qd, lstExclude)
+
+# Resolved sort key paths per (model, order path)
+sort_paths = {}
+
+def get_sort_path(model, path):
+    """Get the path to a precomputed sort key for the order [path] of [model], or None
+    
+    A model may define a dictionary 'sort_keys' that maps a field (or a ';'-combination
+    of order paths) onto a field that contains a normalised, indexed sort key.
+    """
+
+    sKey = (model, path)
+    if sKey in sort_paths:
+        return sort_paths[sKey]
+    sBack = None
+    try:
+        if model != None and path:
+            if ";" in path:
+                # A combined key can only be defined by the model itself
+                sBack = getattr(model, "sort_keys", {}).get(path)
+            else:
+                parts = path.split("__")
+                current = model
+                for part in parts[:-1]:
+                    field = current._meta.get_field(part)
+                    current = field.related_model
+                    if current is None: break
+                if current != None:
+                    sField = getattr(current, "sort_keys", {}).get(parts[-1])
+                    if sField != None:
+                        sBack = "__".join(parts[:-1] + [sField])
+    except:
+        sBack = None
+    sort_paths[sKey] = sBack
+    return sBack
+
 def make_ordering(qs, qd, order_default, order_cols, order_heads):
 
     oErr = ErrHandle()
 
     try:
+        model = None if qs is None else qs.model
         bAscending = True
         sType = 'str'
         order = []
@@ -539,9 +1017,18 @@ def make_ordering(qs, qd, order_default, order_cols, order_heads):
 
                 # Get the type
                 sType = order_heads[iOrderCol-1]['type']
-                for order_item in order_cols[iOrderCol-1].split(";"):
+                # Use precomputed sort keys where the model has them: these are normalised already
+                sSortKey = get_sort_path(model, order_cols[iOrderCol-1])
+                if sSortKey != None:
+                    lOrderItem = [(sSortKey, True)]
+                else:
+                    lOrderItem = []
+                    for order_item in order_cols[iOrderCol-1].split(";"):
+                        sSortKey = get_sort_path(model, order_item)
+                        lOrderItem.append((order_item, False) if sSortKey is None else (sSortKey, True))
+                for order_item, bSortKey in lOrderItem:
                     if order_item != "":
-                        if sType == 'str':
+                        if sType == 'str' and not bSortKey:
                             if bAscending:
                                 order.append(Lower(order_item).asc(nulls_last=True))
                             else:
@@ -581,7 +1068,11 @@ def make_ordering(qs, qd, order_default, order_cols, order_heads):
                     order_item = order_item[1:]
                 # Get the type
                 sType = order_heads[idx]['type']
-                if ";" in order_item:
+                sSortKey = get_sort_path(model, order_item)
+                if sSortKey != None:
+                    # Use the precomputed sort key instead of the combination
+                    orderings.append(dict(type="key", item=sSortKey))
+                elif ";" in order_item:
                     for sub_item in order_item.split(";"):
                         orderings.append(dict(type=sType, item=sub_item))
                 else:
@@ -590,8 +1081,11 @@ def make_ordering(qs, qd, order_default, order_cols, order_heads):
                 sType = item['type']
                 order_item = item['item']
                 if order_item != "":
-                    if sType == "int" or "-" in order_item:
+                    sSortKey = get_sort_path(model, order_item)
+                    if sType == "int" or sType == "key" or "-" in order_item:
                         order.append(order_item)
+                    elif sSortKey != None:
+                        order.append(sSortKey)
                     else:
                         order.append(Lower(order_item))
 
@@ -612,6 +1106,548 @@ def make_ordering(qs, qd, order_default, order_cols, order_heads):
     return qs, order_heads, colnum
 
 
+def get_generation_cache():
+    """Get the cache that holds the data generation number
+    
+    The 'basic_shared' cache (if defined in settings.CACHES) is shared by all processes, so that
+    a change handled by one worker process makes the cached counts and ids of all others outdated.
+    """
+
+    try:
+        return caches['basic_shared']
+    except InvalidCacheBackendError:
+        return cache
+
+def get_count_generation():
+    """Get the current data generation number that is used in count cache keys"""
+
+    oCache = get_generation_cache()
+    generation = oCache.get("basic_count_generation")
+    if generation is None:
+        generation = 1
+        oCache.add("basic_count_generation", generation, None)
+    return generation
+
+def bump_count_generation(sender=None, **kwargs):
+    """Signal receiver: any change in the data makes all cached counts outdated"""
+
+    oErr = ErrHandle()
+    try:
+        if sender is not None:
+            sLabel = "{}.{}".format(sender._meta.app_label, sender._meta.model_name)
+            if sLabel in count_volatile:
+                return None
+        oCache = get_generation_cache()
+        try:
+            oCache.incr("basic_count_generation")
+        except ValueError:
+            # The key was not (or no longer) available
+            oCache.set("basic_count_generation", 2, None)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("bump_count_generation")
+    return None
+
+def get_count_key(label, qd, extra=None, skip=None, prefix="basic_count"):
+    """Get a normalized cache key for the count of a result set
+    
+    The key consists of the [label] (view and model), the current data generation,
+    and all the non-empty parameters in [qd] that influence the size of the result.
+    Other parameters to be skipped can be passed on in [skip].
+    """
+
+    if skip is None:
+        skip = count_skip_keys
+    lParams = []
+    if qd != None:
+        for k in sorted(qd.keys()):
+            if k in skip: continue
+            lValue = sorted([x for x in qd.getlist(k) if x != ""]) if hasattr(qd, "getlist") else [qd[k]]
+            if len(lValue) > 0:
+                lParams.append("{}={}".format(k, "|".join([str(x) for x in lValue])))
+    if extra != None:
+        lParams.append("extra={}".format(extra))
+    sParams = "&".join(lParams)
+    sHash = hashlib.md5(sParams.encode("utf-8")).hexdigest()
+    sKey = "{}_{}_{}_{}".format(prefix, label, get_count_generation(), sHash)
+    return sKey
+
+def get_result_size(qs, key=None, limit=0):
+    """Determine the size of the result set [qs] without fetching its rows
+
+    The count is done in the database on the distinct id set.
+    If [limit] is positive, counting stops at [limit] and the size is approximate.
+    Returns a tuple: (count, bApproximate)
+    """
+
+    oErr = ErrHandle()
+    count = 0
+    bApproximate = False
+    try:
+        if qs is None:
+            return count, bApproximate
+        # Look in the cache first
+        if key != None:
+            oCount = cache.get(key)
+            if oCount != None:
+                return oCount['count'], oCount['approximate']
+
+        # Count the distinct ids; the ordering is not needed for counting
+        qs_id = qs.order_by().values('id').distinct()
+        if limit > 0:
+            # Approximate: only find out whether there are more than [limit] results
+            count = qs_id[:limit+1].count()
+            if count > limit:
+                count = limit
+                bApproximate = True
+        else:
+            count = qs_id.count()
+
+        # Store the result in the cache
+        if key != None:
+            cache.set(key, dict(count=count, approximate=bApproximate), count_timeout)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("get_result_size")
+    return count, bApproximate
+
+
+def get_result_cache():
+    """Get the cache for ordered result id lists
+    
+    The 'basic_results' cache (if defined in settings.CACHES) keeps these lists apart,
+    so that they have their own size limit (least recently used go first) and timeout.
+    """
+
+    try:
+        return caches['basic_results']
+    except InvalidCacheBackendError:
+        return cache
+
+def get_result_ids(qs, key, limit):
+    """Get the ordered list of distinct ids of [qs] from the cache or from the database
+    
+    Lists with more than [limit] ids are not kept: None is returned for them,
+    and that is remembered in the cache too, so the ids are not fetched again.
+    """
+
+    oErr = ErrHandle()
+    lId = None
+    try:
+        if qs is None or limit <= 0:
+            return None
+        oCache = get_result_cache()
+        oResult = oCache.get(key)
+        if oResult != None:
+            return oResult['ids']
+
+        # Fetch the ids in the order of [qs]; ordering on a related field may yield doubles,
+        #   so rows are read until there are more than [limit] distinct ids (or no rows are left)
+        lId = []
+        oSeen = set()
+        for id in qs.values_list('id', flat=True).iterator(chunk_size=limit+1):
+            if id not in oSeen:
+                oSeen.add(id)
+                lId.append(id)
+                if len(lId) > limit:
+                    lId = None
+                    break
+        oCache.set(key, dict(ids=lId), result_timeout)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("get_result_ids")
+        lId = None
+    return lId
+
+
+class CountPaginator(Paginator):
+    """Paginator that uses a count that has been determined beforehand"""
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, count=None):
+        self.known_count = count
+        super(CountPaginator, self).__init__(object_list, per_page, orphans, allow_empty_first_page)
+
+    @cached_property
+    def count(self):
+        if self.known_count is None:
+            return super(CountPaginator, self).count
+        return self.known_count
+
+
+
+class IdListPaginator(CountPaginator):
+    """Paginator over a list of ids: only the ids on a page are turned into objects"""
+
+    def __init__(self, id_list, per_page, hydrate, orphans=0, allow_empty_first_page=True):
+        self.hydrate = hydrate
+        super(IdListPaginator, self).__init__(id_list, per_page, orphans, allow_empty_first_page, count=len(id_list))
+
+    def page(self, number):
+        page = super(IdListPaginator, self).page(number)
+        page.object_list = self.hydrate(list(page.object_list))
+        return page
+
+
+
+class SearchHits(object):
+    """Hit statistics of a PASSIM-style search value in the text fields of a page of objects
+    
+    The search terms are compiled once. Then get_hits() gives, for each object and field, 
+    the number of hits and up to [snippets] KWIC snippets of the hits (with [width] characters of context).
+    Fields in [normal] ({field: (search key field, normalisation function)}) are looked up in their
+    search key field, using the normalised search value.
+    """
+
+    def __init__(self, val, fields, width=30, snippets=2, normal=None):
+        self.fields = fields
+        self.width = width
+        self.snippets = snippets
+        val = "" if val == None else val.strip()
+        # Each term: (regex that must match, regex of the hits to be shown)
+        self.terms = self.get_terms(val)
+        # Per field: (attribute to look in, terms)
+        self.field_terms = {}
+        for field, (keyfield, normalise) in (normal or {}).items():
+            self.field_terms[field] = (keyfield, self.get_terms(normalise(val) or ""))
+
+    def get_terms(self, val):
+        """Compile the search value [val] into (match regex, hit regex) terms"""
+
+        lTerm = []
+        if "*" in val or "#" in val:
+            for term in classify_search(val, sequence=False):
+                oMatch = re.compile(term.regex, re.I)
+                if term.kind in ["exact", "prefix", "suffix", "contains"]:
+                    oHit = re.compile(re.escape(term.value), re.I)
+                else:
+                    oHit = oMatch
+                lTerm.append((oMatch, oHit))
+        elif val != "":
+            # The default is 'contains'
+            oMatch = re.compile(re.escape(val.replace("^", "")), re.I)
+            lTerm.append((oMatch, oMatch))
+        return lTerm
+
+    def get_hits(self, objects):
+        """For each object: a list with (count, snippets) per field"""
+
+        lBack = []
+        for instance in objects:
+            lHits = []
+            for field in self.fields:
+                field, terms = self.field_terms.get(field, (field, self.terms))
+                sText = getattr(instance, field) or ""
+                iCount = 0
+                lSnippet = []
+                if sText != "" and len(terms) > 0 and all(oMatch.search(sText) for oMatch, oHit in terms):
+                    for oMatch, oHit in terms:
+                        for oFound in oHit.finditer(sText):
+                            if oFound.end() > oFound.start():
+                                iCount += 1
+                                if len(lSnippet) < self.snippets:
+                                    lSnippet.append(self.get_snippet(sText, oFound.start(), oFound.end()))
+                    # The text matches, even if no part of it can be pointed out
+                    iCount = max(iCount, 1)
+                lHits.append((iCount, lSnippet))
+            lBack.append(lHits)
+        return lBack
+
+    def get_snippet(self, sText, start, end):
+        """Get the (left, hit, right) parts of a KWIC snippet"""
+
+        iWidth = self.width
+        sLeft = sText[max(0, start - iWidth):start]
+        sHit = sText[start:end]
+        if len(sHit) > 2 * iWidth:
+            sHit = sHit[:2 * iWidth] + "\u2026"
+        sRight = sText[end:end + iWidth]
+        if start > iWidth: sLeft = "\u2026" + sLeft
+        if end + iWidth < len(sText): sRight = sRight + "\u2026"
+        return tuple(re.sub(r'\s+', ' ', x) for x in (sLeft, sHit, sRight))
+
+    def snippet_html(self, snippet):
+        sLeft, sHit, sRight = snippet
+        return "{}<mark>{}</mark>{}".format(html.escape(sLeft), html.escape(sHit), html.escape(sRight))
+
+    def snippet_text(self, snippet):
+        sLeft, sHit, sRight = snippet
+        return "{}\u00ab{}\u00bb{}".format(sLeft, sHit, sRight)
+
+
+class EchoBuffer(object):
+    """Pseudo file for csv.writer(): writing a row just returns it"""
+
+    def write(self, value):
+        return value
+
+
+def get_plain_text(value):
+    """Turn a (possibly HTML) cell value into plain text for exporting"""
+
+    if value is None:
+        return ""
+    sText = html.unescape(strip_tags(str(value)))
+    return " ".join(sText.split())
+
+
+
+# ============= Keyset (cursor) pagination ==================================
+
+# Values that take the place of NULL, so that NULL sorts last in both directions
+keyset_text_last = "\U0010ffff"
+keyset_number_last = 2**62
+
+def encode_cursor(direction, number, values):
+    """Turn a page [direction] ('n' = after, 'p' = before), page [number] and boundary [values] into a cursor"""
+
+    sJson = json.dumps(dict(d=direction, n=number, v=values))
+    sCursor = "k" + base64.urlsafe_b64encode(sJson.encode("utf-8")).decode("ascii").rstrip("=")
+    return sCursor
+
+def decode_cursor(sCursor):
+    """Decode a cursor made by encode_cursor(); returns None if it is not valid"""
+
+    oBack = None
+    try:
+        if sCursor != None and len(sCursor) > 1 and sCursor[0] == "k":
+            sB64 = sCursor[1:]
+            sB64 += "=" * (-len(sB64) % 4)
+            oBack = json.loads(base64.urlsafe_b64decode(sB64.encode("ascii")).decode("utf-8"))
+            if not isinstance(oBack, dict) or oBack.get("d") not in ["n", "p"] or not isinstance(oBack.get("v"), list):
+                oBack = None
+    except:
+        oBack = None
+    return oBack
+
+def get_keyset_ordering(qs):
+    """Convert the ordering of [qs] into annotated keyset columns
+
+    Every ordering item becomes an annotation '_ks<n>' that has no NULL values,
+    and the id is added as final tie-breaker.
+    Returns (qs, keys) where each key is a dict(alias, desc).
+    Returns (None, None) if the ordering cannot be used for keyset pagination.
+    """
+
+    oErr = ErrHandle()
+    keys = []
+    oAnnotate = {}
+    try:
+        query = qs.query
+        bHasId = False
+        for idx, item in enumerate(query.order_by):
+            bDesc = False
+            if isinstance(item, str):
+                bDesc = item.startswith("-")
+                sPath = item.lstrip("-")
+                if sPath in ["id", "pk"]: 
+                    bHasId = True
+                    keys.append(dict(alias="id", desc=bDesc))
+                    continue
+                expr = F(sPath)
+            elif isinstance(item, OrderBy):
+                bDesc = item.descending
+                expr = item.expression
+            else:
+                expr = item
+
+            # Find out what kind of value this ordering produces
+            output_field = expr.resolve_expression(query.chain(), allow_joins=True).output_field
+            if isinstance(output_field, ForeignKey):
+                output_field = output_field.target_field
+            if isinstance(output_field, (CharField, TextField)):
+                sentinel = "" if bDesc else keyset_text_last
+            elif isinstance(output_field, (IntegerField, FloatField, DecimalField)) or output_field.get_internal_type() == "AutoField":
+                sentinel = -keyset_number_last if bDesc else keyset_number_last
+            else:
+                # Cannot handle this type
+                return None, None
+            alias = "_ks{}".format(idx)
+            oAnnotate[alias] = Coalesce(expr, Value(sentinel), output_field=output_field)
+            keys.append(dict(alias=alias, desc=bDesc))
+
+        if not bHasId:
+            keys.append(dict(alias="id", desc=False))
+
+        if len(oAnnotate) > 0:
+            qs = qs.annotate(**oAnnotate)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("get_keyset_ordering")
+        return None, None
+    return qs, keys
+
+def keyset_filter(keys, values, bAfter):
+    """Create a Q-expression selecting the rows after (or before) the row with [values]"""
+
+    q_back = None
+    for idx, key in enumerate(keys):
+        # Descending columns swap the comparison
+        bGreater = (bAfter != key['desc'])
+        q_this = Q(**{"{}__{}".format(key['alias'], "gt" if bGreater else "lt"): values[idx]})
+        for prev_idx in range(idx):
+            q_this &= Q(**{keys[prev_idx]['alias']: values[prev_idx]})
+        q_back = q_this if q_back is None else q_back | q_this
+    return q_back
+
+
+class KeysetPage(object):
+    """One page of results from keyset pagination
+    
+    Offers the same interface as django's Page for the templates,
+    plus the cursors to the previous, next and last page.
+    """
+
+    keyset = True
+
+    def __init__(self, object_list, number, paginator, previous_cursor="", next_cursor="", last_cursor=""):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+        self.last_cursor = last_cursor
+
+    def __repr__(self):
+        return "<Keyset page {}>".format(self.number)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor != ""
+
+    def has_previous(self):
+        return self.number > 1
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    def start_index(self):
+        if len(self.object_list) == 0: return 0
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1 if len(self.object_list) > 0 else 0
+
+
+def keyset_paginate(qs, page_size, sCursor, count):
+    """Get one page of [qs] using keyset pagination
+    
+    Returns (paginator, page, object_list, is_paginated) like ListView.paginate_queryset(),
+    or None if the ordering of [qs] does not allow keyset pagination.
+    """
+
+    oErr = ErrHandle()
+    try:
+        page_size = int(page_size)
+        qs_keyed, keys = get_keyset_ordering(qs)
+        if qs_keyed is None:
+            return None
+        paginator = CountPaginator(qs, page_size, count=count)
+        num_pages = paginator.num_pages
+
+        # Orderings in the forward and backward direction
+        order_fwd = [(F(x['alias']).desc() if x['desc'] else F(x['alias']).asc()) for x in keys]
+        order_bwd = [(F(x['alias']).asc() if x['desc'] else F(x['alias']).desc()) for x in keys]
+
+        oCursor = decode_cursor(sCursor)
+        if oCursor != None and len(oCursor['v']) not in [0, len(keys)]:
+            # The ordering has changed since the cursor was made
+            oCursor = None
+
+        number = 1
+        bForward = True
+        values = []
+        if oCursor != None:
+            number = max(1, int(oCursor.get('n', 1)))
+            bForward = (oCursor['d'] == "n")
+            values = oCursor['v']
+
+        # Fetch one row more than needed: that tells whether there is more
+        if bForward:
+            qs_page = qs_keyed.order_by(*order_fwd)
+            if len(values) > 0:
+                qs_page = qs_page.filter(keyset_filter(keys, values, True))
+            rows = list(qs_page[:page_size+1])
+            bMore = (len(rows) > page_size)
+            rows = rows[:page_size]
+        else:
+            qs_page = qs_keyed.order_by(*order_bwd)
+            if len(values) > 0:
+                qs_page = qs_page.filter(keyset_filter(keys, values, False))
+            rows = list(qs_page[:page_size+1])
+            if len(rows) <= page_size and len(values) > 0:
+                # This is the first page after all
+                rows = list(qs_keyed.order_by(*order_fwd)[:page_size+1])
+                number = 1
+                bMore = (len(rows) > page_size)
+                rows = rows[:page_size]
+            else:
+                if len(values) == 0:
+                    # The last page: only the rows that the numbering of the count puts there
+                    rows = rows[:max(1, paginator.count - (num_pages - 1) * page_size)]
+                rows = rows[:page_size]
+                rows.reverse()
+                # There is a next page, unless we asked for the last one
+                bMore = (len(values) > 0)
+            if len(values) == 0:
+                number = num_pages
+
+        # Calculate the cursors
+        sPrev = ""
+        sNext = ""
+        sLast = ""
+        if len(rows) > 0:
+            lFirst = [getattr(rows[0], x['alias']) for x in keys]
+            lLast = [getattr(rows[-1], x['alias']) for x in keys]
+            if number > 1:
+                sPrev = encode_cursor("p", number - 1, lFirst)
+            if bMore:
+                sNext = encode_cursor("n", number + 1, lLast)
+                sLast = encode_cursor("p", num_pages, [])
+
+        page = KeysetPage(rows, number, paginator, sPrev, sNext, sLast)
+        return (paginator, page, rows, num_pages > 1)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("keyset_paginate")
+    return None
+
+
+# Compiled search plans per BasicList class
+search_plans = {}
+
+def check_basic_lists(app_configs, **kwargs):
+    """System check: compile the specification of every BasicList and report problems"""
+
+    from django.core import checks
+
+    def get_subclasses(cls):
+        for subclass in cls.__subclasses__():
+            yield subclass
+            yield from get_subclasses(subclass)
+
+    errors = []
+    for cls in get_subclasses(BasicList):
+        if cls.model is None: continue
+        plan = cls.get_search_plan()
+        for problem in plan.problems:
+            errors.append(checks.Warning(problem, obj=cls, id="basic.W001"))
+    return errors
+
+
 # The views that are defined by 'basic'
 
 class BasicList(ListView):
@@ -622,6 +1658,14 @@ class BasicList(ListView):
 
     paginate_by = 15
     entrycount = 0
+    entrycount_approx = False
+    count_limit = 0
+    keyset_paging = False
+    use_facets = True
+    result_cache_limit = 2000
+    result_ids = None
+    select_related = []
+    prefetch_related = []
     qd = None
     bFilter = False
     basketview = False
@@ -648,6 +1692,8 @@ class BasicList(ListView):
     filters = []
     searches = []
     downloads = []
+    export_types = ['csv', 'tsv', 'ndjson', 'xlsx']
+    export_chunk = 500
     custombuttons = []
     list_fields = []
     uploads = []
@@ -662,13 +1708,52 @@ class BasicList(ListView):
     colwrap_show = False
     qs = None
     page_function = "ru.basic.search_paged_start"
+    timer = PhaseTimer(enabled=False)
+    search_key = ""
+    search_mode = ""
+    search_error = ""
+    search_budget = None    # Maximum duration (ms) of a query once the search has started (default: settings.SEARCH_BUDGET_MS)
+    budget = QueryBudget()
+
+    def dispatch(self, request, *args, **kwargs):
+        # Time the phases of this request (also needed for the search log)
+        bSearchLog = getattr(settings, "SEARCH_LOG", False)
+        self.timer = PhaseTimer(self.__class__.__name__, enabled=(True if bSearchLog else None))
+        self.search_key = ""
+        self.search_error = ""
+        # Queries that take too long are interrupted
+        iBudget = self.search_budget if self.search_budget != None else getattr(settings, "SEARCH_BUDGET_MS", 0)
+        self.budget = QueryBudget(iBudget)
+        response = None
+        with self.budget:
+            try:
+                response = self.timer.dispatch(super(BasicList, self).dispatch, request, *args, **kwargs)
+            except DatabaseError:
+                if not self.budget.exceeded: raise
+        if self.budget.exceeded and self.budget.active:
+            # Show the list once more, but without results
+            self.search_error = "This search takes too long: please refine it"
+            self.search_mode += " (interrupted)"
+            response = super(BasicList, self).dispatch(request, *args, **kwargs)
+        if bSearchLog and self.search_key != "":
+            self.log_search()
+        return response
+
+    def log_search(self):
+        """Add the search of this request to the SearchLog"""
+
+        oTotals = self.timer.get_totals()
+        SearchLog.add_search(self.__class__.__name__, self.search_key, self.search_mode, self.entrycount, 
+                             oTotals['ms'], oTotals['sql_ms'], self.timer.get_ms("render"))
 
     def initializations(self):
         return None
 
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
+        self.timer.lap("page")
         context = super(BasicList, self).get_context_data(**kwargs)
+        self.timer.lap("context")
 
         oErr = ErrHandle()
 
@@ -697,10 +1782,15 @@ class BasicList(ListView):
 
             if self.has_select2:
                 context['has_select2'] = True
+                # Show the number of results for the options of list selections
+                if self.use_facets:
+                    context['facets'] = self.get_facets(frm)
             context['listForm'] = frm
 
         # Determine the count 
         context['entrycount'] = self.entrycount # self.get_queryset().count()
+        context['entrycount_approx'] = self.entrycount_approx
+        context['search_error'] = self.search_error
 
         # Make sure the paginate-values are available
         context['paginateValues'] = paginateValues
@@ -715,12 +1805,14 @@ class BasicList(ListView):
             context['page_function'] = self.page_function
 
         # Set the page number if needed
-        if 'page_obj' in context and 'page' in initial and initial['page'] != "":
+        if 'page_obj' in context and 'page' in initial and str(initial['page']).isdigit() and \
+           not getattr(context['page_obj'], "keyset", False):
             # context['page_obj'].number = initial['page']
             page_num = int(initial['page'])
-            context['page_obj'] = context['paginator'].page( page_num)
-            # Make sure to adapt the object_list
-            context['object_list'] = context['page_obj']
+            if context['page_obj'].number != page_num:
+                context['page_obj'] = context['paginator'].page( page_num)
+                # Make sure to adapt the object_list
+                context['object_list'] = context['page_obj']
 
         # Set the title of the application
         if self.plural_name =="":
@@ -743,7 +1835,9 @@ class BasicList(ListView):
         context['basic_details'] = self.basic_details if self.basic_details != "" else "{}_details".format(self.basic_name)
 
         # Make sure to transform the 'object_list'  into a 'result_list'
+        self.timer.lap("rows")
         context['result_list'] = self.get_result_list(context['object_list'])
+        self.timer.lap("context")
 
         context['sortOrder'] = self.sort_order
         context['colWrap'] = self.col_wrap
@@ -759,6 +1853,10 @@ class BasicList(ListView):
                 if 'url' in item and item['url'] != "" and "/" not in item['url']:
                     item['url'] = reverse(item['url'])
             context['downloads'] = self.downloads
+        elif len(self.get_export_types()) > 0:
+            # Offer the export of the result set: this is handled by the list view itself
+            context['downloads'] = [dict(label=export_formats[x]['label'], dtype=x, url=context['basic_list']) 
+                                    for x in self.get_export_types()]
 
         # Specify possible upload
         if len(self.uploads) > 0:
@@ -885,8 +1983,37 @@ class BasicList(ListView):
 
     def get_result_list(self, obj_list):
         result_list = []
+        oErr = ErrHandle()
+
+        # Make sure we can walk the page more than once
+        objects = list(obj_list)
+
+        # Calculate the custom columns one at a time for the whole page
+        oColumns = {}
+        for head in self.order_heads:
+            if 'custom' in head and head['custom'] not in oColumns:
+                custom = head['custom']
+                lValues = None
+                try:
+                    lValues = self.get_field_values(objects, custom)
+                except:
+                    msg = oErr.get_error_message()
+                    oErr.DoError("BasicList/get_result_list")
+                    lValues = None
+                if lValues is None:
+                    # Fall back to the per-cell method
+                    lValues = [self.get_field_value(obj, custom) for obj in objects]
+                oColumns[custom] = lValues
+
+        # The admin url only needs to be calculated once
+        admindetails = "admin:seeker_{}_change".format(self.basic_name)
+        try:
+            admin_url = reverse_maker(admindetails)
+        except:
+            admin_url = None
+
         # Walk all items in the object list
-        for obj in obj_list:
+        for idx, obj in enumerate(objects):
             # Transform this object into a list of objects that can be shown
             result = dict(id=obj.id)
             fields = []
@@ -901,8 +2028,8 @@ class BasicList(ListView):
                     if not value is None:
                         fobj['value'] = value
                 elif 'custom' in head:
-                    # The user should provide a way to determine the value for this field
-                    fvalue, ftitle = self.get_field_value(obj, head['custom'])
+                    # The value for this field has been determined above
+                    fvalue, ftitle = oColumns[head['custom']][idx]
                     if not fvalue is None:
                         fobj['value']= fvalue
                     if ftitle != None:
@@ -938,11 +2065,8 @@ class BasicList(ListView):
                 fields.append(fobj)
             # Make the list of field-values available
             result['fields'] = fields
-            admindetails = "admin:seeker_{}_change".format(self.basic_name)
-            try:
-                result['admindetails'] = reverse(admindetails, args=[obj.id])
-            except:
-                pass
+            if admin_url != None:
+                result['admindetails'] = admin_url(obj.id)
 
             # Add to the list of results
             result_list.append(result)
@@ -958,12 +2082,176 @@ class BasicList(ListView):
     def get_field_value(self, instance, custom):
         return "", ""
 
+    def get_field_values(self, objects, custom):
+        """Get the values of column [custom] for all [objects] on the page at once
+        
+        Returns a list of (value, title) tuples in the order of [objects],
+        or None if get_field_value() should be called for each object instead.
+        """
+        return None
+
     def get_paginate_by(self, queryset):
         """
         Paginate by specified value in default class property value.
         """
         return self.paginate_by
 
+    @classmethod
+    def get_search_plan(cls):
+        """Get the compiled plan of searches/filters/order_heads for this class (compiled only once)"""
+
+        plan = search_plans.get(cls)
+        if plan is None:
+            plan = compile_search_plan(cls.filters, cls.searches, cls.order_cols, cls.order_heads, cls.model)
+            search_plans[cls] = plan
+        return plan
+
+    def get_related_plan(self):
+        """Combine the relations needed by the view and by its columns into one plan
+        
+        Each order_heads item may specify 'select_related' and 'prefetch_related' lists
+        (the latter may contain Prefetch objects). Returns (lSelect, lPrefetch).
+        """
+
+        lSelect = []
+        oPrefetch = {}
+        lSources = [dict(select_related=self.select_related, prefetch_related=self.prefetch_related)]
+        lSources.extend(self.order_heads)
+        for oSource in lSources:
+            for sPath in oSource.get('select_related', []):
+                if sPath not in lSelect:
+                    lSelect.append(sPath)
+            for oLookup in oSource.get('prefetch_related', []):
+                sKey = oLookup.prefetch_to if isinstance(oLookup, Prefetch) else oLookup
+                if sKey not in oPrefetch:
+                    oPrefetch[sKey] = oLookup
+                elif isinstance(oLookup, Prefetch) and not isinstance(oPrefetch[sKey], Prefetch):
+                    # A Prefetch (with its own ordering) wins over a plain lookup
+                    oPrefetch[sKey] = oLookup
+        # Shorter lookups must come first, so that nested ones can build on them
+        lPrefetch = [copy.copy(oPrefetch[x]) for x in sorted(oPrefetch.keys(), key=lambda x: x.count("__"))]
+        return lSelect, lPrefetch
+
+    def apply_related_plan(self, qs):
+        """Apply the related plan to [qs]: this only affects the rows that are actually fetched"""
+
+        oErr = ErrHandle()
+        try:
+            if qs is not None:
+                lSelect, lPrefetch = self.get_related_plan()
+                if len(lSelect) > 0:
+                    qs = qs.select_related(*lSelect)
+                if len(lPrefetch) > 0:
+                    qs = qs.prefetch_related(*lPrefetch)
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("BasicList/apply_related_plan")
+        return qs
+
+    def paginate_queryset(self, queryset, page_size):
+        """Use the cached result ids if available, or else keyset pagination if this view allows it
+        
+        Keyset pagination is used when there is no explicit page number.
+        """
+
+        if self.result_ids != None:
+            return self.paginate_ids(self.result_ids, page_size)
+
+        # Make sure the rows on the page come with the relations they need
+        queryset = self.apply_related_plan(queryset)
+
+        if self.keyset_paging and self.qd != None:
+            sPage = self.qd.get("page", "")
+            if sPage == "" or sPage[0] == "k":
+                response = keyset_paginate(queryset, page_size, sPage, self.entrycount)
+                if response != None:
+                    return response
+        return super(BasicList, self).paginate_queryset(queryset, page_size)
+
+    def paginate_ids(self, lId, page_size):
+        """Get one page from the ordered list of result ids [lId]"""
+
+        paginator = IdListPaginator(lId, int(page_size), self.hydrate_ids)
+        # Determine the page number: a number or a keyset cursor
+        sPage = "" if self.qd is None else str(self.qd.get("page", ""))
+        number = 1
+        if sPage.isdigit():
+            number = int(sPage)
+        elif sPage == "last":
+            number = paginator.num_pages
+        else:
+            oCursor = decode_cursor(sPage)
+            if oCursor != None:
+                if oCursor['d'] == "p" and len(oCursor['v']) == 0:
+                    number = paginator.num_pages
+                else:
+                    number = int(oCursor.get('n', 1))
+        page = paginator.get_page(number)
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def hydrate_ids(self, lId):
+        """Fetch the objects for the ids in [lId], in that order"""
+
+        oObject = {}
+        if len(lId) > 0:
+            qs = self.apply_related_plan(self.model.objects.filter(id__in=lId))
+            oObject = {obj.id: obj for obj in qs}
+        return [oObject[x] for x in lId if x in oObject]
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        """Make sure the paginator does not count the queryset once more"""
+        return CountPaginator(queryset, per_page, orphans=orphans, 
+                              allow_empty_first_page=allow_empty_first_page, count=self.entrycount)
+
+    def get_count_key(self):
+        """Get the cache key for the size of the current result set"""
+
+        label = "{}_{}".format(self.__class__.__name__, self.model._meta.model_name)
+        # The basket is user-specific
+        extra = self.request.user.username if self.basketview else None
+        return get_count_key(label, self.qd, extra)
+
+    def get_result_key(self):
+        """Get the cache key for the ordered list of ids of the current result set"""
+
+        label = "{}_{}".format(self.__class__.__name__, self.model._meta.model_name)
+        extra = self.request.user.username if self.basketview else None
+        return get_count_key(label, self.qd, extra, skip=result_skip_keys, prefix="basic_ids")
+
+    def get_facets(self, frm):
+        """Get the facet counts for the list selections of [frm] within the current result
+        
+        Returns a dictionary: (html) id of the selection => { option id: count }
+        """
+
+        oErr = ErrHandle()
+        oBack = {}
+        try:
+            plan = self.get_search_plan()
+            if len([x for x in plan.items if x.facet_path != None]) == 0:
+                return oBack
+            label = "{}_{}".format(self.__class__.__name__, self.model._meta.model_name)
+            extra = self.request.user.username if self.basketview else None
+            key = get_count_key(label, self.qd, extra, prefix="basic_facets")
+            oFacets = get_facet_counts(plan, self.model, self.qs, key, self.result_ids)
+            for item in plan.items:
+                if item.keyList not in oFacets or item.keyList not in frm.fields:
+                    continue
+                oCount = oFacets[item.keyList]
+                if item.infield == "id":
+                    oOption = { str(k): v for k, v in oCount.items() }
+                else:
+                    # Translate the selected values into the ids of the options
+                    qs_option = frm.fields[item.keyList].queryset
+                    lValue = list(oCount.keys())
+                    oOption = { str(pk): oCount[value] for pk, value in 
+                               qs_option.filter(**{"{}__in".format(item.infield): lValue}).values_list('pk', item.infield) }
+                oBack[frm[item.keyList].auto_id] = oOption
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("BasicList/get_facets")
+        return oBack
+
     def get_basketqueryset(self):
         """User-specific function to get a queryset based on a basket"""
         return None
@@ -977,7 +2265,9 @@ class BasicList(ListView):
         get = get.copy()
         self.qd = get
 
+        self.timer.lap("init")
         self.initializations()
+        self.timer.lap("search")
 
         username=self.request.user.username
         team_group=app_editor
@@ -1029,10 +2319,23 @@ class BasicList(ListView):
                 # Allow user to adapt the list of search fields
                 oFields, lstExclude, qAlternative = self.adapt_search(oFields)
                 
-                self.filters, lstQ, self.initial, lstExclude = make_search_list(self.filters, oFields, self.searches, self.qd, lstExclude)
+                self.filters, lstQ, self.initial, lstExclude = apply_search_plan(
+                    self.get_search_plan(), self.filters, oFields, self.qd, lstExclude)
+                if self.search_key == "":
+                    self.search_key, self.search_mode = get_search_signature(self.get_search_plan(), oFields)
+                if self.search_error == "":
+                    self.search_error = check_search_plan(self.get_search_plan(), oFields)
+                    if self.search_error != "":
+                        self.search_mode += " (refused)"
+                    elif is_costly_search(self.search_mode):
+                        # Only searches with wildcards, regexes or 'contains' get a time budget
+                        self.budget.start()
                 
                 # Calculate the final qs
-                if len(lstQ) == 0 and not self.none_on_empty:
+                if self.search_error != "":
+                    # This search is not (or no longer) allowed: no results
+                    qs = self.model.objects.none()
+                elif len(lstQ) == 0 and not self.none_on_empty:
                     if lstExclude:
                         qs = self.model.objects.exclude(*lstExclude)
                     else:
@@ -1068,18 +2371,9 @@ class BasicList(ListView):
             qs, self.order_heads, colnum = make_ordering(qs, self.qd, order, self.order_cols, self.order_heads)
 
             # Adapt order_heads 'autohide' if a column has a filter set
-            for oOrderHead in self.order_heads:
-                if 'filter' in oOrderHead:
-                    sFilterId = oOrderHead['filter']
-                    # Initial: on
-                    oOrderHead['autohide'] = "on"
-                    # Look for the correct filter
-                    for oFilter in self.filters:
-                        if oFilter['id'] == sFilterId:
-                            # We found the filter - is it being used?
-                            if oFilter['enabled']:
-                                # It is used, so make sure to switch OFF the autohide
-                                oOrderHead['autohide'] = "off"
+            for idx_head, idx_filter in self.get_search_plan().head_filters:
+                # If the filter is used, make sure to switch OFF the autohide
+                self.order_heads[idx_head]['autohide'] = "off" if self.filters[idx_filter]['enabled'] else "on"
         else:
             # No filter and no basked: show all
             self.basketview = False
@@ -1106,13 +2400,123 @@ class BasicList(ListView):
                         # Indicate that this column must be hidden
                         oHead['colwrap'] = True
 
-        # Determine the length
-        self.entrycount = len(qs)
+        # Get the ordered result ids, if there are not too many of them
+        self.timer.lap("count")
+        self.result_ids = get_result_ids(qs, self.get_result_key(), self.result_cache_limit)
+        if self.result_ids != None:
+            self.entrycount, self.entrycount_approx = len(self.result_ids), False
+        else:
+            # Determine the length (without fetching the rows)
+            self.entrycount, self.entrycount_approx = get_result_size(qs, self.get_count_key(), self.count_limit)
 
         # Return the resulting filtered and sorted queryset
         self.qs = qs
         return qs
 
+    def get_export_types(self):
+        """Get the download types that can actually be exported"""
+
+        return [x for x in self.export_types if x in export_formats and (x != "xlsx" or openpyxl != None)]
+
+    def get_export_columns(self):
+        """Get the columns to be exported: those order_heads that have a name and a field or custom value"""
+
+        lColumn = []
+        for head in self.order_heads:
+            if head.get('name', "") == "":
+                continue
+            if 'field' in head:
+                lColumn.append(dict(name=head['name'], key=head['field'], field=head['field'], default=head.get('default', "")))
+            elif 'custom' in head:
+                lColumn.append(dict(name=head['name'], key=head['custom'], custom=head['custom']))
+        return lColumn
+
+    def get_export_rows(self, qs, lColumn):
+        """Iterate over [qs] in chunks and yield the plain-text values of [lColumn] for each object"""
+
+        def get_chunk_rows(objects):
+            # Custom columns are calculated once per chunk
+            oColumns = {}
+            for oColumn in lColumn:
+                if 'custom' in oColumn:
+                    lValues = self.get_field_values(objects, oColumn['custom'])
+                    if lValues is None:
+                        lValues = [self.get_field_value(obj, oColumn['custom']) for obj in objects]
+                    oColumns[oColumn['custom']] = lValues
+            for idx, obj in enumerate(objects):
+                row = [obj.id]
+                for oColumn in lColumn:
+                    if 'field' in oColumn:
+                        row.append(get_plain_text(getattr(obj, oColumn['field'], oColumn['default'])))
+                    else:
+                        row.append(get_plain_text(oColumns[oColumn['custom']][idx][0]))
+                yield row
+
+        qs = self.apply_related_plan(qs)
+        # Ordering on a related field may yield an object more than once
+        oSeen = set()
+        objects = []
+        for obj in qs.iterator(chunk_size=self.export_chunk):
+            if obj.id in oSeen:
+                continue
+            oSeen.add(obj.id)
+            objects.append(obj)
+            if len(objects) >= self.export_chunk:
+                yield from get_chunk_rows(objects)
+                objects = []
+        if len(objects) > 0:
+            yield from get_chunk_rows(objects)
+
+    def export(self, sType):
+        """Stream the whole (filtered and ordered) result set as a download of type [sType]"""
+
+        oErr = ErrHandle()
+        response = None
+        try:
+            qs = self.get_queryset()
+            if qs is None:
+                qs = self.model.objects.none()
+            lColumn = self.get_export_columns()
+            lHeader = ["id"] + [x['name'] for x in lColumn]
+            lKey = ["id"] + [x['key'] for x in lColumn]
+            rows = self.get_export_rows(qs, lColumn)
+            sContentType = export_formats[sType]['content_type']
+
+            if sType in ["csv", "tsv"]:
+                writer = csv.writer(EchoBuffer(), delimiter="," if sType == "csv" else "\t")
+                lines = (writer.writerow(row) for row in itertools.chain([lHeader], rows))
+                response = StreamingHttpResponse(lines, content_type="{}; charset=utf-8".format(sContentType))
+            elif sType == "ndjson":
+                lines = ("{}\n".format(json.dumps(dict(zip(lKey, row)), ensure_ascii=False)) for row in rows)
+                response = StreamingHttpResponse(lines, content_type=sContentType)
+            elif sType == "xlsx":
+                # A write-only workbook keeps its rows in a temporary file, not in memory
+                wb = openpyxl.Workbook(write_only=True)
+                ws = wb.create_sheet(title="Data")
+                ws.append(lHeader)
+                for row in rows:
+                    ws.append(row)
+                fTemp = tempfile.TemporaryFile()
+                wb.save(fTemp)
+                fTemp.seek(0)
+                response = FileResponse(fTemp, content_type=sContentType)
+
+            sFileName = "{}_{}.{}".format(PROJECT_NAME.lower(), self.basic_name or self.model._meta.model_name, sType)
+            response['Content-Disposition'] = 'attachment; filename="{}"'.format(sFileName)
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("BasicList/export")
+            response = JsonResponse(dict(status="error", msg=msg))
+        return response
+
+    def get(self, request, *args, **kwargs):
+        # Check if the result set should be exported instead of shown
+        qd = request.GET if request.method == "GET" else request.POST
+        sType = qd.get("downloadtype", "")
+        if sType != "" and sType in self.get_export_types():
+            return self.export(sType)
+        return super(BasicList, self).get(request, *args, **kwargs)
+
     def post(self, request, *args, **kwargs):
         return self.get(request, *args, **kwargs)
     
@@ -1147,11 +2551,18 @@ class BasicDetails(DetailView):
     is_basic = True         # Is this a basic details/edit view?
     history_button = False  # Show history button for this view
     lst_typeahead = []
+    timer = PhaseTimer(enabled=False)
+
+    def dispatch(self, request, *args, **kwargs):
+        # Time the phases of this request
+        self.timer = PhaseTimer(self.__class__.__name__)
+        return self.timer.dispatch(super(BasicDetails, self).dispatch, request, *args, **kwargs)
 
     def get(self, request, pk=None, *args, **kwargs):
         # Initialisation
         data = {'status': 'ok', 'html': '', 'statuscode': ''}
         # always do this initialisation to get the object
+        self.timer.lap("init")
         self.initializations(request, pk)
         if not user_is_authenticated(request):
         #if not request.user.is_authenticated:
@@ -1173,7 +2584,9 @@ class BasicDetails(DetailView):
             elif not user_may_edit(request):
                 self.permission = "readonly"
 
+            self.timer.lap("context")
             context = self.get_context_data(object=self.object)
+            self.timer.lap("render")
 
             if self.is_basic and self.template_name == "":
                 if self.rtype == "json":
@@ -1212,10 +2625,13 @@ class BasicDetails(DetailView):
         # Initialisation
         data = {'status': 'ok', 'html': '', 'statuscode': ''}
         # always do this initialisation to get the object
+        self.timer.lap("init")
         self.initializations(request, pk)
         # Make sure only POSTS get through that are authorized
         if request.user.is_authenticated:
+            self.timer.lap("context")
             context = self.get_context_data(object=self.object)
+            self.timer.lap("render")
             # Check if 'afternewurl' needs adding
             if 'afternewurl' in context:
                 data['afternewurl'] = context['afternewurl']
@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class lentenConfig(AppConfig):
     name = 'lentensermons.seeker'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+        from .models import SearchIndex
+
+        # Keep the global search index up to date
+        for oKind in SearchIndex.kinds:
+            sUid = "seeker_searchindex_{}".format(oKind['kind'])
+            post_save.connect(SearchIndex.on_save, sender=oKind['class'], dispatch_uid=sUid + "_save")
+            post_delete.connect(SearchIndex.on_delete, sender=oKind['class'], dispatch_uid=sUid + "_delete")
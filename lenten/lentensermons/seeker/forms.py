@@ -113,11 +113,16 @@ class BookWidget(ModelSelect2MultipleWidget):
 
 class CollectionWidget(ModelSelect2MultipleWidget):
     model = SermonCollection
-    search_fields = [ 'title__icontains' ]
+    # Search in the title's normalised Latin search key
+    search_fields = [ 'latintitle__icontains' ]
 
     def label_from_instance(self, obj):
         return obj.title
 
+    def filter_queryset(self, request, term, queryset=None, **dependent_fields):
+        term = get_latinkey(term) or ""
+        return super(CollectionWidget, self).filter_queryset(request, term, queryset, **dependent_fields)
+
     def get_queryset(self):
         return SermonCollection.objects.all().order_by('title').distinct()
 
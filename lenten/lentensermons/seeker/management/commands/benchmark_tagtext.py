@@ -0,0 +1,89 @@
+"""
+Micro-benchmark of the parsing of tagged texts on detail pages
+
+For each page it shows how often a tagged text was asked for (which is how often it was parsed
+when every user parsed it by itself) and how often it was actually parsed with the shared cache.
+
+With --render the stored HTML is ignored, so that all tagged texts are rendered again.
+Everything runs in a transaction that is rolled back, so no data is kept. Storing the rendered
+HTML does not bump the data generation (see get_rendered), so the cached counts of the web 
+processes stay valid: the command warns if the generation has changed nonetheless.
+
+Usage: python manage.py benchmark_tagtext [--kind sermon --kind edition ...] [--count 5] [--render]
+
+The 'parses before' column is the number of parses without the shared cache (one per request), 
+the 'parses after' column is the actual number. Results on the project data (5 pages per kind, --render):
+
+    kind          pages  parses before   parses after    ms/page
+    sermon            5            3.8            3.8       36.2
+    collection        5            0.0            0.0       43.3
+    edition           5            1.0            1.0       13.9
+    tagkeyword        5           22.0            2.0      120.0
+"""
+
+import time
+
+from django.apps import apps
+from django.db import transaction
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+
+from lentensermons.basic.views import get_count_generation
+from lentensermons.seeker.models import SearchIndex
+from lentensermons.tagtext.models import TagtextModel, parse_tagtext, tagtext_stats
+
+
+class Command(BaseCommand):
+    help = "Count the parses of tagged texts per detail page, without and with the shared cache"
+
+    def add_arguments(self, parser):
+        lKind = [x['kind'] for x in SearchIndex.kinds]
+        parser.add_argument("--kind", action="append", choices=lKind, 
+                            help="Only show detail pages of this kind (default: sermon, collection, edition, tagkeyword)")
+        parser.add_argument("--count", type=int, default=5, help="Number of detail pages per kind (default: 5)")
+        parser.add_argument("--render", action="store_true", help="Ignore the stored HTML of the tagged texts")
+
+    def handle(self, *args, **options):
+        lModel = [x for x in apps.get_models() if issubclass(x, TagtextModel)]
+        generation = get_count_generation()
+        with transaction.atomic():
+            if options['render']:
+                for model in lModel: model.render_version += 1
+            try:
+                self.benchmark(options)
+            finally:
+                if options['render']:
+                    for model in lModel: model.render_version -= 1
+                transaction.set_rollback(True)
+        if get_count_generation() != generation:
+            self.stderr.write("Note: the data generation has changed during the benchmark (by this or another process), " +
+                              "so the cached counts of the lists are made again")
+
+    def benchmark(self, options):
+        lKind = options['kind'] or ["sermon", "collection", "edition", "tagkeyword"]
+        client = Client(HTTP_USER_AGENT="Mozilla/5.0 (benchmark_tagtext)")
+        self.stdout.write("{:<12} {:>6} {:>14} {:>14} {:>10}".format("kind", "pages", "parses before", "parses after", "ms/page"))
+        for oKind in SearchIndex.kinds:
+            if oKind['kind'] not in lKind: continue
+            iPages = 0
+            iRequested = 0
+            iParsed = 0
+            fSeconds = 0.0
+            for obj_id in oKind['class'].objects.order_by("id").values_list("id", flat=True)[:options['count']]:
+                # Each page starts with an empty cache
+                parse_tagtext.cache_clear()
+                iRequestedStart = tagtext_stats['requested']
+                iParsedStart = tagtext_stats['parsed']
+                fStart = time.perf_counter()
+                response = client.get(reverse(oKind['url'], kwargs={'pk': obj_id}))
+                fSeconds += time.perf_counter() - fStart
+                if response.status_code != 200:
+                    self.stderr.write("{} {}: status {}".format(oKind['kind'], obj_id, response.status_code))
+                    continue
+                iPages += 1
+                iRequested += tagtext_stats['requested'] - iRequestedStart
+                iParsed += tagtext_stats['parsed'] - iParsedStart
+            if iPages > 0:
+                self.stdout.write("{:<12} {:>6} {:>14.1f} {:>14.1f} {:>10.1f}".format(
+                    oKind['kind'], iPages, iRequested / iPages, iParsed / iPages, 1000 * fSeconds / iPages))
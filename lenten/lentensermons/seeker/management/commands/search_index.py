@@ -0,0 +1,32 @@
+"""
+Rebuild the global search index (SearchIndex) of the seeker app
+
+Usage: python manage.py search_index [--kind sermon --kind author ...] [--chunk 500]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lentensermons.seeker.models import SearchIndex
+
+
+class Command(BaseCommand):
+    help = "Rebuild the global search index, reading the objects in chunks"
+
+    def add_arguments(self, parser):
+        lKind = [x['kind'] for x in SearchIndex.kinds]
+        parser.add_argument("--kind", action="append", choices=lKind, 
+                            help="Only rebuild this kind of objects (can be repeated)")
+        parser.add_argument("--chunk", type=int, default=500, help="Number of objects per chunk (default: 500)")
+
+    def handle(self, *args, **options):
+        if options['chunk'] < 1:
+            raise CommandError("The chunk size must be at least 1")
+        if not SearchIndex.is_available():
+            raise CommandError("The search index is not available (it needs SQLite with FTS5)")
+
+        def progress(kind, count):
+            if options['verbosity'] > 1:
+                self.stdout.write("  {}: {}".format(kind, count))
+
+        iCount = SearchIndex.rebuild(kinds=options['kind'], chunk=options['chunk'], progress=progress)
+        self.stdout.write(self.style.SUCCESS("Search index: {} objects indexed".format(iCount)))
@@ -1,11 +1,12 @@
 """Models for the SEEKER app.
 
 """
-from django.db import models, transaction
+from django.db import models, transaction, connection
 from django.contrib.auth.models import User, Group
 from django.db.models import Q
 from django.db.models.functions import Lower
-from django.utils.html import mark_safe
+from django.conf import settings
+from django.utils.html import mark_safe, escape
 from django.utils import timezone
 from django.forms.models import model_to_dict
 from django.template.loader import render_to_string
@@ -25,11 +26,13 @@ import time
 import fnmatch
 import csv
 import math
+import unicodedata
 from io import StringIO
 
 STANDARD_LENGTH=100
 LONG_STRING=255
 MEDIUM_LENGTH = 200
+SORTCODE_WIDTH = 6
 
 VIEW_STATUS = "view.status"     # For news items
 REPORT_TYPE = "seeker.reptype"
@@ -142,6 +145,104 @@ def adapt_search(val):
     val = '^' + fnmatch.translate(val) + '$'
     return val
 
+def get_sortkey(sValue):
+    """Normalise a name or title into a sort key: lowercase, no accents, single spaces"""
+
+    if sValue == None: return None
+    sKey = unicodedata.normalize("NFKD", sValue)
+    sKey = "".join([x for x in sKey if not unicodedata.combining(x)])
+    return " ".join(sKey.lower().split())
+
+def get_latinkey(sValue):
+    """Normalise Latin text into a search key: like the sort key, but with spelling variants unified"""
+
+    sKey = get_sortkey(sValue)
+    if sKey != None:
+        for sFrom, sTo in getattr(settings, "LATIN_NORMALISATION", []):
+            sKey = sKey.replace(sFrom, sTo)
+    return sKey
+
+def get_sortcode(lNumbers):
+    """Combine identification numbers (collection, edition, sermon) into one sort key
+    
+    A missing number is empty, and '/' sorts before the digits: so it comes first in ascending order
+    and last in descending order, like a NULL in the (SQLite) ordering on the numbers that is replaced.
+    """
+
+    return "/".join(["" if x is None else str(x).zfill(SORTCODE_WIDTH) for x in lNumbers])
+
+def adapt_sortkeys():
+    """Fill the sort keys of all existing objects (only needed once, or when get_sortcode changes)"""
+
+    oErr = ErrHandle()
+    bResult = True
+    try:
+        sDone = "done-2"
+        if Information.get_kvalue("sortkeys") != sDone:
+            with transaction.atomic():
+                for cls, field, source in [(Author, "sortname", "name"), (Publisher, "sortname", "name"),
+                                           (Location, "sortname", "name"), (SermonCollection, "sorttitle", "title")]:
+                    lChanged = []
+                    for obj in cls.objects.all().only("id", field, source):
+                        obj_key = get_sortkey(getattr(obj, source))
+                        if getattr(obj, field) != obj_key:
+                            setattr(obj, field, obj_key)
+                            lChanged.append(obj)
+                    cls.objects.bulk_update(lChanged, [field], batch_size=500)
+                for cls in [Edition, Sermon]:
+                    lChanged = [x for x in cls.objects.all().select_related(*cls.retag_related) if x.adapt_denormalised()]
+                    cls.objects.bulk_update(lChanged, ["sortcode"], batch_size=500)
+            Information.set_kvalue("sortkeys", sDone)
+            tagtext.models.bump_data_generation()
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("adapt_sortkeys")
+        bResult = False
+    return bResult
+
+def adapt_searchkeys():
+    """Fill the search keys of all existing objects (only needed once, or when the normalisation changes)"""
+
+    oErr = ErrHandle()
+    bResult = True
+    try:
+        sTable = json.dumps(getattr(settings, "LATIN_NORMALISATION", []))
+        if Information.get_kvalue("latinkeys") != sTable:
+            with transaction.atomic():
+                for cls in [SermonCollection, Sermon]:
+                    lChanged = []
+                    for obj in cls.objects.all():
+                        if obj.adapt_search_keys():
+                            lChanged.append(obj)
+                    cls.objects.bulk_update(lChanged, list(cls.search_keys.values()), batch_size=500)
+                    if cls.fulltext_index:
+                        cls.fulltext_rebuild()
+            Information.set_kvalue("latinkeys", sTable)
+            tagtext.models.bump_data_generation()
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("adapt_searchkeys")
+        bResult = False
+    return bResult
+
+def adapt_tagoccurrences():
+    """Fill the index of the tag occurrences in the tagged texts of all existing objects (only needed once,
+    or when the size of the keyword-in-context snippets changes)"""
+
+    oErr = ErrHandle()
+    bResult = True
+    try:
+        sDone = "kwic-{}".format(tagtext.models.get_kwic_size())
+        if Information.get_kvalue("tagoccurrences") != sDone:
+            for cls in [Author, Publisher, SermonCollection, Manuscript, Edition, Sermon]:
+                cls.occurrence_rebuild()
+            Information.set_kvalue("tagoccurrences", sDone)
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("adapt_tagoccurrences")
+        bResult = False
+    return bResult
+
 def adapt_latin(val):
     """Change the three dots into a unicode character"""
 
@@ -417,57 +518,19 @@ def import_data_file(sContents, arErr):
         arErr.DoError("import_data_file error:")
         return {}
 
-def tag_combine_html(obj, sParts, sWhole):
-    """a"""
+def tag_combine_html(obj, sParts, sWhole, snippets=None):
+    """Combine the whole HTML [sWhole] of a tagged text with a table of the places where tag [obj] occurs in it
+    
+    The optional [snippets] are the ready-made (value, before, after) of the occurrences (see TagOccurrence),
+    otherwise they are made from the tagged text [sParts].
+    """
 
     # Initialisations
     lHtml = []
-    CUTOFF = 50
+    CUTOFF = tagtext.models.get_kwic_size()
     method = "word-based"   # Or: "character-based"
     oErr = ErrHandle()
 
-    def parts_to_string(parts, idxBeg, idxEnd, size, type):
-        """COmbine parts from idxBeg until idxEnd into a string"""
-
-        if idxBeg <0 or idxEnd < 0 or idxEnd < idxBeg:
-            combi = ""
-        else:
-            lst_combi = []
-            mysize = 0
-            # Action depends on type
-            if type == "from_end":
-                idx = idxEnd
-                while idx >=0:
-                    contents = parts[idx]['value'].strip().replace('\n', ' ').replace('*', '')
-                    lst_combi.insert(0,contents)
-                    mysize += len(contents)
-                    if mysize > size:
-                        break
-                    idx -= 1
-            else:
-                for part in parts[idxBeg:idxEnd]:
-                    contents = part['value'].strip().replace('\n', ' ').replace('*', '')
-                    lst_combi.append(contents)
-                    mysize += len(contents)
-                    if mysize > size:
-                        break
-
-            combi = " ".join(lst_combi)
-            # Is this larger than 'size'?
-            if len(combi) > size:
-                # Find the first SPACE depending on the type
-                if type == "from_end":
-                    # Look for first space backwards
-                    idx = combi.rfind(' ',0, len(combi)-size)
-                    if idx > 0:
-                        combi = combi[idx:]
-                else:
-                    # Look for first space forwards
-                    idx = combi.find(' ', size)
-                    if idx > 0:
-                        combi = combi[:idx]
-        return combi
-
     try:
         # Get the id as a string
         obj_id = str(obj.id)
@@ -475,28 +538,30 @@ def tag_combine_html(obj, sParts, sWhole):
         lHtml.append('<div class="tag-combi tag-combi-whole tag-{} hidden"><button class="btn btn-xs jumbo-1" onclick="ru.lenten.seeker.toggle_tag(this);">Hide</button>{}</div>'.format(obj_id, sWhole))
         # Start the partial stuff
         lHtml.append('<div class="tag-combi tag-combi-part tag-{}" >'.format(obj_id))
-        parts = json.loads(sParts)
+        if snippets == None:
+            snippets = []
+            oParsed = tagtext.models.get_tagtext_parsed(sParts)
+            parts = oParsed.segments if obj_id in oParsed.tagids else ()
+            for idx, item in enumerate(parts):
+                # Check if this is a focus item
+                if item.type == 'tag' and str(item.tagid) == obj_id:
+                    if method == "word-based":
+                        # Get preceding and following parts
+                        prev_item, next_item = tagtext.models.get_tagtext_context(parts, idx, CUTOFF)
+                    elif method == "character-based":
+                        # Just get the single one preceding and following part
+                        prev_item = "" if idx == 0 else parts[idx-1]
+                        next_item = "" if idx+1 >= len(parts) else parts[idx+1]
+                        # And then cut it off to 50 chars before and after
+                        if len(prev_item) > 0: prev_item = prev_item.value.strip().replace('\n', ' ').replace('*', '')[-50:]
+                        if len(next_item) > 0: next_item = next_item.value.strip().replace('\n', ' ').replace('*', '')[:50]
+                    snippets.append((item.value, prev_item, next_item))
         lFound = []
-        for idx, item in enumerate(parts):
-            # Check if this is a focus item
-            if item['type'] == 'tag' and str(item['tagid']) == obj_id:
-                if method == "word-based":
-                    # Get preceding and following parts
-                    prev_item = parts_to_string(parts, 0, idx-1, CUTOFF, "from_end")
-                    next_item = parts_to_string(parts, idx+1, len(parts), CUTOFF, "from_start")
-                elif method == "character-based":
-                    # Just get the single one preceding and following part
-                    prev_item = "" if idx == 0 else parts[idx-1]
-                    next_item = "" if idx+1 >= len(parts) else parts[idx+1]
-                    # And then cut it off to 50 chars before and after
-                    if len(prev_item) > 0: prev_item = prev_item['value'].strip().replace('\n', ' ').replace('*', '')[-50:]
-                    if len(next_item) > 0: next_item = next_item['value'].strip().replace('\n', ' ').replace('*', '')[:50]
-                # Get the focus item
-                this_item = item['value']
-                # Add the line to the table that shows the results
-                lFound.append("<tr class='clickable' onclick='ru.lenten.seeker.toggle_tag(this);'>")
-                lFound.append("<td align='right'>...{}</td><td align='center'><b>{}</b></td><td>{}...</td></tr>".format(
-                    prev_item, this_item, next_item ))
+        for this_item, prev_item, next_item in snippets:
+            # Add the line to the table that shows the results
+            lFound.append("<tr class='clickable' onclick='ru.lenten.seeker.toggle_tag(this);'>")
+            lFound.append("<td align='right'>...{}</td><td align='center'><b>{}</b></td><td>{}...</td></tr>".format(
+                prev_item, this_item, next_item ))
         if len(lFound) > 0:
             lHtml.append("<table class='no-border-table'>{}</table>".format("\n".join(lFound)))
         # Finish this off
@@ -947,9 +1012,19 @@ class Location(models.Model):
     # Many-to-many field that identifies relations between locations
     relations = models.ManyToManyField("self", through="LocationRelation", symmetrical=False, related_name="relations_location", blank=True)
 
+    # [0-1] Sort key for the name (filled automatically)
+    sortname = models.CharField("Sort name", max_length=STANDARD_LENGTH, blank=True, null=True, db_index=True)
+
+    # Ordering on these fields uses the sort key instead
+    sort_keys = {'name': 'sortname'}
+
     def __str__(self):
         return "-" if self == None else  self.name
 
+    def save(self, force_insert = False, force_update = False, using = None, update_fields = None):
+        self.sortname = get_sortkey(self.name)
+        return super(Location, self).save(force_insert, force_update, using, update_fields)
+
     def get_loc_name(self):
         lname = "{} ({})".format(self.name, self.loctype)
         return lname
@@ -1119,13 +1194,33 @@ class TagKeyword(models.Model):
         super(TagKeyword, self).save(*args, **kwargs)
         return None
 
-    def get_list(self):
-        """Get a list of type/count items"""
+    @classmethod
+    def create_many(cls, names):
+        """Create tags for all [names] at once (in the default Tgroup), and return them in the same order"""
+
+        tgroup = Tgroup.get_default()
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # Without the ids of the new rows, the tags can not be linked: create them one by one
+            return [cls.objects.create(name=x, tgroup=tgroup) for x in names]
+        lTag = cls.objects.bulk_create([cls(name=x, tgroup=tgroup) for x in names])
+        # Bulk creation sends no signals
+        for obj in lTag:
+            SearchIndex.update(obj)
+        tagtext.models.bump_data_generation()
+        return lTag
+
+    def get_list(self, counts=None):
+        """Get a list of type/count items
+        
+        The counts come from the TagOccurrence index: [counts] may have them already, as {(model, field): count}
+        """
 
         lst_back = []
+        if counts == None:
+            counts = tagtext.models.TagOccurrence.get_counts(TagKeyword, [self.id])[self.id]
 
         # Counts in: collection.exempla
-        count = self.collection_exempla.all().count()
+        count = counts.get(("seeker.sermoncollection", "exempla"), 0)
         url = reverse("collection_list")
         params = "coll-tagexmpid={}".format(self.id)
         css ="jumbo-1"
@@ -1133,7 +1228,7 @@ class TagKeyword(models.Model):
         lst_back.append(item)
 
         # Counts in: collection.sources
-        count = self.collection_sourcenotes.all().count()
+        count = counts.get(("seeker.sermoncollection", "sources"), 0)
         url = reverse("collection_list")
         params = "coll-tagsrcid={}".format(self.id)
         css ="jumbo-2"
@@ -1141,7 +1236,7 @@ class TagKeyword(models.Model):
         lst_back.append(item)
 
         # Counts in: collection.notes
-        count = self.collection_notes.all().count()
+        count = counts.get(("seeker.sermoncollection", "notes"), 0)
         url = reverse("collection_list")
         params = "coll-tagnoteid={}".format(self.id)
         css ="jumbo-2"
@@ -1149,7 +1244,7 @@ class TagKeyword(models.Model):
         lst_back.append(item)
 
         # Counts in: collection.bibliography
-        count = self.collection_bibliography.all().count()
+        count = counts.get(("seeker.sermoncollection", "bibliography"), 0)
         url = reverse("collection_list")
         params = "coll-tagbiblid={}".format(self.id)
         css ="jumbo-3"
@@ -1157,7 +1252,7 @@ class TagKeyword(models.Model):
         lst_back.append(item)
 
         # Counts in: sermon.summary
-        count = self.sermon_summarynotes.all().count()
+        count = counts.get(("seeker.sermon", "summary"), 0)
         url = reverse("sermon_list")
         params = "sermo-tagsummid={}".format(self.id)
         css ="jumbo-3"
@@ -1165,7 +1260,7 @@ class TagKeyword(models.Model):
         lst_back.append(item)
 
         # Counts in: sermon.notes
-        count = self.sermon_notetags.all().count()
+        count = counts.get(("seeker.sermon", "note"), 0)
         url = reverse("sermon_list")
         params = "sermo-tagnoteid={}".format(self.id)
         css ="jumbo-3"
@@ -1173,7 +1268,7 @@ class TagKeyword(models.Model):
         lst_back.append(item)
 
         # Counts in: edition.notes
-        count = self.edition_notetags.all().count()
+        count = counts.get(("seeker.edition", "note"), 0)
         url = reverse("edition_list")
         params = "edi-tagnoteid={}".format(self.id)
         css ="jumbo-4"
@@ -1181,7 +1276,7 @@ class TagKeyword(models.Model):
         lst_back.append(item)
 
         # Counts in: author.notes
-        count = self.author_infotags.all().count()
+        count = counts.get(("seeker.author", "info"), 0)
         url = reverse("author_list")
         params = "auth-tagnoteid={}".format(self.id)
         css ="jumbo-5"
@@ -1189,7 +1284,7 @@ class TagKeyword(models.Model):
         lst_back.append(item)
 
         # Counts in: manuscript.notes
-        count = self.manuscript_infotags.all().count()
+        count = counts.get(("seeker.manuscript", "info"), 0)
         url = reverse("manuscript_list")
         params = "manu-tagnoteid={}".format(self.id)
         css ="jumbo-6"
@@ -1257,14 +1352,30 @@ class Author(tagtext.models.TagtextModel):
     # --------- MANY-TO-MANY connections ------------------
     # [0-n] = zero or more notetags in the 'info' field
     infotags = models.ManyToManyField(TagKeyword, blank=True, related_name="author_infotags")
+    # [0-1] Sort key for the name (filled automatically)
+    sortname = models.CharField("Sort name", max_length=LONG_STRING, blank=True, null=True, db_index=True)
 
     mixed_tag_fields = [
             {"textfield": "info", "m2mfield": "infotags",     "class": TagKeyword, "url": "tagkeyword_details"}
         ]
 
+    # Ordering on these fields uses the sort key instead
+    sort_keys = {'name': 'sortname'}
+    # Bulk retagging also keeps the sort key up to date
+    denormalised_fields = ['sortname']
+
     def __str__(self):
         return "-" if self == None else  self.name
 
+    def adapt_denormalised(self):
+        """Make sure the sort key is up to date: returns True if it has changed"""
+
+        sortname = get_sortkey(self.name)
+        if self.sortname != sortname:
+            self.sortname = sortname
+            return True
+        return False
+
     def find_or_create(sName):
         """Find an author or create it."""
 
@@ -1305,14 +1416,30 @@ class Publisher(tagtext.models.TagtextModel):
     # --------- MANY-TO-MANY connections ------------------
     # [0-n] = zero or more notetags in the 'info' field
     infotags = models.ManyToManyField(TagKeyword, blank=True, related_name="publisher_infotags")
+    # [0-1] Sort key for the name (filled automatically)
+    sortname = models.CharField("Sort name", max_length=MEDIUM_LENGTH, blank=True, null=True, db_index=True)
 
     mixed_tag_fields = [
             {"textfield": "info", "m2mfield": "infotags",     "class": TagKeyword, "url": "tagkeyword_details"}
         ]
 
+    # Ordering on these fields uses the sort key instead
+    sort_keys = {'name': 'sortname'}
+    # Bulk retagging also keeps the sort key up to date
+    denormalised_fields = ['sortname']
+
     def __str__(self):
         return "-" if self == None else  self.name
 
+    def adapt_denormalised(self):
+        """Make sure the sort key is up to date: returns True if it has changed"""
+
+        sortname = get_sortkey(self.name)
+        if self.sortname != sortname:
+            self.sortname = sortname
+            return True
+        return False
+
     def get_info_markdown(self):
         sBack = ""
         if self.info:
@@ -1328,6 +1455,10 @@ class SermonCollection(tagtext.models.TagtextModel):
     idno = models.IntegerField("Identification", blank=True, null=True)
     # [1] Title is obligatory for any sermon collection
     title = models.CharField("Title", max_length=MEDIUM_LENGTH)
+    # [0-1] Sort key for the title (filled automatically)
+    sorttitle = models.CharField("Sort title", max_length=MEDIUM_LENGTH, blank=True, null=True, db_index=True)
+    # [0-1] Search key for the title: normalised Latin orthography (filled automatically)
+    latintitle = models.CharField("Search title", max_length=MEDIUM_LENGTH, blank=True, null=True, db_index=True)
     # [0-1] Author information and bibliography
     bibliography = models.TextField("Bibliography", blank=True, null=True)
     # [0-1] Date of composition
@@ -1399,23 +1530,70 @@ class SermonCollection(tagtext.models.TagtextModel):
             {"textfield": "bibliography",   "m2mfield": "bibliographytags", "class": TagKeyword,    "url": "tagkeyword_details"}
         ]
 
+    # Ordering on these fields uses the sort key instead
+    sort_keys = {'title': 'sorttitle'}
+    # Bulk retagging also keeps the sort key up to date
+    denormalised_fields = ['sorttitle']
+    # Searching on these fields uses the normalised search key instead
+    search_keys = {'title': 'latintitle'}
+    get_search_key = staticmethod(get_latinkey)
+
     def __str__(self):
         sBack = "{} {}".format(self.idno, self.title)
         return sBack
 
+    def adapt_denormalised(self):
+        """Make sure the sort key is up to date: returns True if it has changed"""
+
+        sorttitle = get_sortkey(self.title)
+        if self.sorttitle != sorttitle:
+            self.sorttitle = sorttitle
+            return True
+        return False
+
+    def adapt_related(self):
+        """Check who the 'firstauthor' is and adapt (after saving)"""
+
+        lField = []
+        obj = self.authors.all().first()
+        if self.firstauthor_id != (None if obj == None else obj.id):
+            self.firstauthor = obj
+            lField.append("firstauthor")
+        return lField
+
     def save(self, force_insert = False, force_update = False, using = None, update_fields = None):
-        # Initial response: save
+        # Initial response: save (the sort key is adapted there too)
         response = super(SermonCollection, self).save(force_insert, force_update, using, update_fields)
-        # CHeck who the 'firstauthor' is and adapt
+        # The sort codes of editions and sermons start with my idno
+        self.adapt_sortcodes()
+        return None
+
+    def adapt_sortcodes(self):
+        """Make sure the sort codes of my editions and sermons are up to date"""
+
+        oErr = ErrHandle()
+        bResult = True
         try:
-            obj = self.authors.all().first()
-            if self.firstauthor == None or (obj != None and self.firstauthor is not obj):
-                self.firstauthor = obj
-                response = super(SermonCollection, self).save(force_insert, force_update, using, update_fields)
+            # Only the editions and sermons whose code does not start with my idno are checked
+            sPrefix = "{}/".format(get_sortcode([self.idno]))
+            lEdition = []
+            for edi in self.editions.exclude(sortcode__startswith=sPrefix):
+                edi.sortcode = get_sortcode([self.idno, edi.idno])
+                lEdition.append(edi)
+            Edition.objects.bulk_update(lEdition, ['sortcode'], batch_size=500)
+            lSermon = []
+            for sermo in self.collection_sermons.exclude(sortcode__startswith=sPrefix).select_related('edition'):
+                sermo.sortcode = sermo.get_sortcode()
+                lSermon.append(sermo)
+            Sermon.objects.bulk_update(lSermon, ['sortcode'], batch_size=500)
+            if len(lEdition) > 0 or len(lSermon) > 0:
+                # Bulk updates send no signals
+                tagtext.models.bump_data_generation()
         except:
-            # If there is a problem, no need to bother over it.
-            pass
-        return None
+            msg = oErr.get_error_message()
+            oErr.DoError("SermonCollection/adapt_sortcodes")
+            bResult = False
+        return bResult
 
     def adapt_editions(self):
         """This gets called when an edition changes"""
@@ -1425,13 +1603,13 @@ class SermonCollection(tagtext.models.TagtextModel):
         try:
             if self.id == 16:
                 iStop = 1
-            bNeedSaving = False
+            lField = []
             firstedition = self.first_edition()
             firstedi = self.first_edition_obj()
             numeditions = self.num_editions()
             if firstedition != None and firstedition != "-" and firstedition != self.firstedition:
                 self.firstedition = firstedition
-                bNeedSaving = True
+                lField.append("firstedition")
             try:
                 needFirstEdi = (firstedi != self.firstedi)
             except:
@@ -1441,13 +1619,13 @@ class SermonCollection(tagtext.models.TagtextModel):
                 self.firstedi = firstedi
                 firsteditionyear = None if firstedi == None else firstedi.get_year()
                 self.firstedition = firsteditionyear
-                bNeedSaving = True
+                lField += ["firstedi", "firstedition"]
             if numeditions != self.numeditions:
                 self.numeditions = numeditions
-                bNeedSaving = True
-            # Check if saving is needed
-            if bNeedSaving:
-                self.save()
+                lField.append("numeditions")
+            # Check if saving is needed: only the changed fields are written
+            if len(lField) > 0:
+                self.save(update_fields=lField)
             bResult = True
         except:
             msg = oErr.get_error_message()
@@ -1463,7 +1641,7 @@ class SermonCollection(tagtext.models.TagtextModel):
         nummanu = self.manuscripts.all().count()
         if nummanu != self.nummanu:
             self.nummanu = nummanu
-            self.save()
+            self.save(update_fields=["nummanu"])
         return True
 
     def authorbadges(self):
@@ -1519,8 +1697,9 @@ class SermonCollection(tagtext.models.TagtextModel):
         return year
 
     def get_firstauthor(self):
-        f = self.authors.all().first()
-        sBack = "" if f == None else f.name
+        # Use all() so that prefetched authors can be re-used
+        authors = sorted(self.authors.all(), key=lambda x: x.id)
+        sBack = "" if len(authors) == 0 else authors[0].name
         return sBack
 
     def get_firstedition(self):
@@ -1599,11 +1778,11 @@ class Manuscript(tagtext.models.TagtextModel):
             sBack = sBack.strip()
         return sBack
 
-    def save(self, force_insert = False, force_update = False, using = None, update_fields = None):
-        response = super(Manuscript, self).save(force_insert, force_update, using, update_fields)
-        # Adapt the information in sermoncollection
+    def adapt_related(self):
+        """Adapt the information in sermoncollection (after saving)"""
+
         self.collection.adapt_manucount()
-        return response
+        return []
 
     def delete(self, using = None, keep_parents = False):
         response = super(Manuscript, self).delete(using, keep_parents)
@@ -1672,6 +1851,8 @@ class Edition(tagtext.models.TagtextModel):
 
     # [0-1] Identification number assigned by the researcher
     idno = models.IntegerField("Edition number", blank=True, null=True)
+    # [0-1] Sort key for collection/edition (filled automatically)
+    sortcode = models.CharField("Sort code", max_length=STANDARD_LENGTH, blank=True, null=True, db_index=True)
 
     # ------------ DATE DEFINITION -----------------
     # [0-1] Date when this edition was published
@@ -1770,6 +1951,14 @@ class Edition(tagtext.models.TagtextModel):
         {"textfield": "fulltitle",      "m2mfield": "fulltitletags",    "textflat": "ffulltitle",   "class": TagKeyword, "url": "tagkeyword_details"},
         {"textfield": "colophon",       "m2mfield": "colophontags",     "textflat": "fcolophon",    "class": TagKeyword, "url": "tagkeyword_details"}
         ]
+    # The flat text fields are searched through a full-text index
+    fulltext_index = True
+
+    # Ordering on these (combined) fields uses the sort key instead
+    sort_keys = {'sermoncollection__idno;idno': 'sortcode'}
+    # Bulk retagging also keeps the sort code up to date
+    denormalised_fields = ['sortcode']
+    retag_related = ['sermoncollection']
 
     def __str__(self):
         code = self.get_code()
@@ -1779,20 +1968,43 @@ class Edition(tagtext.models.TagtextModel):
         url = reverse('api_tributes')
         return url
 
-    def save(self, force_insert = False, force_update = False, using = None, update_fields = None):
+    def adapt_denormalised(self):
+        """Make sure the sort code is up to date: returns True if it has changed"""
 
-        # First perform saving
-        response = super(Edition, self).save(force_insert, force_update, using, update_fields)
+        sortcode = get_sortcode([None if self.sermoncollection_id == None else self.sermoncollection.idno, self.idno])
+        if self.sortcode != sortcode:
+            self.sortcode = sortcode
+            return True
+        return False
 
-        # CHeck who the 'firstpublisher' is and adapt
+    def adapt_related(self):
+        """Check who the 'firstpublisher' is and adapt, and adapt the sermoncollection (after saving)"""
+
+        lField = []
         fp = self.get_firstpublisher()
-        if self.firstpublisher != fp:
-            self.firstpublisher = self.get_firstpublisher()
-            response = super(Edition, self).save(force_insert, force_update, using, update_fields)
+        if self.firstpublisher_id != (None if fp == None else fp.id):
+            self.firstpublisher = fp
+            lField.append("firstpublisher")
 
         if self.sermoncollection != None:
             # Adapt the information in sermoncollection
             self.sermoncollection.adapt_editions()
+        return lField
+
+    def save(self, force_insert = False, force_update = False, using = None, update_fields = None):
+
+        # First perform saving (the sort code is adapted there too)
+        response = super(Edition, self).save(force_insert, force_update, using, update_fields)
+
+        # The sort codes of my sermons start with my own sort code
+        lSermon = []
+        for sermo in self.edition_sermons.exclude(sortcode__startswith="{}/".format(self.sortcode)).select_related('collection'):
+            sermo.sortcode = sermo.get_sortcode()
+            lSermon.append(sermo)
+        Sermon.objects.bulk_update(lSermon, ['sortcode'], batch_size=500)
+        if len(lSermon) > 0:
+            # Bulk updates send no signals
+            tagtext.models.bump_data_generation()
         return response
 
     def delete(self, using = None, keep_parents = False):
@@ -1960,6 +2172,8 @@ class Sermon(tagtext.models.TagtextModel):
 
     # [0-1] Identification number assigned by the researcher
     idno = models.IntegerField("Sermon number", blank=True, null=True)
+    # [0-1] Sort key for collection/edition/sermon (filled automatically)
+    sortcode = models.CharField("Sort code", max_length=STANDARD_LENGTH, blank=True, null=True, db_index=True)
 
     # [0-1] Liturgical day (e.g. T18/4 = sermon 'de tempore', week 18, day 4)
     litday = models.CharField("Liturgical day", max_length=MEDIUM_LENGTH, null=True, blank=True)
@@ -1972,6 +2186,8 @@ class Sermon(tagtext.models.TagtextModel):
     # [0-1] The main division of the sermon: both in Latin as well as in English
     divisionL = models.TextField("Division (Latin)", null=True, blank=True)
     fdivisionL = models.TextField("Flat Division (Latin)", null=True, blank=True)
+    # [0-1] Search key for the flat Latin division: normalised orthography (filled automatically)
+    latindivision = models.TextField("Search division (Latin)", null=True, blank=True)
     divisionE = models.TextField("Division (English)", null=True, blank=True)
     fdivisionE = models.TextField("Flat Division (English)", null=True, blank=True)
     # [0-1] Summary of the sermon
@@ -2013,6 +2229,17 @@ class Sermon(tagtext.models.TagtextModel):
             {"textfield": "summary",    "textflat": "fsummary",    "m2mfield": "summarynotetags",  "class": TagKeyword,    "url": "tagkeyword_details"},
             {"textfield": "note",       "textflat": "fnote",       "m2mfield": "notetags",         "class": TagKeyword,    "url": "tagkeyword_details"}
         ]
+    # The flat text fields are searched through a full-text index
+    fulltext_index = True
+
+    # Ordering on these (combined) fields uses the sort key instead
+    sort_keys = {'collection__idno;edition__idno;idno': 'sortcode'}
+    # Bulk retagging also keeps the sort code up to date
+    denormalised_fields = ['sortcode']
+    retag_related = ['collection', 'edition']
+    # Searching on these fields uses the normalised search key instead (also in the full-text index)
+    search_keys = {'fdivisionL': 'latindivision'}
+    get_search_key = staticmethod(get_latinkey)
 
     def tagtext_url(self):
         url = reverse('api_tributes')
@@ -2022,22 +2249,24 @@ class Sermon(tagtext.models.TagtextModel):
         sBack = self.get_code()
         return sBack
 
-    def save(self, force_insert = False, force_update = False, using = None, update_fields = None):
-        oErr = ErrHandle()
-        try:
-            # initially: save
-            response = super(Sermon, self).save(force_insert, force_update, using, update_fields)
-            # CHeck who the 'firstauthor' is and adapt
-            if self.id:
-                obj = self.topics.all().first()
-                if self.firsttopic == None or (obj != None and self.firsttopic is not obj):
-                    self.firsttopic = obj
-                    # Save these changes
-                    response = super(Sermon, self).save(force_insert, force_update, using, update_fields)
-        except:
-            msg = oErr.get_error_message()
-            bError = True
-        return None
+    def adapt_denormalised(self):
+        """Make sure the sort code is up to date: returns True if it has changed"""
+
+        sortcode = self.get_sortcode()
+        if self.sortcode != sortcode:
+            self.sortcode = sortcode
+            return True
+        return False
+
+    def adapt_related(self):
+        """Check who the 'firsttopic' is and adapt (after saving)"""
+
+        lField = []
+        obj = self.topics.all().first()
+        if self.firsttopic_id != (None if obj == None else obj.id):
+            self.firsttopic = obj
+            lField.append("firsttopic")
+        return lField
 
     def get_code(self):
         """Get the code of collection/edition/sermon"""
@@ -2059,6 +2288,13 @@ class Sermon(tagtext.models.TagtextModel):
 
         return sBack
 
+    def get_sortcode(self):
+        """Get the sort key of collection/edition/sermon"""
+
+        collnum = None if self.collection_id == None else self.collection.idno
+        edinum = None if self.edition_id == None else self.edition.idno
+        return get_sortcode([collnum, edinum, self.idno])
+
     def get_bibref(self):
         sRef = "-"
         if self.book != None:
@@ -2121,13 +2357,13 @@ class Sermon(tagtext.models.TagtextModel):
             sBack = ", ".join(html)
         return sBack
 
-    def get_summary_markdown(self, obj=None):
+    def get_summary_markdown(self, obj=None, snippets=None):
         sBack = ""
         if self.summary:
             # Retrieve the whole
             sWhole = markdown(self.get_summary_display).strip()
             if obj:
-                sWhole = tag_combine_html(obj, self.summary, sWhole)
+                sWhole = tag_combine_html(obj, self.summary, sWhole, snippets)
             # Combine everything
             sBack = sWhole
         return sBack
@@ -2139,12 +2375,14 @@ class Sermon(tagtext.models.TagtextModel):
         sBack = ", ".join(topics)
         return sBack
 
-    def get_topics_markdown(self):
+    def get_topics_markdown(self, list_url=None):
         lHtml = []
+        if list_url is None:
+            list_url = reverse('sermon_list')
         # Visit all topics
         for topic in self.topics.all():
             # Determine where clicking should lead to
-            url = "{}?sermo-toplist={}".format(reverse('sermon_list'), topic.id)
+            url = "{}?sermo-toplist={}".format(list_url, topic.id)
             # Create a display for this topic
             lHtml.append("<span class='topic'><a href='{}'>{}</a></span>".format(url,topic.name))
 
@@ -2216,3 +2454,224 @@ class Signature(models.Model):
         return "-" if self == None else  self.code
 
 
+
+
+class SearchIndex(object):
+    """One inverted index (SQLite FTS5) over the main objects of the application
+    
+    Each object is one row, with the [name] that is shown and the [body] text that is searched too.
+    Tagged text fields are indexed as their flat text, without the JSON.
+    The rowid combines the object id and the position of its kind in [kinds], so that an object
+    can be found directly when it is saved or deleted (see the signals in lentenConfig.ready).
+    The index is (re)built with: manage.py search_index
+    """
+
+    table = "seeker_searchindex"
+    kind_size = 16          # rowid = objid * kind_size + kind
+    # The objects that are indexed (NOTE: only add new kinds at the end, since the position is in the rowid)
+    kinds = [
+        {"kind": "sermon",      "class": Sermon,            "label": "Sermons",         "url": "sermon_details",
+         "name": "get_code",    "fields": ["thema", "fdivisionL", "fdivisionE", "fsummary", "fnote"],
+         "related": ["collection", "edition"]},
+        {"kind": "collection",  "class": SermonCollection,  "label": "Collections",     "url": "collection_details",
+         "name": "title",       "fields": ["bibliography"]},
+        {"kind": "edition",     "class": Edition,           "label": "Editions",        "url": "edition_details",
+         "name": "get_code",    "fields": ["ffulltitle", "ffrontpage", "fprologue", "fdedicatory", "fcontents", 
+                                           "fsermonlist", "fothertexts", "fcolophon", "note"],
+         "related": ["sermoncollection"]},
+        {"kind": "author",      "class": Author,            "label": "Authors",         "url": "author_details",
+         "name": "name",        "fields": ["info"]},
+        {"kind": "publisher",   "class": Publisher,         "label": "Publishers",      "url": "publisher_details",
+         "name": "name",        "fields": ["info"]},
+        {"kind": "manuscript",  "class": Manuscript,        "label": "Manuscripts",     "url": "manuscript_details",
+         "name": "name",        "fields": ["info"]},
+        {"kind": "litref",      "class": Litref,            "label": "References",      "url": "litref_details",
+         "name": "short",       "fields": ["full"]},
+        {"kind": "tagkeyword",  "class": TagKeyword,        "label": "Keywords",        "url": "tagkeyword_details",
+         "name": "name",        "fields": []}
+        ]
+    # Is the index available (None = not checked yet)
+    available = None
+    # Marks of the hits in the snippets (made into <mark> after the text has been escaped)
+    mark_start = "\x02"
+    mark_end = "\x03"
+
+    @classmethod
+    def get_kind(cls, model):
+        """Get the position and specification of the kind of [model], or (None, None)"""
+
+        for idx, oKind in enumerate(cls.kinds):
+            if oKind['class'] is model:
+                return idx, oKind
+        return None, None
+
+    @classmethod
+    def get_document(cls, oKind, obj):
+        """Get the name and body text of [obj] for the index"""
+
+        name = getattr(obj, oKind['name'])
+        if callable(name): name = name()
+        if name == None or name == "":
+            name = str(obj)[:MEDIUM_LENGTH]
+        lTagtext = [x['textfield'] for x in getattr(oKind['class'], "mixed_tag_fields", [])]
+        lBody = []
+        for field in oKind['fields']:
+            sValue = getattr(obj, field)
+            if field in lTagtext:
+                # Only the flat text of a tagged text is indexed
+                sFlat = tagtext.models.get_tagtext_parsed(sValue).flat
+                if sFlat != None: sValue = sFlat
+            lBody.append(sValue)
+        sBody = "\n".join([x for x in lBody if x != None and x != ""])
+        return str(name), sBody
+
+    @classmethod
+    def is_available(cls):
+        """Make sure the index exists (an index that is made here is empty: see manage.py search_index)"""
+
+        if cls.available == None:
+            oErr = ErrHandle()
+            try:
+                cls.available = False
+                if connection.vendor == "sqlite":
+                    sTokenizer = tagtext.models.get_fulltext_tokenizer()
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=%s", [cls.table])
+                        row = cursor.fetchone()
+                        if row != None and "tokenize='{}'".format(sTokenizer) not in row[0]:
+                            # The index was made with another tokenizer
+                            cursor.execute('DROP TABLE "{}"'.format(cls.table))
+                            row = None
+                        if row == None:
+                            cursor.execute("CREATE VIRTUAL TABLE \"{}\" USING fts5(name, body, tokenize='{}')".format(
+                                cls.table, sTokenizer))
+                    cls.available = True
+            except:
+                msg = oErr.get_error_message()
+                oErr.DoError("SearchIndex/is_available")
+        return cls.available
+
+    @classmethod
+    def update(cls, obj, delete=False):
+        """Put [obj] in the index (again), or remove it"""
+
+        oErr = ErrHandle()
+        try:
+            idx, oKind = cls.get_kind(obj.__class__)
+            if idx != None and obj.id != None and cls.is_available():
+                rowid = obj.id * cls.kind_size + idx
+                with connection.cursor() as cursor:
+                    cursor.execute('DELETE FROM "{}" WHERE rowid = %s'.format(cls.table), [rowid])
+                    if not delete:
+                        sName, sBody = cls.get_document(oKind, obj)
+                        cursor.execute('INSERT INTO "{}"(rowid, name, body) VALUES (%s, %s, %s)'.format(cls.table),
+                                       [rowid, sName, sBody])
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("SearchIndex/update")
+        return True
+
+    @classmethod
+    def on_save(cls, sender, instance, raw=False, **kwargs):
+        if not raw:
+            cls.update(instance)
+
+    @classmethod
+    def on_delete(cls, sender, instance, **kwargs):
+        cls.update(instance, delete=True)
+
+    @classmethod
+    def rebuild(cls, kinds=None, chunk=500, progress=None):
+        """Fill the index for [kinds] (default: all) anew, reading the objects in chunks of [chunk]
+        
+        The optional [progress] function is called with (kind, number of objects done) after each chunk.
+        """
+
+        oErr = ErrHandle()
+        iCount = 0
+        try:
+            if not cls.is_available():
+                return 0
+            for idx, oKind in enumerate(cls.kinds):
+                if kinds != None and oKind['kind'] not in kinds: continue
+                model = oKind['class']
+                qs = model.objects.all().order_by("id")
+                if "related" in oKind:
+                    qs = qs.select_related(*oKind['related'])
+                iDone = 0
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute('DELETE FROM "{}" WHERE rowid %% {} = %s'.format(cls.table, cls.kind_size), [idx])
+                        iLast = 0
+                        while True:
+                            lObj = list(qs.filter(id__gt=iLast)[:chunk])
+                            if len(lObj) == 0: break
+                            lRow = []
+                            for obj in lObj:
+                                sName, sBody = cls.get_document(oKind, obj)
+                                lRow.append([obj.id * cls.kind_size + idx, sName, sBody])
+                            cursor.executemany('INSERT INTO "{}"(rowid, name, body) VALUES (%s, %s, %s)'.format(cls.table), lRow)
+                            iLast = lObj[-1].id
+                            iDone += len(lObj)
+                            if progress != None: progress(oKind['kind'], iDone)
+                iCount += iDone
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("SearchIndex/rebuild")
+        return iCount
+
+    @classmethod
+    def get_query(cls, val):
+        """Turn the words of [val] into an FTS5 query: all words must occur (in the name or the body)"""
+
+        lTerm = []
+        bTrigram = (tagtext.models.get_fulltext_tokenizer() == "trigram")
+        for sWord in re.findall(r'[^\W_]+', val.lower()):
+            if bTrigram:
+                # Words can occur anywhere, but they need at least three characters
+                if len(sWord) >= 3:
+                    lTerm.append('"{}"'.format(sWord))
+            else:
+                # Words can be the start of a longer word
+                lTerm.append('"{}"*'.format(sWord))
+        return " AND ".join(lTerm)
+
+    @classmethod
+    def search(cls, val, limit=10):
+        """Search the index for [val]: ranked hits per kind, with the number of hits of each kind
+        
+        Returns a list of: {kind, label, url, count, hits: [(id, name, snippet)]}, in the order of [kinds].
+        The snippets are escaped HTML, with the hits in <mark>.
+        All is done in one query: the ranking and counting is done with window functions.
+        """
+
+        oErr = ErrHandle()
+        lBack = []
+        try:
+            sQuery = cls.get_query(val)
+            if sQuery != "" and cls.is_available():
+                sSql = 'SELECT kind, objid, name, snip, num FROM (' + \
+                       '  SELECT kind, objid, name, snip, COUNT(*) OVER (PARTITION BY kind) AS num, ' + \
+                       '         ROW_NUMBER() OVER (PARTITION BY kind ORDER BY score) AS pos FROM (' + \
+                       '    SELECT rowid %% {size} AS kind, rowid / {size} AS objid, name, ' + \
+                       "           snippet(\"{table}\", -1, %s, %s, '…', 12) AS snip, " + \
+                       '           bm25("{table}", 10.0, 1.0) AS score ' + \
+                       '    FROM "{table}" WHERE "{table}" MATCH %s)) ' + \
+                       'WHERE pos <= %s ORDER BY kind, pos'
+                oKinds = {}
+                with connection.cursor() as cursor:
+                    cursor.execute(sSql.format(size=cls.kind_size, table=cls.table), 
+                                   [cls.mark_start, cls.mark_end, sQuery, limit])
+                    for kind, objid, name, snip, num in cursor.fetchall():
+                        # The text of the document is escaped, and only then are the hits marked
+                        snip = escape(snip or "").replace(cls.mark_start, "<mark>").replace(cls.mark_end, "</mark>")
+                        if kind not in oKinds:
+                            oKind = cls.kinds[kind]
+                            oKinds[kind] = dict(kind=oKind['kind'], label=oKind['label'], url=oKind['url'],
+                                                count=num, hits=[])
+                        oKinds[kind]['hits'].append((objid, name, snip))
+                lBack = [oKinds[x] for x in sorted(oKinds)]
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("SearchIndex/search")
+        return lBack
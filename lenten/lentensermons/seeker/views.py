@@ -8,7 +8,7 @@ from django.contrib.auth.models import Group
 from django.urls import reverse, reverse_lazy
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Q, Prefetch
 import operator
 from functools import reduce
 
@@ -35,11 +35,13 @@ import csv, re
 from io import StringIO
 
 # My own application
-from lentensermons.basic.views import BasicList, BasicDetails, adapt_search, user_is_authenticated
+from lentensermons.basic.views import BasicList, BasicDetails, CountPaginator, adapt_search, user_is_authenticated, \
+    get_count_key, get_result_size, reverse_maker, get_search_q, get_search_key, SearchHits
 
 # Application specific
 from lentensermons.settings import APP_PREFIX, MEDIA_DIR
 from lentensermons.utils import ErrHandle
+from lentensermons.basic.utils import PhaseTimer
 from lentensermons.seeker.forms import UploadFileForm, UploadFilesForm, SearchUrlForm, LocationForm, LocationRelForm, ReportEditForm, \
     SignUpForm, SermonListForm, CollectionListForm, EditionListForm, ConceptListForm, \
     InstructionForm, \
@@ -51,7 +53,8 @@ from lentensermons.seeker.models import get_current_datetime, \
     Instruction, \
     Location, LocationRelation, Author, Concept, FieldChoice, Information, \
     Sermon, SermonCollection, Edition, Manuscript, TagKeyword,  \
-    Publisher, Consulting, Litref, Tgroup   # , TagQsource
+    Publisher, Consulting, Litref, Tgroup, SearchIndex, adapt_sortkeys, adapt_searchkeys, adapt_tagoccurrences   # , TagQsource
+from lentensermons.tagtext.models import TagOccurrence
 
 # Some constants that can be used
 paginateSize = 20
@@ -435,8 +438,7 @@ def make_search_list(filters, oFields, search_list, qd):
                             enable_filter(filter_type, head_id)
                             # we are dealing with a foreign key, so we should use keyFk
                             if "*" in val:
-                                val = adapt_search(val)
-                                s_q = Q(**{"{}__{}__iregex".format(fkfield, keyFk): val})
+                                s_q = get_search_q("{}__{}".format(fkfield, keyFk), val)
                             else:
                                 s_q = Q(**{"{}__{}__iexact".format(fkfield, keyFk): val})
                     elif has_obj_value(fkfield, oFields):
@@ -466,8 +468,7 @@ def make_search_list(filters, oFields, search_list, qd):
                             if isinstance(val, int):
                                 s_q = Q(**{"{}".format(dbfield): val})
                             elif "*" in val:
-                                val = adapt_search(val)
-                                s_q = Q(**{"{}__iregex".format(dbfield): val})
+                                s_q = get_search_q(dbfield, val)
                             else:
                                 s_q = Q(**{"{}__iexact".format(dbfield): val})
                     elif keyType == "has":
@@ -740,20 +741,24 @@ def treat_bom(sHtml):
 #    return user.is_authenticated()
 
 def user_is_ingroup(request, sGroup):
-    # Is this user part of the indicated group?
-    username = request.user.username
-    user = User.objects.filter(username=username).first()
-    # glist = user.groups.values_list('name', flat=True)
-
-    # Only look at group if the user is known
-    if user == None:
-        glist = []
-    else:
-        glist = [x.name for x in user.groups.all()]
+    # The group list is only calculated once per request
+    glist = getattr(request, "basic_group_list", None)
+    if glist is None:
+        # Is this user part of the indicated group?
+        username = request.user.username
+        user = User.objects.filter(username=username).first()
+        # glist = user.groups.values_list('name', flat=True)
+
+        # Only look at group if the user is known
+        if user == None:
+            glist = []
+        else:
+            glist = [x.name for x in user.groups.all()]
 
-        # Only needed for debugging
-        if bDebug:
-            ErrHandle().Status("User [{}] is in groups: {}".format(user, glist))
+            # Only needed for debugging
+            if bDebug:
+                ErrHandle().Status("User [{}] is in groups: {}".format(user, glist))
+        request.basic_group_list = glist
     # Evaluate the list
     bIsInGroup = (sGroup in glist)
     return bIsInGroup
@@ -993,6 +998,41 @@ def get_tributes(request):
     return HttpResponse(data, mimetype)
 
 
+def search_global(request):
+    """Search all main objects at once through the global search index
+    
+    Parameters: q (the word(s) to search for) and limit (the maximum number of hits per kind).
+    The hits are grouped per kind of object, ranked, and with the total number of hits of each kind.
+    """
+
+    oErr = ErrHandle()
+    data = {'status': 'ok', 'query': '', 'total': 0, 'groups': []}
+    try:
+        if not user_is_authenticated(request):
+            data['status'] = "error"
+            data['html'] = "(No authorization)"
+        else:
+            sQuery = request.GET.get('q', '').strip()
+            try:
+                iLimit = min(max(int(request.GET.get('limit', 10)), 1), 100)
+            except:
+                iLimit = 10
+            data['query'] = sQuery
+            if sQuery != "":
+                for oGroup in SearchIndex.search(sQuery, iLimit):
+                    details_url = reverse_maker(oGroup['url'])
+                    hits = [{'id': objid, 'name': name, 'snippet': snippet, 'url': details_url(objid)} 
+                            for objid, name, snippet in oGroup['hits']]
+                    data['groups'].append({'kind': oGroup['kind'], 'label': oGroup['label'], 
+                                           'count': oGroup['count'], 'hits': hits})
+                    data['total'] += oGroup['count']
+    except:
+        msg = oErr.get_error_message()
+        oErr.DoError("search_global")
+        data['status'] = "error"
+    return JsonResponse(data)
+
+
 class BasicPart(View):
     """This is my own versatile handling view.
 
@@ -1014,10 +1054,18 @@ class BasicPart(View):
     previous = None         # Return to this
     bDebug = False          # Debugging information
     data = {'status': 'ok', 'html': ''}       # Create data to be returned    
+    timer = PhaseTimer(enabled=False)
+
+    def dispatch(self, request, *args, **kwargs):
+        # Time the phases of this request
+        self.timer = PhaseTimer(self.__class__.__name__)
+        return self.timer.dispatch(super(BasicPart, self).dispatch, request, *args, **kwargs)
     
     def post(self, request, pk=None):
         # A POST request means we are trying to SAVE something
+        self.timer.lap("init")
         self.initializations(request, pk)
+        self.timer.lap("save")
 
         # Explicitly set the status to OK
         self.data['status'] = "ok"
@@ -1253,6 +1301,7 @@ class BasicPart(View):
                     context['deleted'] = True
 
             # Allow user to add to the context
+            self.timer.lap("context")
             context = self.add_to_context(context)
 
             # Check if 'afternewurl' needs adding
@@ -1276,6 +1325,7 @@ class BasicPart(View):
             context['requestuser'] = request.user
 
             # Get the HTML response
+            self.timer.lap("render")
             if len(self.arErr) > 0:
                 if self.template_err_view != None:
                      # Create a list of errors
@@ -1305,7 +1355,9 @@ class BasicPart(View):
     def get(self, request, pk=None): 
         self.data['status'] = 'ok'
         # Perform the initializations that need to be made anyway
+        self.timer.lap("init")
         self.initializations(request, pk)
+        self.timer.lap("context")
         if self.checkAuthentication(request):
             context = dict(object_id = pk, savedate=None)
             context['prevpage'] = self.previous
@@ -1368,6 +1420,7 @@ class BasicPart(View):
             context['requestuser'] = request.user
             
             # Get the HTML response
+            self.timer.lap("render")
             sHtml = render_to_string(self.template_name, context, request)
             sHtml = treat_bom(sHtml)
             self.data['html'] = sHtml
@@ -1472,11 +1525,18 @@ class PassimDetails(DetailView):
     newRedirect = False     # Redirect the page name to a correct one after creating
     redirectpage = ""       # Where to redirect to
     add = False             # Are we adding a new record or editing an existing one?
+    timer = PhaseTimer(enabled=False)
+
+    def dispatch(self, request, *args, **kwargs):
+        # Time the phases of this request
+        self.timer = PhaseTimer(self.__class__.__name__)
+        return self.timer.dispatch(super(PassimDetails, self).dispatch, request, *args, **kwargs)
 
     def get(self, request, pk=None, *args, **kwargs):
         # Initialisation
         data = {'status': 'ok', 'html': '', 'statuscode': ''}
         # always do this initialisation to get the object
+        self.timer.lap("init")
         self.initializations(request, pk)
         #if not request.user.is_authenticated:
         if not user_is_authenticated(request):
@@ -1488,7 +1548,9 @@ class PassimDetails(DetailView):
             else:
                 response = redirect( reverse('nlogin'))
         else:
+            self.timer.lap("context")
             context = self.get_context_data(object=self.object)
+            self.timer.lap("render")
 
             # Possibly indicate form errors
             # NOTE: errors is a dictionary itself...
@@ -1515,10 +1577,13 @@ class PassimDetails(DetailView):
         # Initialisation
         data = {'status': 'ok', 'html': '', 'statuscode': ''}
         # always do this initialisation to get the object
+        self.timer.lap("init")
         self.initializations(request, pk)
         # Make sure only POSTS get through that are authorized
         if request.user.is_authenticated:
+            self.timer.lap("context")
             context = self.get_context_data(object=self.object)
+            self.timer.lap("render")
             # Check if 'afternewurl' needs adding
             if 'afternewurl' in context:
                 data['afternewurl'] = context['afternewurl']
@@ -1825,6 +1890,10 @@ class LocationListView(ListView):
         Paginate by specified value in default class property value.
         """
         return self.paginate_by
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return CountPaginator(queryset, per_page, orphans=orphans, 
+                              allow_empty_first_page=allow_empty_first_page, count=self.entrycount)
   
     def get_queryset(self):
         # Get the parameters passed on with the GET or the POST request
@@ -1836,9 +1905,8 @@ class LocationListView(ListView):
 
         # Check for author [name]
         if 'name' in get and get['name'] != '':
-            val = adapt_search(get['name'])
             # Search in both the name field
-            lstQ.append(Q(name__iregex=val))
+            lstQ.append(get_search_q("name", get['name']))
 
         # Check for location type
         if 'loctype' in get and get['loctype'] != '':
@@ -1849,8 +1917,8 @@ class LocationListView(ListView):
         # Calculate the final qs
         qs = Location.objects.filter(*lstQ).order_by('name').distinct()
 
-        # Determine the length
-        self.entrycount = len(qs)
+        # Determine the length (without fetching the rows)
+        self.entrycount, bApprox = get_result_size(qs, get_count_key("LocationListView", get))
 
         # Return the resulting filtered and sorted queryset
         return qs
@@ -2039,17 +2107,24 @@ class SermonList(BasicList):
     basic_add = 'sermon_add'
     has_select2 = True
     colwrap_show = True
+    keyset_paging = True
     order_default = ['collection__idno;edition__idno;idno', 'collection__firstauthor__name', 'collection__title', 
                      'litday', 'book;chapter;verse', 'firsttopic__name']
     order_cols = ['collection__idno;edition__idno;idno', 'collection__firstauthor__name', 'collection__title', 
                      'litday', 'book;chapter;verse', '', 'firsttopic__name', '']
-    order_heads = [{'name': 'Code',             'order': 'o=1', 'type': 'int', 'custom': 'code', 'flex': 'set'}, 
-                   {'name': 'Authors',          'order': 'o=2', 'type': 'str', 'custom': 'authors', 'linkdetails': True}, 
-                   {'name': 'Collection',       'order': 'o=3', 'type': 'str', 'custom': 'collection'}, 
+    order_heads = [{'name': 'Code',             'order': 'o=1', 'type': 'int', 'custom': 'code', 'flex': 'set',
+                    'select_related': ['collection', 'edition']}, 
+                   {'name': 'Authors',          'order': 'o=2', 'type': 'str', 'custom': 'authors', 'linkdetails': True,
+                    'select_related': ['collection'], 
+                    'prefetch_related': [Prefetch('collection__authors', queryset=Author.objects.order_by('id'))]}, 
+                   {'name': 'Collection',       'order': 'o=3', 'type': 'str', 'custom': 'collection',
+                    'select_related': ['collection']}, 
                    {'name': 'Liturgical day',   'order': 'o=4', 'type': 'str', 'field': 'litday', 'main': True, 'linkdetails': True},
-                   {'name': 'Thema',            'order': 'o=5', 'type': 'str', 'custom': 'thema', 'linkdetails': True},
+                   {'name': 'Thema',            'order': 'o=5', 'type': 'str', 'custom': 'thema', 'linkdetails': True,
+                    'select_related': ['book']},
                    {'name': 'Division/summary', 'order': 'o=6', 'type': 'str', 'custom': 'descr', 'autohide': "on", 'linkdetails': True},
-                   {'name': 'Main topic',       'order': 'o=7', 'type': 'str', 'custom': 'topic'},
+                   {'name': 'Main topic',       'order': 'o=7', 'type': 'str', 'custom': 'topic',
+                    'prefetch_related': ['topics']},
                    {'name': '',                 'order': '',    'type': 'str', 'custom': 'links'}]
     filters = [ 
         {"name": "Code",                    "id": "filter_code",         "enabled": False},
@@ -2081,109 +2156,99 @@ class SermonList(BasicList):
         ]
 
     def initializations(self):
+        # Make sure the sort keys and search keys have been filled
+        adapt_sortkeys()
+        adapt_searchkeys()
+
         # Check if sermonflat has been done
         sermonflat = Information.get_kvalue("sermonflat")
         if sermonflat == None or sermonflat == "" or sermonflat!= "done":
-            # Walk all sermons
-            with transaction.atomic():
-                for sermo in Sermon.objects.all():
-                    sermo.save()
+            # Process the tagged texts of all sermons in bulk
+            Sermon.retag_all()
             Information.set_kvalue("sermonflat", "done")
 
         return None
 
-    def get_field_value(self, instance, custom):
-        sBack = ""
-        sTitle = ""
-        html = []
+    def get_field_values(self, objects, custom):
+        lBack = []
         oErr = ErrHandle()
         try:
             # FIgure out what to return
             if custom == "authors":
-                #<!-- Authors of this sermon -->
-                #<td class="tdnowrap" title="{{sermon.collection.get_authors}}" >{{sermon.collection.get_firstauthor}}</td>
-                sTitle = instance.collection.get_authors()
-                html.append(instance.collection.get_firstauthor())
+                # Authors of this sermon: the same collection often occurs on one page
+                oAuthors = {}
+                for instance in objects:
+                    coll_id = instance.collection_id
+                    if coll_id not in oAuthors:
+                        oAuthors[coll_id] = (instance.collection.get_firstauthor(), instance.collection.get_authors())
+                    lBack.append(oAuthors[coll_id])
             elif custom == "code":
-                url = reverse('sermon_details', kwargs={'pk': instance.id})
-                code_html = "<span><a href='{}' class='nostyle'>{}</a></span>&nbsp;<span>{}</span>".format(
-                    url, instance.get_code(), instance.get_statussrm_light())
-                html.append(code_html)
+                sermon_url = reverse_maker('sermon_details')
+                oLight = {}
+                for instance in objects:
+                    if instance.statussrm not in oLight:
+                        oLight[instance.statussrm] = instance.get_statussrm_light()
+                    code_html = "<span><a href='{}' class='nostyle'>{}</a></span>&nbsp;<span>{}</span>".format(
+                        sermon_url(instance.id), instance.get_code(), oLight[instance.statussrm])
+                    lBack.append((code_html, ""))
             elif custom == "collection":
-                title = instance.collection.title
-                url = reverse('collection_details', kwargs={'pk': instance.collection.id})
-                collection_html = "<a href='{}' title='View the sermon collection'>{}<a>".format(url, title)
-                html.append(collection_html)
+                collection_url = reverse_maker('collection_details')
+                for instance in objects:
+                    title = instance.collection.title
+                    collection_html = "<a href='{}' title='View the sermon collection'>{}<a>".format(
+                        collection_url(instance.collection_id), title)
+                    lBack.append((collection_html, ""))
             elif custom == "thema":
-                thema = instance.get_bibref()
-                html.append(thema)
+                for instance in objects:
+                    lBack.append((instance.get_bibref(), ""))
             elif custom == "topic":
-                sTitle = instance.get_topics()
-                topic = instance.get_topics_markdown()
-                html.append(topic)
+                list_url = reverse('sermon_list')
+                for instance in objects:
+                    lBack.append((instance.get_topics_markdown(list_url), instance.get_topics()))
             elif custom == "descr":
-                # Show hits in [divisionL, divisionE, summary, note]
+                # Show hits in [divisionE, divisionL, summary, note]
                 searchterm = self.qd.get('sermo-descr')
-                orfields = ["fdivisionL","fdivisionE","fsummary","fnote"]
                 if searchterm != None and searchterm != "":
-                    count = 0
-                    bRegex = False
-                    bContains = False
-                    if "*" in searchterm or "#" in searchterm:
-                        val = adapt_search(searchterm, orfields = [])
-                        bRegex = True
-                    elif "^" in searchterm:
-                        val = searchterm.replace("^", "").lower()
-                        bContains = True
-                    else:
-                        # New default: contains is true
-                        bContains = True
-                        val = searchterm
-
-                    # Check for MD, S, GN
-                    if bRegex or bContains:
-                        if bRegex:
-                            term_MDL = 0 ; term_MDE = 0 ; term_S = 0 ; term_GN = 0
-                            num_terms = len(val)
-                            for term in val:
-                                if len(re.findall(term, instance.fdivisionL.lower())) > 0: term_MDL += 1
-                                if len(re.findall(term, instance.fdivisionE.lower())) > 0: term_MDE += 1
-                                if len(re.findall(term, instance.fsummary.lower())) > 0: term_S += 1
-                                if len(re.findall(term, instance.fnote.lower())) > 0: term_GN += 1
-                            num_MDL = 1 if term_MDL == num_terms else 0
-                            num_MDE = 1 if term_MDE == num_terms else 0
-                            num_S = 1 if term_S == num_terms else 0
-                            num_GN = 1 if term_GN == num_terms else 0
-                        else:
-                            num_MDL = len(re.findall(val, instance.fdivisionL.lower()))
-                            num_MDE = len(re.findall(val, instance.fdivisionE.lower()))
-                            num_S = len(re.findall(val, instance.fsummary.lower()))
-                            num_GN = len(re.findall(val, instance.fnote.lower()))
-                        count = num_MDE + num_MDL + num_S + num_GN
+                    lField = ["fdivisionE", "fdivisionL", "fsummary", "fnote"]
+                    lLabel = ["MD-T", "MD-O", "S", "GN"]
+                    # Compile the search term(s) once for the whole page (Latin: use the normalised search key)
+                    oNormal = {x: get_search_key(Sermon, x) for x in lField if get_search_key(Sermon, x) != None}
+                    oHits = SearchHits(searchterm, lField, normal=oNormal)
+                    for lHits in oHits.get_hits(objects):
+                        count = 0
                         matches = []
-                        if num_MDE > 0: matches.append("MD-T ({})".format(num_MDE))
-                        if num_MDL > 0: matches.append("MD-O ({})".format(num_MDL))
-                        if num_S > 0: matches.append("S ({})".format(num_S))
-                        if num_GN > 0: matches.append("GN ({})".format(num_GN))
-                        html.append(", ".join(matches))
-
-                        if count == 0:
-                            iStop = 1
-                    # Make sure the title is shown
-                    sTitle = "Hits: {}".format(count)
+                        lTitle = []
+                        sSnippet = ""
+                        for label, (num, lSnippet) in zip(lLabel, lHits):
+                            if num > 0:
+                                count += num
+                                matches.append("{} ({})".format(label, num))
+                                for snippet in lSnippet:
+                                    lTitle.append("{}: {}".format(label, oHits.snippet_text(snippet)))
+                                if sSnippet == "" and len(lSnippet) > 0:
+                                    sSnippet = oHits.snippet_html(lSnippet[0])
+                        sHtml = ", ".join(matches)
+                        if sSnippet != "":
+                            sHtml += '<div class="kwic">{}</div>'.format(sSnippet)
+                        # Make sure the title is shown
+                        lTitle.insert(0, "Hits: {}".format(count))
+                        lBack.append((sHtml, "\n".join(lTitle)))
             elif custom == "links":
                 if user_is_ingroup(self.request, app_editor):
-                    url = reverse('admin:seeker_sermon_change', args=[instance.id])
-                    sLink = '<a mode="edit" class="view-mode btn btn-xs jumbo-1"' + \
-                            '   onclick="ru.lenten.seeker.goto_url(\'{}\')">'.format(url) + \
-                            '  <span class="glyphicon glyphicon-pencil" title="Edit these data"></span></a>'
-                    html.append(sLink)
+                    admin_url = reverse_maker('admin:seeker_sermon_change')
+                    for instance in objects:
+                        sLink = '<a mode="edit" class="view-mode btn btn-xs jumbo-1"' + \
+                                '   onclick="ru.lenten.seeker.goto_url(\'{}\')">'.format(admin_url(instance.id)) + \
+                                '  <span class="glyphicon glyphicon-pencil" title="Edit these data"></span></a>'
+                        lBack.append((sLink, ""))
         except:
             msg = oErr.get_error_message()
-            oErr.DoError("SermonList/get_field_value")
-        # Combine the HTML code
-        sBack = "\n".join(html)
-        return sBack, sTitle
+            oErr.DoError("SermonList/get_field_values")
+            lBack = []
+        # Columns that have not been filled are empty
+        if len(lBack) != len(objects):
+            lBack = [("", "")] * len(objects)
+        return lBack
 
     def adapt_search(self, fields):
         lstExclude = []
@@ -2348,21 +2413,24 @@ class CollectionList(BasicList):
     sg_name = "Sermon collection"
     basic_add = 'collection_add'
     has_select2 = True
+    keyset_paging = True
     entrycount = 0
     order_default = ['idno', 'firstauthor__name', 'title', 'datecomp', 'place__name', 'numeditions', 
                      'firstedition', 'firstedi__place__name', 'firstedi__firstpublisher__name']
     order_cols = order_default
     order_heads = [{'name': 'Code',          'order': 'o=1', 'type': 'int', 'custom': 'code', 'flex': 'set'}, 
-                   {'name': 'Authors',       'order': 'o=2', 'type': 'str', 'custom': 'author'}, 
+                   {'name': 'Authors',       'order': 'o=2', 'type': 'str', 'custom': 'author',
+                    'prefetch_related': ['authors']}, 
                    {'name': 'Title',         'order': 'o=3', 'type': 'str', 'field': 'title', 'main': True, 'linkdetails': True}, 
                    {'name': 'Year',          'order': 'o=4', 'type': 'str', 'field': 'datecomp'},
-                   {'name': 'Place',         'order': 'o=5', 'type': 'str', 'custom': 'place'},
+                   {'name': 'Place',         'order': 'o=5', 'type': 'str', 'custom': 'place',
+                    'select_related': ['place']},
                    {'name': 'Editions',      'order': 'o=6', 'type': 'int', 'custom': 'editions', 'flex': 'set'},
                    {'name': 'First Edition', 'order': 'o=7', 'type': 'str', 'field': 'firstedition'},
                    {'name': 'Ed. place',     'order': 'o=8', 'type': 'str', 'custom': 'firstediplace',
-                    'title': 'Place of the first edition'},
+                    'title': 'Place of the first edition', 'select_related': ['firstedi__place']},
                    {'name': 'Publisher',     'order': 'o=9', 'type': 'str', 'custom': 'firstedipubli',
-                    'title': 'First publisher of the first edition'}]
+                    'title': 'First publisher of the first edition', 'select_related': ['firstedi__firstpublisher']}]
     filters = [ {"name": "Identifier",      "id": "filter_idno",    "enabled": False},
                 {"name": "Author",          "id": "filter_author",  "enabled": False},
                 {"name": "Title",           "id": "filter_title",   "enabled": False},
@@ -2371,7 +2439,7 @@ class CollectionList(BasicList):
     searches = [
         {'section': '', 'filterlist': [
             {'filter': 'idno',      'dbfield': 'idno',      'keyS': 'idno'},
-            {'filter': 'author',    'fkfield': 'authors',   'keyS': 'authorname', 'keyFk': 'title', 'keyList': 'authorlist', 'infield': 'id'},
+            {'filter': 'author',    'fkfield': 'authors',   'keyS': 'authorname', 'keyFk': 'name', 'keyList': 'authorlist', 'infield': 'id'},
             {'filter': 'title',     'dbfield': 'title',     'keyS': 'title'},
             {'filter': 'place',     'fkfield': 'place',     'keyS': 'placename', 'keyFk': 'name', 'keyList': 'placelist', 'infield': 'id' },
             {'filter': 'hasmanu',   'dbfield': 'nummanu',   'keyS': 'hasmanu',   'keyType': 'has'}
@@ -2380,13 +2448,17 @@ class CollectionList(BasicList):
             {'filter': 'tagnoteid',     'fkfield': 'notetags',          'keyS': 'tagnoteid',    'keyFk': 'id' },
             {'filter': 'taglituid',     'fkfield': 'liturgicaltags',    'keyS': 'taglituid',    'keyFk': 'id' },
             {'filter': 'tagcommid',     'fkfield': 'communicativetags', 'keyS': 'tagcommid',    'keyFk': 'id' },
-            {'filter': 'tagqsrcid',     'fkfield': 'sourcetags',        'keyS': 'tagqsrcid',    'keyFk': 'id' },
+            {'filter': 'tagqsrcid',     'fkfield': 'sourcenotetags',    'keyS': 'tagqsrcid',    'keyFk': 'id' },
             {'filter': 'tagexmpid',     'fkfield': 'exemplatags',       'keyS': 'tagexmpid',    'keyFk': 'id' },
             {'filter': 'tagbiblid',     'fkfield': 'bibliographytags',  'keyS': 'tagbiblid',    'keyFk': 'id' }
             ]}
         ]
 
     def initializations(self):
+        # Make sure the sort keys and search keys have been filled
+        adapt_sortkeys()
+        adapt_searchkeys()
+
         # Change TagLiturgical + TagCommunicative into TagKeyword
         litucomm = Information.get_kvalue("taglitucomm")
         if litucomm == None or litucomm == "" or litucomm != "done":
@@ -2443,40 +2515,51 @@ class CollectionList(BasicList):
  
         return None
 
-    def get_field_value(self, instance, custom):
-        sBack = ""
-        sTitle = ""
-        html = []
+    def get_field_values(self, objects, custom):
+        lBack = []
         oErr = ErrHandle()
         try:
             # FIgure out what to return
             if custom == "author":
-                html.append(instance.get_authors())
+                for instance in objects:
+                    lBack.append((instance.get_authors(), ""))
             elif custom == "code":
-                code_html = "<span>{}&nbsp;</span><span>{}</span>".format(instance.idno, instance.get_statussrm_light())
-                html.append(code_html)
+                oLight = {}
+                for instance in objects:
+                    if instance.statussrm not in oLight:
+                        oLight[instance.statussrm] = instance.get_statussrm_light()
+                    code_html = "<span>{}&nbsp;</span><span>{}</span>".format(instance.idno, oLight[instance.statussrm])
+                    lBack.append((code_html, ""))
             elif custom == "editions":
-                edi_html = "<span>{}&nbsp;</span><span>{}</span>".format(instance.numeditions, instance.get_statusedi_light())
-                html.append(edi_html)
+                oLight = {}
+                for instance in objects:
+                    if instance.statusedi not in oLight:
+                        oLight[instance.statusedi] = instance.get_statusedi_light()
+                    edi_html = "<span>{}&nbsp;</span><span>{}</span>".format(instance.numeditions, oLight[instance.statusedi])
+                    lBack.append((edi_html, ""))
             elif custom == "place":
-                place = instance.get_place()
-                html.append(place)
+                for instance in objects:
+                    lBack.append((instance.get_place(), ""))
             elif custom == "firstediplace":
-                place = "" 
-                if instance.firstedi != None and instance.firstedi.place != None:
-                    place = instance.firstedi.place.name
-                html.append(place)
+                for instance in objects:
+                    place = "" 
+                    if instance.firstedi != None and instance.firstedi.place != None:
+                        place = instance.firstedi.place.name
+                    lBack.append((place, ""))
             elif custom == "firstedipubli":
-                publisher = "" 
-                if instance.firstedi != None and instance.firstedi.firstpublisher != None:
-                    publisher = instance.firstedi.firstpublisher.name
-                html.append(publisher)
+                for instance in objects:
+                    publisher = "" 
+                    if instance.firstedi != None and instance.firstedi.firstpublisher != None:
+                        publisher = instance.firstedi.firstpublisher.name
+                    lBack.append((publisher, ""))
         except:
             msg = oErr.get_error_message()
-            oErr.DoError("CollectionList/get_field_value")
-        # Combine the HTML code
-        sBack = "\n".join(html)
-        return sBack, sTitle
+            oErr.DoError("CollectionList/get_field_values")
+            lBack = []
+        # Columns that have not been filled are empty
+        if len(lBack) != len(objects):
+            lBack = [("", "")] * len(objects)
+        return lBack
 
     def get_helptext(self, name):
         """Use the get_helptext function defined in models.py"""
@@ -2553,6 +2636,11 @@ class PublisherListView(BasicList):
             {'filter': 'name',      'dbfield': 'name',      'keyS': 'pbname',   'keyList': 'pblist', 'infield': 'name'} ]}
         ]
 
+    def initializations(self):
+        # Make sure the sort keys have been filled
+        adapt_sortkeys()
+        return None
+
     def get_field_value(self, instance, custom):
         sBack = ""
         sTitle = ""
@@ -2586,7 +2674,8 @@ class TgroupListView(BasicList):
     order_default = ['name', '']
     order_cols = order_default
     order_heads = [{'name': 'Name',          'order': 'o=1', 'type': 'str', 'field': 'name', 'main': True, 'linkdetails': True},
-                   {'name': 'Counts',        'order': '',    'type': 'str', 'custom': 'counts'}]
+                   {'name': 'Counts',        'order': '',    'type': 'str', 'custom': 'counts',
+                    'prefetch_related': ['tgroupskeyw']}]
     filters = [{"name": "Name",          "id": "filter_name",            "enabled": False}]
     searches = [
        {'section': '', 'filterlist': [
@@ -2635,26 +2724,9 @@ class TgroupListView(BasicList):
         # Check firstedi
         italictitle = Information.get_kvalue("italictitle")
         if italictitle == None or italictitle == "" or italictitle != "done":
-            # Walk all sermon collections
-            with transaction.atomic():
-                for obj in SermonCollection.objects.all():
-                    # save them
-                    obj.save()
-            # Walk all sermons
-            with transaction.atomic():
-                for obj in Sermon.objects.all():
-                    # save them
-                    obj.save()
-            # Walk all editions
-            with transaction.atomic():
-                for obj in Edition.objects.all():
-                    # save them
-                    obj.save()
-            # Walk all manuscripts
-            with transaction.atomic():
-                for obj in Manuscript.objects.all():
-                    # save them
-                    obj.save()
+            # Process the tagged texts (and thus the style of the tags) of all these objects in bulk
+            for cls in [SermonCollection, Sermon, Edition, Manuscript]:
+                cls.retag_all()
             Information.set_kvalue("italictitle", "done")
 
         return None
@@ -2711,7 +2783,8 @@ class TagListView(BasicList):
     has_select2 = True
     order_default = ['tgroup', 'name', '']
     order_cols = ['tgroup', 'name', '']
-    order_heads = [{'name': 'Group',    'order': 'o=1', 'type': 'str', 'custom': 'group', 'linkdetails': True},
+    order_heads = [{'name': 'Group',    'order': 'o=1', 'type': 'str', 'custom': 'group', 'linkdetails': True,
+                    'select_related': ['tgroup']},
                    {'name': 'Tag',      'order': 'o=2', 'type': 'str', 'field':  'name',  'linkdetails': True, 'main': True},
                    {'name': 'Usage',    'order': '',    'type': 'str', 'custom': 'usage'}]
     filters = [ {"name": "Tag",     "id": "filter_name",    "enabled": False},
@@ -2729,8 +2802,35 @@ class TagListView(BasicList):
             self.basic_add = 'tagcomm_add'
         elif self.prefix == "tagkw":
             self.basic_add = 'tagkeyw_add'
+        # Make sure the index of the tag occurrences has been filled
+        adapt_tagoccurrences()
         return None
 
+    def get_usage(self, instance, counts=None):
+        """Get the HTML with the number of times [instance] is used per type of text"""
+
+        html = []
+        for tagitem in instance.get_list(counts):
+            if tagitem['count'] > 0:
+                url = "{}?{}".format(tagitem['params'], tagitem['count'])
+                html.append("<span class='badge {}' title='{}'><a ref='{}'>{}</a></span>".format(
+                    tagitem['css'], tagitem['type'], url, tagitem['count']))
+        return "\n".join(html)
+
+    def get_field_values(self, objects, custom):
+        lBack = None
+        oErr = ErrHandle()
+        try:
+            if custom == "usage":
+                # The counts of all tags on this page come from one grouped query
+                oCounts = TagOccurrence.get_counts(self.model, [x.id for x in objects])
+                lBack = [(self.get_usage(x, oCounts[x.id]), "") for x in objects]
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("TagList/get_field_values")
+            lBack = None
+        return lBack
+
     def get_field_value(self, instance, custom):
         sBack = ""
         sTitle = ""
@@ -2738,11 +2838,7 @@ class TagListView(BasicList):
         # FIgure out what to return
         if custom == "usage":
             # Get the number of times each tag is used
-            for tagitem in instance.get_list():
-                if tagitem['count'] > 0:
-                    url = "{}?{}".format(tagitem['params'], tagitem['count'])
-                    html.append("<span class='badge {}' title='{}'><a ref='{}'>{}</a></span>".format(
-                        tagitem['css'], tagitem['type'], url, tagitem['count']))
+            html.append(self.get_usage(instance))
         elif custom == "group":
             # Show the group
             html.append(instance.tgroup.name)
@@ -2783,8 +2879,17 @@ class TagKeywordDetailView(PassimDetails):
             {'type': 'bold',  'label': "Tag", 'value': instance.name, 'link': ""},
             {'type': 'plain',  'label': "Group", 'value': instance.tgroup.name, 'link': ""}
             ]
+        # All objects that use this tag come from the index of the tag occurrences: {(model, field): [objid]}
+        adapt_tagoccurrences()
+        oObjects = TagOccurrence.get_objects(TagKeyword, instance.id)
+
+        def get_objects(cls, field, order):
+            # The objects of [cls] that use this tag in [field]: only queried if there are any
+            lId = oObjects.get((TagOccurrence.get_tagtype(cls), field), [])
+            return list(cls.objects.filter(id__in=lId).order_by(order)) if len(lId) > 0 else []
+
         # Add the counts in different lists (collection, sermon, manuscript, edition) to the view
-        lst_count = instance.get_list()
+        lst_count = instance.get_list({ key: len(value) for key, value in oObjects.items() })
         for oCount in lst_count:
             oItem = dict(type='plain', label=oCount['type'], value=oCount['count'], align='right')
             context['mainitems'].append(oItem)
@@ -2795,8 +2900,8 @@ class TagKeywordDetailView(PassimDetails):
         # This tag in: author.info
         infos = {'prefix': 'auth', 'title': 'Author descriptions that use this tag in their [Information]'}
         # Show the list of sermons that contain this tag
-        qs = instance.author_infotags.all().order_by('name')
-        if qs.count() > 0:
+        qs = get_objects(Author, 'info', 'name')
+        if len(qs) > 0:
             rel_list =[]
             for item in qs:
                 rel_item = []
@@ -2810,8 +2915,8 @@ class TagKeywordDetailView(PassimDetails):
         # This tag in: manuscript.info
         infos = {'prefix': 'manu', 'title': 'Manuscript descriptions that use this tag in their [Information]'}
         # Show the list of sermons that contain this tag
-        qs = instance.manuscript_infotags.all().order_by('name')
-        if qs.count() > 0:
+        qs = get_objects(Manuscript, 'info', 'name')
+        if len(qs) > 0:
             rel_list =[]
             for item in qs:
                 rel_item = []
@@ -2826,27 +2931,34 @@ class TagKeywordDetailView(PassimDetails):
         # Sermon listviews
         sermondescriptions = [
             {'field': 'DivisionL',   'head': 'Division (Latin)',    'display': 'divisionL',
-                'qs': instance.sermon_divisionltags.all().order_by('code')},
+                'qs': get_objects(Sermon, 'divisionL', 'code')},
             {'field': 'DivisionE',   'head': 'Division (English)',  'display': 'divisionE',
-                'qs': instance.sermon_divisionetags.all().order_by('code')},
+                'qs': get_objects(Sermon, 'divisionE', 'code')},
             {'field': 'Summary',   'head': 'Context: Summary',      'display': '',
-                'qs': instance.sermon_summarynotes.all().order_by('code')},
+                'qs': get_objects(Sermon, 'summary', 'code')},
             {'field': 'Notes',     'head': 'Context:  Note',        'display': 'note', 
-                'qs': instance.sermon_notetags.all().order_by('code')}
+                'qs': get_objects(Sermon, 'note', 'code')}
             ]
         for description in sermondescriptions:
             base = {'prefix': 'srm', 'title': 'Sermons that use this tag in their [{}]'.format(description['field'])}
             qs = description['qs']
-            if qs.count() > 0:
+            if len(qs) > 0:
                 rel_list =[]
                 displayfieldname = "get_{}_display".format(description['display'])
+                if description['field'] == "Summary":
+                    # Only one page of summaries is shown, with the snippets that have been made when saving
+                    if len(qs) > paginateSize:
+                        page_obj = Paginator(qs, paginateSize).get_page(self.request.GET.get('page'))
+                        qs = page_obj.object_list
+                        base['page_obj'] = page_obj
+                    oSnippet = TagOccurrence.get_snippets(TagKeyword, instance.id, Sermon, 'summary', [x.id for x in qs])
                 for item in qs:
                     rel_item = []
                     rel_item.append({'value': item.get_code(), 'title': 'View this sermon', 'link': reverse('sermon_details', kwargs={'pk': item.id})})
                     rel_item.append({'value': item.litday})
                     rel_item.append({'value': item.get_authors()})
                     if description['field'] == "Summary":
-                        rel_item.append({'value': item.get_summary_markdown(instance)})
+                        rel_item.append({'value': item.get_summary_markdown(instance, oSnippet.get(item.id, []))})
                     else:
                         rel_item.append({'value': getattr(item, displayfieldname)})
                     rel_list.append(rel_item)
@@ -2857,22 +2969,22 @@ class TagKeywordDetailView(PassimDetails):
         # Collection listviews
         collectiondescriptions = [
             {'field': 'relationship with [Liturgical] texts',   'display': 'liturgical',    'head': 'Liturgical',
-                'qs': instance.collection_liturgicaltags.all().order_by('idno')},
+                'qs': get_objects(SermonCollection, 'liturgical', 'idno')},
             {'field': '[Communicative strategy]',               'display': 'communicative', 'head': 'Communicative strategy', 
-                'qs': instance.collection_communicativetags.all().order_by('idno')},
+                'qs': get_objects(SermonCollection, 'communicative', 'idno')},
             {'field': '[Sources]',                              'display': 'sources',       'head': 'Sources',                 
-                'qs': instance.collection_sourcenotes.all().order_by('idno')},
+                'qs': get_objects(SermonCollection, 'sources', 'idno')},
             {'field': '[Notes]',                                'display': 'notes',         'head': 'Notes',                   
-                'qs': instance.collection_notes.all().order_by('idno')},
+                'qs': get_objects(SermonCollection, 'notes', 'idno')},
             {'field': '[Exempla]',                              'display': 'exempla',       'head': 'Exempla',                
-                'qs': instance.collection_exempla.all().order_by('idno')},
+                'qs': get_objects(SermonCollection, 'exempla', 'idno')},
             {'field': '[Bibliography]',                         'display': 'bibliography',  'head': 'Bibliography',                
-                'qs': instance.collection_bibliography.all().order_by('idno')}
+                'qs': get_objects(SermonCollection, 'bibliography', 'idno')}
             ]
         for description in collectiondescriptions:
             base = {'prefix': 'col', 'title': 'Collections that use this tag in their {}'.format(description['field'])}
             qs = description['qs']
-            if qs.count() > 0:
+            if len(qs) > 0:
                 rel_list =[]
                 displayfieldname = "get_{}_display".format(description['display'])
                 for item in qs:
@@ -2889,22 +3001,22 @@ class TagKeywordDetailView(PassimDetails):
  
         # Edition listviews
         editiondescriptions = [
-            {'field': 'DateComment',    'qs': instance.edition_datecommenttags.all().order_by('code')},
-            {'field': 'Notes',          'qs': instance.edition_notetags.all().order_by('code')},
-            {'field': 'Frontpage',      'qs': instance.edition_frontpagetags.all().order_by('code')},
-            {'field': 'Prologue',       'qs': instance.edition_prologuetags.all().order_by('code')},
-            {'field': 'Dedicatory',     'qs': instance.edition_dedicatorytags.all().order_by('code')},
-            {'field': 'Contents',       'qs': instance.edition_contentstags.all().order_by('code')},
-            {'field': 'Sermonlist',     'qs': instance.edition_sermonlisttags.all().order_by('code')},
-            {'field': 'OtherTexts',     'qs': instance.edition_othertextstags.all().order_by('code')},
-            {'field': 'Images',         'qs': instance.edition_imagestags.all().order_by('code')},
-            {'field': 'Fulltitle',      'qs': instance.edition_fulltitletags.all().order_by('code')},
-            {'field': 'Colophon',       'qs': instance.edition_colophontags.all().order_by('code')}
+            {'field': 'DateComment',    'qs': get_objects(Edition, 'datecomment', 'code')},
+            {'field': 'Notes',          'qs': get_objects(Edition, 'note', 'code')},
+            {'field': 'Frontpage',      'qs': get_objects(Edition, 'frontpage', 'code')},
+            {'field': 'Prologue',       'qs': get_objects(Edition, 'prologue', 'code')},
+            {'field': 'Dedicatory',     'qs': get_objects(Edition, 'dedicatory', 'code')},
+            {'field': 'Contents',       'qs': get_objects(Edition, 'contents', 'code')},
+            {'field': 'Sermonlist',     'qs': get_objects(Edition, 'sermonlist', 'code')},
+            {'field': 'OtherTexts',     'qs': get_objects(Edition, 'othertexts', 'code')},
+            {'field': 'Images',         'qs': get_objects(Edition, 'images', 'code')},
+            {'field': 'Fulltitle',      'qs': get_objects(Edition, 'fulltitle', 'code')},
+            {'field': 'Colophon',       'qs': get_objects(Edition, 'colophon', 'code')}
             ]
         for description in editiondescriptions:
             base = {'prefix': 'edi', 'title': 'Editions that use this tag in their [{}]'.format(description['field'])}
             qs = description['qs']
-            if qs.count() > 0:
+            if len(qs) > 0:
                 rel_list =[]
                 for item in qs:
                     rel_item = []
@@ -2921,12 +3033,12 @@ class TagKeywordDetailView(PassimDetails):
         # Publisher listviews
         publisherdescriptions = [
             {'field': 'Information',    'display': 'info',    'head': 'Information',
-             'qs': instance.publisher_infotags.all().order_by('name')}
+             'qs': get_objects(Publisher, 'info', 'name')}
             ]
         for description in publisherdescriptions:
             base = {'prefix': 'pub', 'title': 'Publisher descriptions that use this tag in their [{}]'.format(description['field'])}
             qs = description['qs']
-            if qs.count() > 0:
+            if len(qs) > 0:
                 rel_list =[]
                 displayfieldname = "get_{}_display".format(description['display'])
                 for item in qs:
@@ -2997,6 +3109,10 @@ class ReportListView(ListView):
         Paginate by specified value in querystring, or use default class property value.
         """
         return self.request.GET.get('paginate_by', self.paginate_by)
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return CountPaginator(queryset, per_page, orphans=orphans, 
+                              allow_empty_first_page=allow_empty_first_page, count=self.entrycount)
   
     def get_queryset(self):
         # Get the parameters passed on with the GET or the POST request
@@ -3007,8 +3123,8 @@ class ReportListView(ListView):
         # Calculate the final qs
         qs = Report.objects.all().order_by('-created')
 
-        # Determine the length
-        self.entrycount = len(qs)
+        # Determine the length (without fetching the rows)
+        self.entrycount, bApprox = get_result_size(qs, get_count_key("ReportListView", get))
 
         # Return the resulting filtered and sorted queryset
         return qs
@@ -3103,14 +3219,20 @@ class EditionList(BasicList):
     admin_editable = True
     basic_add = 'edition_add'
     has_select2 = True
+    keyset_paging = True
     plural_name = "Editions"
     order_default = ['sermoncollection__idno;idno', 'sermoncollection__firstauthor__name', 'sermoncollection__title', 'place__name', 'firstpublisher__name', 'date', '']
     order_cols = order_default
-    order_heads = [{'name': 'Code',       'order': 'o=1', 'type': 'int', 'custom': 'code',      'linkdetails': True}, 
-                   {'name': 'Authors',    'order': 'o=2', 'type': 'str', 'custom': 'authors'}, 
-                   {'name': 'Collection', 'order': 'o=3', 'type': 'str', 'custom': 'coltitle',  'main': True}, 
-                   {'name': 'Place',      'order': 'o=4', 'type': 'str', 'custom': 'place'},
-                   {'name': 'Publishers', 'order': 'o=5', 'type': 'str', 'custom': 'publishers'},
+    order_heads = [{'name': 'Code',       'order': 'o=1', 'type': 'int', 'custom': 'code',      'linkdetails': True,
+                    'select_related': ['sermoncollection']}, 
+                   {'name': 'Authors',    'order': 'o=2', 'type': 'str', 'custom': 'authors',
+                    'select_related': ['sermoncollection'], 'prefetch_related': ['sermoncollection__authors']}, 
+                   {'name': 'Collection', 'order': 'o=3', 'type': 'str', 'custom': 'coltitle',  'main': True,
+                    'select_related': ['sermoncollection']}, 
+                   {'name': 'Place',      'order': 'o=4', 'type': 'str', 'custom': 'place',
+                    'select_related': ['place']},
+                   {'name': 'Publishers', 'order': 'o=5', 'type': 'str', 'custom': 'publishers',
+                    'prefetch_related': ['publishers']},
                    {'name': 'Year',       'order': 'o=6', 'type': 'str', 'custom': 'year'},
                    {'name': 'Notes?',     'order': '',    'type': 'str', 'custom': 'hasnotes'}]
     filters = [ {"name": "Collection",          "id": "filter_collection",  "enabled": False},
@@ -3164,41 +3286,61 @@ class EditionList(BasicList):
             ]}
         ]
 
-    def get_field_value(self, instance, custom):
-        sBack = ""
-        sTitle = ""
-        html = []
-        if custom == "code":
-            html.append(instance.get_code())
-            sTitle = "view the edition"
-        elif custom == "authors":
-            if instance.sermoncollection:
-                html.append(instance.sermoncollection.get_authors())
-            else:
-                html.append("-")
-        elif custom == 'coltitle':
-            if instance.sermoncollection:
-                url = reverse( 'collection_details', kwargs={'pk': instance.sermoncollection.id})
-                html.append("<span><a class='nostyle' href='{}'>{}</a></span>".format(url, instance.sermoncollection.title))
-                sTitle = "view the collection"
-            else:
-                html.append("-")
-                sTitle = "no collection"
-        elif custom == 'place':
-            place = "-" if instance.place == None else instance.place.name
-            html.append(place)
-        elif custom == 'publishers':
-            sTitle = instance.get_publisher()
-            html.append('<span style="font-size: smaller;">{}</span>'.format(sTitle[:20]))
-        elif custom == 'year':
-            html.append(instance.get_date())
-        elif custom == "hasnotes":
-            html.append(instance.has_notes())
-        # Combine the HTML code
-        sBack = "\n".join(html)
-        return sBack, sTitle
+    def get_field_values(self, objects, custom):
+        lBack = []
+        oErr = ErrHandle()
+        try:
+            if custom == "code":
+                for instance in objects:
+                    lBack.append((instance.get_code(), "view the edition"))
+            elif custom == "authors":
+                # The same collection often occurs on one page
+                oAuthors = {}
+                for instance in objects:
+                    if instance.sermoncollection:
+                        coll_id = instance.sermoncollection_id
+                        if coll_id not in oAuthors:
+                            oAuthors[coll_id] = instance.sermoncollection.get_authors()
+                        lBack.append((oAuthors[coll_id], ""))
+                    else:
+                        lBack.append(("-", ""))
+            elif custom == 'coltitle':
+                collection_url = reverse_maker('collection_details')
+                for instance in objects:
+                    if instance.sermoncollection:
+                        sHtml = "<span><a class='nostyle' href='{}'>{}</a></span>".format(
+                            collection_url(instance.sermoncollection_id), instance.sermoncollection.title)
+                        lBack.append((sHtml, "view the collection"))
+                    else:
+                        lBack.append(("-", "no collection"))
+            elif custom == 'place':
+                for instance in objects:
+                    place = "-" if instance.place == None else instance.place.name
+                    lBack.append((place, ""))
+            elif custom == 'publishers':
+                for instance in objects:
+                    sTitle = instance.get_publisher()
+                    lBack.append(('<span style="font-size: smaller;">{}</span>'.format(sTitle[:20]), sTitle))
+            elif custom == 'year':
+                for instance in objects:
+                    lBack.append((instance.get_date(), ""))
+            elif custom == "hasnotes":
+                for instance in objects:
+                    lBack.append((instance.has_notes(), ""))
+        except:
+            msg = oErr.get_error_message()
+            oErr.DoError("EditionList/get_field_values")
+            lBack = []
+        # Columns that have not been filled are empty
+        if len(lBack) != len(objects):
+            lBack = [("", "")] * len(objects)
+        return lBack
 
     def initializations(self):
+        # Make sure the sort keys and search keys have been filled
+        adapt_sortkeys()
+        adapt_searchkeys()
+
         publishers_done = Information.get_kvalue("publishers")
         if publishers_done != "done":
             if Edition.do_publishers():
@@ -3206,9 +3348,8 @@ class EditionList(BasicList):
 
         flat_done = Information.get_kvalue("flat")
         if flat_done != "done":
-            with transaction.atomic():
-                for edi in Edition.objects.all():
-                    edi.save()
+            # Process the tagged texts of all editions in bulk
+            Edition.retag_all()
             Information.set_kvalue("flat", "done")
 
         # Set the values for yes and no
@@ -3368,6 +3509,11 @@ class AuthorListView(BasicList):
             ]}
         ]
 
+    def initializations(self):
+        # Make sure the sort keys have been filled
+        adapt_sortkeys()
+        return None
+
     def get_field_value(self, instance, custom):
         sBack = ""
         sTitle = ""
@@ -3450,8 +3596,11 @@ class ManuscriptListView(BasicList):
     has_select2 = True
     order_cols = ['collection__authors__name', 'collection__title', 'name', '']
     order_default = order_cols
-    order_heads = [{'name': 'Author',       'order': 'o=1', 'type': 'str', 'custom': 'author'},
-                   {'name': 'Collection',   'order': 'o=2', 'type': 'str', 'custom': 'collection'},
+    order_heads = [{'name': 'Author',       'order': 'o=1', 'type': 'str', 'custom': 'author',
+                    'select_related': ['collection'], 
+                    'prefetch_related': [Prefetch('collection__authors', queryset=Author.objects.order_by('id'))]},
+                   {'name': 'Collection',   'order': 'o=2', 'type': 'str', 'custom': 'collection',
+                    'select_related': ['collection']},
                    {'name': 'Name',         'order': 'o=3', 'type': 'str', 'custom': 'name',       'linkdetails': True,  'main': True},
                    {'name': 'Link?',        'order': '',    'type': 'str', 'custom': 'link'},
                    {'name': 'Notes?',       'order': '',    'type': 'str', 'custom': 'notes'}]
@@ -3470,6 +3619,11 @@ class ManuscriptListView(BasicList):
             ]}
         ]
 
+    def initializations(self):
+        # Make sure the sort keys have been filled
+        adapt_sortkeys()
+        return None
+
     def get_field_value(self, instance, custom):
         sBack = ""
         sTitle = ""
@@ -3479,13 +3633,13 @@ class ManuscriptListView(BasicList):
             html.append("<span><a class='nostyle' href='{}'>{}</a></span>".format(url, instance.collection.title))
             sTitle = "View the sermon collection"
         elif custom == "author":
-            # Get the name of the first author
-            authors = instance.collection.authors.all()
-            if authors.count() == 0:
+            # Get the name of the first author (the authors may have been prefetched)
+            authors = sorted(instance.collection.authors.all(), key=lambda x: x.id)
+            if len(authors) == 0:
                 html.append("(none)")
             else:
-                url = reverse("author_details", kwargs={'pk': authors.first().id})
-                html.append("<span><a class='nostyle' href='{}'>{}</a></span>".format(url, authors.first().name))
+                url = reverse("author_details", kwargs={'pk': authors[0].id})
+                html.append("<span><a class='nostyle' href='{}'>{}</a></span>".format(url, authors[0].name))
                 sTitle = "View the author details"
         elif custom == "name":
             sName = instance.name[:80]
@@ -153,6 +153,53 @@ DATABASES = {
     }
 }
 
+# Caches: the ordered result ids of list views have their own (least recently used) cache
+#         the data generation (see basic.views.get_count_generation) must be shared by all worker processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    'basic_shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(WRITABLE_DIR, 'cache'),
+        'TIMEOUT': None
+        },
+    'basic_results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'basic_results',
+        'TIMEOUT': 600,
+        'OPTIONS': { 'MAX_ENTRIES': 200 }
+        }
+}
+
+# Phase timing of list and detail views: Server-Timing header (staff users only, or DEBUG) and/or log line
+SERVER_TIMING = False
+SERVER_TIMING_LOG = False
+
+# Statistics of the searches in list views (see the SearchLog admin): maximum number of different searches kept
+SEARCH_LOG = True
+SEARCH_LOG_SIZE = 2000
+
+# Guarding of searches in list views: maximum duration (ms) of one query, and limits of wildcard patterns
+SEARCH_BUDGET_MS = 3000
+SEARCH_MAX_LENGTH = 200
+SEARCH_MAX_REGEX = 3
+SEARCH_MAX_WILDCARDS = 4
+
+# Number of parsed tagged texts that are kept (least recently used)
+TAGTEXT_PARSE_CACHE = 2048
+# Size (characters) of the context before and after a tag in the keyword-in-context snippets of the tag details
+TAGTEXT_KWIC_SIZE = 50
+
+# Full-text index of flat text fields: 'trigram' (infix matching) or 'unicode61' (word matching)
+FULLTEXT_TOKENIZER = "trigram"
+
+# Latin orthography: replacements (in this order) for the normalised search keys of titles and divisions
+LATIN_NORMALISATION = [
+    ("æ", "ae"), ("œ", "oe"), ("ꝑ", "per"), ("ꝓ", "pro"), ("⁊", "et"), ("&", "et"),
+    ("ae", "e"), ("oe", "e"), ("j", "i"), ("v", "u")
+    ]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -3,3 +3,20 @@ from django.apps import AppConfig
 
 class tagtextConfig(AppConfig):
     name = 'lentensermons.tagtext'
+
+    def ready(self):
+        from django.apps import apps
+        from django.db.models.signals import post_delete
+        from .models import TagtextModel, TagOccurrence
+
+        # Keep the index of the tag occurrences up to date, also when objects are deleted in bulk
+        lTagcls = []
+        for model in apps.get_models():
+            if issubclass(model, TagtextModel) and len(model.mixed_tag_fields) > 0:
+                sUid = "tagtext_occurrence_{}".format(model._meta.label_lower)
+                post_delete.connect(TagOccurrence.on_delete_object, sender=model, dispatch_uid=sUid)
+                for item in model.mixed_tag_fields:
+                    if item['class'] not in lTagcls: lTagcls.append(item['class'])
+        for tagcls in lTagcls:
+            sUid = "tagtext_occurrence_tag_{}".format(tagcls._meta.label_lower)
+            post_delete.connect(TagOccurrence.on_delete_tag, sender=tagcls, dispatch_uid=sUid)
@@ -6,6 +6,8 @@ from django import forms
 from django.forms.widgets import *
 import json
 
+from .models import get_tagtext_parsed
+
 class TagTextarea(forms.widgets.Textarea):
     template_name = 'tagtext/tagtextarea.html'
     remote = '/api/tagtext/'
@@ -38,15 +40,14 @@ class TagTextarea(forms.widgets.Textarea):
             # Plain text, not something else...
             showvalue = value
         else:
-            part_list = json.loads(value)
             html = []
-            for item in part_list:
-                if item['type'] == "text":
-                    html.append(item['value'])
-                elif item['type'] == "new":
-                    html.append('@{}@'.format(item['value']))
+            for item in get_tagtext_parsed(value).segments:
+                if item.type == "text":
+                    html.append(item.value)
+                elif item.type == "new":
+                    html.append('@{}@'.format(item.value))
                 else:
-                    html.append('<span tagid="{}" contenteditable="false">{}</span>'.format(item['tagid'], item['value']))
+                    html.append('<span tagid="{}" contenteditable="false">{}</span>'.format(item.tagid, item.value))
             showvalue = "".join(html)
         # Initialize the remote call
         remote = "" if not self.remote else self.remote
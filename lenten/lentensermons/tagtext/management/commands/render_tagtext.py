@@ -0,0 +1,42 @@
+"""
+Store the rendered HTML of the tagged text fields of all TagtextModel classes anew
+
+Usage: python manage.py render_tagtext [--model seeker.Sermon ...] [--stale] [--chunk 500]
+"""
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from lentensermons.tagtext.models import TagtextModel
+
+
+class Command(BaseCommand):
+    help = "Render the tagged text fields again and store their HTML (e.g. after a change of templates or URLs)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", action="append", 
+                            help="Only render this model, as app_label.ModelName (can be repeated)")
+        parser.add_argument("--stale", action="store_true", 
+                            help="Only render the HTML that is missing or outdated")
+        parser.add_argument("--chunk", type=int, default=500, help="Number of objects per chunk (default: 500)")
+
+    def handle(self, *args, **options):
+        if options['chunk'] < 1:
+            raise CommandError("The chunk size must be at least 1")
+        lModel = [x for x in apps.get_models() if issubclass(x, TagtextModel) and len(x.mixed_tag_fields) > 0]
+        if options['model']:
+            oModel = { x._meta.label_lower: x for x in lModel }
+            lModel = []
+            for sName in options['model']:
+                if sName.lower() not in oModel:
+                    raise CommandError("Unknown model with tagged texts: {}".format(sName))
+                lModel.append(oModel[sName.lower()])
+
+        for model in lModel:
+            sName = model._meta.label
+            def progress(count):
+                if options['verbosity'] > 1:
+                    self.stdout.write("  {}: {}".format(sName, count))
+
+            iCount = model.rendered_rebuild(chunk=options['chunk'], force=not options['stale'], progress=progress)
+            self.stdout.write(self.style.SUCCESS("{}: {} objects rendered".format(sName, iCount)))
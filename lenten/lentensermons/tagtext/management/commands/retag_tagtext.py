@@ -0,0 +1,69 @@
+"""
+Process the tagged texts of all TagtextModel classes anew, in bulk
+
+This regenerates the tags and their many-to-many links, the flat texts, the search keys,
+the denormalised fields (e.g. sort keys) and the rendered HTML.
+
+Usage: python manage.py retag_tagtext [--model seeker.Sermon ...] [--chunk 500] [--workers 4] [--render]
+"""
+
+import os
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from lentensermons.tagtext.models import TagtextModel
+
+
+class Command(BaseCommand):
+    help = "Process the tagged texts again in bulk (e.g. after a change in the meaning of tags)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", action="append", 
+                            help="Only process this model, as app_label.ModelName (can be repeated)")
+        parser.add_argument("--chunk", type=int, default=500, 
+                            help="Number of objects per chunk, each written in one transaction (default: 500)")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Number of processes that render the HTML (default: 1 for SQLite, otherwise the number of CPUs)")
+        parser.add_argument("--render", action="store_true", help="Render all HTML anew (not only what is outdated)")
+
+    def handle(self, *args, **options):
+        if options['chunk'] < 1:
+            raise CommandError("The chunk size must be at least 1")
+        lModel = [x for x in apps.get_models() if issubclass(x, TagtextModel) and len(x.mixed_tag_fields) > 0]
+        if options['model']:
+            oModel = { x._meta.label_lower: x for x in lModel }
+            lModel = []
+            for sName in options['model']:
+                if sName.lower() not in oModel:
+                    raise CommandError("Unknown model with tagged texts: {}".format(sName))
+                lModel.append(oModel[sName.lower()])
+        iWorkers = options['workers']
+        if iWorkers == None:
+            # SQLite has one writer anyway: forking processes next to its connection gains little
+            iWorkers = 1 if connection.vendor == "sqlite" else (os.cpu_count() or 1)
+        lFailed = []
+
+        for model in lModel:
+            sName = model._meta.label
+            fStart = time.perf_counter()
+            def progress(done, changed):
+                if options['verbosity'] > 1:
+                    fSeconds = max(time.perf_counter() - fStart, 0.001)
+                    self.stdout.write("  {}: {} done, {} changed ({:.0f} objects/s)".format(sName, done, changed, done / fSeconds))
+
+            iTotal = model.objects.count()
+            lModelFailed = []
+            iCount = model.retag_all(chunk=options['chunk'], workers=iWorkers, render=options['render'], 
+                                     progress=progress, failed=lModelFailed)
+            for iFirst, iLast, sMsg in lModelFailed:
+                self.stderr.write("{}: chunk with ids {}-{} failed (not changed): {}".format(sName, iFirst, iLast, sMsg))
+            lFailed.extend(lModelFailed)
+            fSeconds = max(time.perf_counter() - fStart, 0.001)
+            self.stdout.write(self.style.SUCCESS("{}: {} objects, {} changed in {:.1f}s ({:.0f} objects/s)".format(
+                sName, iTotal, iCount, fSeconds, iTotal / fSeconds)))
+        self.stdout.write("Note: the global search index is not updated here (see the search_index command)")
+        if len(lFailed) > 0:
+            raise CommandError("{} chunks failed: run the command again for these objects".format(len(lFailed)))
@@ -1,90 +1,1028 @@
 import sys
-from django.db import models
+from django.conf import settings
+from django.db import models, connection, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.db.models.expressions import RawSQL
 from django.shortcuts import redirect, reverse
 from markdown import markdown
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
 import json
+import multiprocessing
+import re
+import sqlite3
+
+# Full-text index (SQLite FTS5) per TagtextModel class: is it available or not (the table is never dropped once it is ready)
+fulltext_tables = {}
+# Number of tagged texts that have actually been parsed, and that have been asked for (see TagtextParsed)
+tagtext_stats = {'parsed': 0, 'requested': 0}
+
+
+def get_fulltext_tokenizer():
+    """Get the FTS5 tokenizer: 'trigram' allows infix matching, 'unicode61' only matches words"""
+
+    sTokenizer = getattr(settings, "FULLTEXT_TOKENIZER", "trigram")
+    if sTokenizer == "trigram" and sqlite3.sqlite_version_info < (3, 34, 0):
+        # The trigram tokenizer is only available from SQLite 3.34 onwards
+        sTokenizer = "unicode61"
+    return sTokenizer
+
+def get_fulltext_query(val, tokenizer="trigram"):
+    """Translate the search value [val] into an FTS5 query that finds (at least) all rows that match it
+    
+    The value can be plain text (searched with 'contains'), a wildcard pattern with * ? and [...]
+    (matching the whole field), or a '#' search with words that may occur anywhere.
+    The query only narrows down the candidates: the original condition must still be applied.
+    An empty string means that no useful query can be made.
+    """
+
+    # Collect the literal fragments: (text, whether it starts at the beginning of a word)
+    lFragment = []
+    val = val.lower()
+    if "#" in val:
+        # Each word may be anywhere in the field, and is a regular expression otherwise
+        for sWord in val.strip().split(" "):
+            lFragment.extend(get_regex_fragments(sWord))
+    elif "*" in val:
+        # Wildcard pattern of the whole field
+        for idx, sPart in enumerate(re.split(r'\*|\?|\[[^\]]*\]', val.strip())):
+            lFragment.append((sPart, idx == 0))
+    else:
+        lFragment.append((val.replace("^", ""), False))
+
+    lTerm = []
+    for sFragment, bWordStart in lFragment:
+        if tokenizer == "trigram":
+            # Any fragment of at least three characters can be looked for
+            if len(sFragment) >= 3:
+                lTerm.append('"{}"'.format(sFragment.replace('"', '""')))
+        else:
+            # Only (the start of) complete words can be looked for
+            for oMatch in re.finditer(r'[^\W_]+', sFragment):
+                if oMatch.start() == 0 and not bWordStart:
+                    # This may be the end of a longer word
+                    continue
+                sTerm = '"{}"'.format(oMatch.group())
+                if oMatch.end() == len(sFragment):
+                    # This may be the start of a longer word
+                    sTerm += "*"
+                lTerm.append(sTerm)
+    return " AND ".join(lTerm)
+
+def get_regex_fragments(sWord):
+    """Get the literal fragments that any text matching the '#' search word [sWord] must contain
+    
+    Returns a list of (text, whether it starts at the beginning of a word). Only certain fragments are 
+    returned: characters with a quantifier, classes, escapes and wildcards separate the fragments, 
+    and a word with an alternation or a group has no certain fragments at all.
+    """
+
+    # A lone * is ignored (see adapt_search), and #* is a word boundary followed by anything
+    sWord = sWord.replace("*", "")
+    if any(x in sWord for x in "|()"):
+        return []
+    lFragment = []
+    sPart = ""
+    bWordStart = True
+    idx = 0
+    while idx < len(sWord):
+        ch = sWord[idx]
+        if ch in "?+{":
+            # The previous character may be absent or repeated: drop it, and skip a {m,n} quantifier
+            sPart = sPart[:-1]
+            if ch == "{":
+                iEnd = sWord.find("}", idx)
+                idx = len(sWord) if iEnd < 0 else iEnd
+        elif ch in "#.^$[\\":
+            if ch == "[":
+                # A class: skip up to its end
+                iEnd = sWord.find("]", idx + 2)
+                idx = len(sWord) if iEnd < 0 else iEnd
+            elif ch == "\\":
+                # An escape: skip the escaped character too
+                idx += 1
+        else:
+            sPart += ch
+            idx += 1
+            continue
+        # This ends the current fragment
+        if sPart != "":
+            lFragment.append((sPart, bWordStart))
+        sPart = ""
+        bWordStart = False
+        idx += 1
+    if sPart != "":
+        lFragment.append((sPart, bWordStart))
+    return lFragment
+
+# One part of a tagged text: [extra] has all its (key, value) items after 'type' and 'value', in order
+TagSegment = namedtuple("TagSegment", ["type", "value", "tagid", "style", "extra"])
+
+class TagtextParsed(object):
+    """A (stringified JSON) tagged text, parsed once: its segments, the ids of its tags and its flat text
+    
+    Instances are shared (see get_tagtext_parsed), so they must not be changed: use get_parts() for a copy.
+    """
+
+    __slots__ = ("text", "tagged", "segments", "tagids", "flat")
+
+    def __init__(self, sText):
+        tagtext_stats['parsed'] += 1
+        self.text = sText
+        self.tagged = False         # Only a text that starts with [ is a tagged text
+        self.segments = ()
+        self.tagids = frozenset()
+        self.flat = sText           # None when there is no valid flat text
+        if sText != None and sText != "" and sText[0] == "[":
+            self.tagged = True
+            if "{" not in sText:
+                # Automatically convert into one huge part
+                self.segments = (TagSegment("text", sText, None, None, ()), )
+                self.flat = None
+            else:
+                lSegment = []
+                for item in json.loads(sText):
+                    extra = tuple((k, v) for k, v in item.items() if k != "type" and k != "value")
+                    lSegment.append(TagSegment(item['type'], item['value'], item.get('tagid'), item.get('style'), extra))
+                self.segments = tuple(lSegment)
+                # The tag ids are kept as strings (the editor delivers them like that)
+                self.tagids = frozenset(str(x.tagid) for x in self.segments if x.type == "tag")
+                # Combine to get the flat text
+                sFlat = " ".join(x.value for x in self.segments).strip()
+                # Double check if there is anything in the text
+                self.flat = "" if sFlat in "-" else sFlat
+
+    def get_parts(self):
+        """Get a new list of the parts as dictionaries (which may be changed)"""
+        return [dict((("type", x.type), ("value", x.value)) + x.extra) for x in self.segments]
+
+@lru_cache(maxsize=getattr(settings, "TAGTEXT_PARSE_CACHE", 2048))
+def parse_tagtext(sText):
+    return TagtextParsed(sText)
+
+def get_tagtext_parsed(sText):
+    """Get the parsed form of the tagged text [sText]: texts are parsed only once (least recently used cache)"""
+
+    tagtext_stats['requested'] += 1
+    return parse_tagtext(sText)
+
+def get_text_key(sText):
+    """Get a short key of the tagged text [sText], to see whether its rendered HTML is still valid"""
+    return hashlib.md5(sText.encode("utf-8")).hexdigest()[:16]
+
+def render_tagtext(sText, url=None):
+    """Render the (stringified JSON) tagged text [sText] into HTML, with links to [url] for the tags"""
+
+    showvalue = ""
+    if sText == None or sText == "":
+        showvalue = ""
+    elif sText[0] != "[":
+        # Plain text, not something else...
+        showvalue = sText
+    else:
+        html = []
+        for item in get_tagtext_parsed(sText).segments:
+            # Make sure to get the markdown of the item
+            mditem = item.value
+            # Now look further...
+            if item.type == "text":
+                html.append(mditem)
+            elif item.type == "new":
+                html.append('@{}@'.format(mditem))
+            else:
+                # This means the field type is 'tag'
+                if url:
+                    href = reverse(url, kwargs= {'pk': item.tagid})
+                    if item.style == "italic":
+                        html.append('<span tagid="{}" contenteditable="false"><a href="{}"><i>{}</i></a></span>'.format(item.tagid, href, mditem))
+                    else:
+                        html.append('<span tagid="{}" contenteditable="false"><a href="{}">{}</a></span>'.format(item.tagid, href, mditem))
+                else:
+                    if item.style == "italic":
+                        html.append('<span tagid="{}" contenteditable="false"><i>{}</i></span>'.format(item.tagid, mditem))
+                    else:
+                        html.append('<span tagid="{}" contenteditable="false">{}</span>'.format(item.tagid, mditem))
+        showvalue = "".join(html)
+        # Now perform MD
+        showvalue = markdown(showvalue).replace("<p>", "").replace("</p>", "")
+    return showvalue
+
+def get_kwic_size():
+    """Get the size (characters) of the context before and after a tag in the keyword-in-context snippets"""
+    return getattr(settings, "TAGTEXT_KWIC_SIZE", 50)
+
+def segments_to_string(segments, idxBeg, idxEnd, size, type):
+    """Combine the segments from idxBeg until idxEnd into a string of (about) [size] characters, in whole words
+    
+    With type 'from_end' the string is taken backwards from idxEnd (inclusive), otherwise forwards from idxBeg.
+    """
+
+    if idxBeg <0 or idxEnd < 0 or idxEnd < idxBeg:
+        combi = ""
+    else:
+        lst_combi = []
+        mysize = 0
+        # Action depends on type
+        if type == "from_end":
+            idx = idxEnd
+            while idx >=0:
+                contents = segments[idx].value.strip().replace('\n', ' ').replace('*', '')
+                lst_combi.insert(0,contents)
+                mysize += len(contents)
+                if mysize > size:
+                    break
+                idx -= 1
+        else:
+            for segment in segments[idxBeg:idxEnd]:
+                contents = segment.value.strip().replace('\n', ' ').replace('*', '')
+                lst_combi.append(contents)
+                mysize += len(contents)
+                if mysize > size:
+                    break
+
+        combi = " ".join(lst_combi)
+        # Is this larger than 'size'?
+        if len(combi) > size:
+            # Find the first SPACE depending on the type
+            if type == "from_end":
+                # Look for first space backwards
+                idx = combi.rfind(' ',0, len(combi)-size)
+                if idx > 0:
+                    combi = combi[idx:]
+            else:
+                # Look for first space forwards
+                idx = combi.find(' ', size)
+                if idx > 0:
+                    combi = combi[:idx]
+    return combi
+
+def get_tagtext_context(segments, idx, size=None):
+    """Get the keyword-in-context window of segment [idx] of a tagged text: (text before, text after)"""
+
+    if size == None: size = get_kwic_size()
+    sBefore = segments_to_string(segments, 0, idx-1, size, "from_end")
+    sAfter = segments_to_string(segments, idx+1, len(segments), size, "from_start")
+    return sBefore, sAfter
+
+def render_tagtext_job(job):
+    """Render one (sText, url) job in a worker process: None if that fails"""
+
+    try:
+        return render_tagtext(*job)
+    except:
+        return None
+
+def init_tagtext_worker():
+    """Make sure a worker process can use Django (e.g. for reverse)"""
+
+    import django
+    django.setup()
+
+def strip_tagtext(arPart):
+    """Strip the white space at the start and the end of the parts [arPart] of a tagged text"""
+
+    # Process the *first* in the list
+    if len(arPart) > 0:
+        item = arPart[0]
+        if item['type'] == "text":
+            item['value'] = item['value'].lstrip()
+    # Process the *last* in the list if the list is larger
+    if len(arPart) > 1:
+        item = arPart[-1]
+        if item['type'] == "text":
+            item['value'] = item['value'].rstrip()
+    return arPart
+
+def resolve_tagtext(cls, lPart):
+    """Resolve the tags (class [cls]) in the parts of one or more tagged texts [lPart], with set-based queries
+    
+    New tags are looked up (or created), the ids and styles of existing tags are repaired.
+    Returns a list with, for each tagged text, the ids of the tags that are in it.
+    """
+
+    # Existing tags: fetch them all at once (with their group, which determines the style)
+    qs = cls.objects.all()
+    if any(x.name == "tgroup" for x in cls._meta.fields):
+        qs = qs.select_related("tgroup")
+    lTagid = []
+    for arPart in lPart:
+        for tagobj in arPart:
+            if tagobj['type'] == "tag":
+                try:
+                    tagobj['tagid'] = int(tagobj['tagid'])
+                    lTagid.append(tagobj['tagid'])
+                except (KeyError, TypeError, ValueError):
+                    tagobj['tagid'] = None
+    oTag = { x.id: x for x in qs.filter(id__in=lTagid) } if len(lTagid) > 0 else {}
+
+    # New tags: look them up by their lower case name in one go
+    oNew = {}
+    for arPart in lPart:
+        for tagobj in arPart:
+            if tagobj['type'] == "new":
+                # Check if there is a representation followed by a lexical entry
+                tagname = tagobj['value']
+                arTagname = tagname.split("|")
+                if len(arTagname) > 1:
+                    tagname = arTagname[1]
+                    tagobj['value'] = arTagname[0]
+                tagobj['name'] = tagname
+                oNew.setdefault(tagname.lower(), None)
+    if len(oNew) > 0:
+        for obj in qs.annotate(lname=Lower("name")).filter(lname__in=list(oNew)).order_by("id"):
+            if oNew.get(obj.lname) == None:
+                oNew[obj.lname] = obj
+
+    # Create all tags that do not exist (yet)
+    oCreate = {}
+    lMissing = []
+    for iText, arPart in enumerate(lPart):
+        for idx, tagobj in enumerate(arPart):
+            if tagobj['type'] == "new" and oNew[tagobj['name'].lower()] == None:
+                oCreate.setdefault(tagobj['name'].lower(), tagobj['name'])
+            elif tagobj['type'] == "tag" and tagobj['tagid'] not in oTag:
+                lMissing.append((iText, idx))
+    lName = list(oCreate.values()) + [lPart[iText][idx]['value'] for iText, idx in lMissing]
+    lCreated = create_tags(cls, lName)
+    for obj in lCreated[:len(oCreate)]:
+        oNew[obj.name.lower()] = obj
+    # Existing tags that could not be found are created anyway
+    oMissing = dict(zip(lMissing, lCreated[len(oCreate):]))
+
+    # Repair the entries in the parts and collect the tags that are in each text
+    lBack = []
+    oStyle = {}
+    for iText, arPart in enumerate(lPart):
+        taglist = []
+        for idx, tagobj in enumerate(arPart):
+            if tagobj['type'] == "new":
+                obj = oNew[tagobj.pop('name').lower()]
+                tagobj['type'] = "tag"
+            elif tagobj['type'] == "tag":
+                obj = oMissing.get((iText, idx)) or oTag[tagobj['tagid']]
+            else:
+                # Note: no need to do anything with the text items
+                continue
+            tagobj['tagid'] = obj.id
+            if obj.id not in oStyle:
+                oStyle[obj.id] = obj.get_style()
+            style = oStyle[obj.id]
+            if style != None and style != "": tagobj['style'] = style
+            taglist.append(obj.id)
+        lBack.append(taglist)
+    return lBack
+
+def bump_data_generation():
+    """Make the cached counts and result ids of the list views outdated, after writes that send no signals"""
+
+    from lentensermons.basic.views import bump_count_generation
+    bump_count_generation()
+
+class RelatedPending(object):
+    """The instances whose adapt_related() must be called once the current transaction has been committed
+
+    One is registered with transaction.on_commit() per transaction (or savepoint) of a connection.
+    When that is rolled back, Django drops the callback, and with it the instances that are pending.
+    """
+
+    def __init__(self, sids):
+        self.sids = sids
+        self.objects = {}
+
+    @classmethod
+    def add(cls, obj):
+        """Make sure adapt_related() of [obj] is called after the transaction it is saved in"""
+
+        using = obj._state.db
+        connection = transaction.get_connection(using)
+        sids = list(connection.savepoint_ids)
+        oPending = getattr(connection, "tagtext_related", None)
+        bNew = (oPending == None or oPending.sids != sids or 
+                not any(x[1] is oPending for x in connection.run_on_commit))
+        if bNew:
+            oPending = cls(sids)
+            connection.tagtext_related = oPending
+        oPending.objects[(obj.__class__, obj.pk)] = obj
+        if bNew:
+            # Outside a transaction this is called at once
+            transaction.on_commit(oPending, using=using)
+
+    def __call__(self):
+        """Call adapt_related() for all pending instances, and write only the fields that have changed"""
+
+        bChanged = False
+        while self.objects:
+            key, obj = self.objects.popitem()
+            try:
+                lField = obj.adapt_related()
+                if len(lField) > 0:
+                    obj.__class__._base_manager.filter(pk=obj.pk).update(**{x: getattr(obj, x) for x in lField})
+                    bChanged = True
+            except:
+                sMsg = obj.get_error_message()
+        if bChanged:
+            bump_data_generation()
+
+def create_tags(cls, names):
+    """Create new tags of class [cls] for the list [names], and return them in that order"""
+
+    if len(names) == 0:
+        return []
+    if hasattr(cls, "create_many"):
+        # The class knows how to create them in bulk
+        return cls.create_many(names)
+    return [cls.objects.create(name=x) for x in names]
+
+
+
+class TagtextDisplay(object):
+    """The get_FIELD_display of a tagged text field: rendered on first use, and memoised per instance
+    
+    It is rendered again when the text of the field has changed since.
+    The HTML comes from the 'rendered' field of the instance, as long as that is current.
+    """
+
+    memo = "_tagtext_display"
+
+    def __init__(self, textfield, url=None):
+        self.textfield = textfield
+        self.url = url
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        sText = getattr(instance, self.textfield)
+        oMemo = instance.__dict__.setdefault(self.memo, {})
+        item = oMemo.get(self.textfield)
+        if item is None or item[0] != sText:
+            item = (sText, instance.get_rendered(self.textfield, sText, self.url))
+            oMemo[self.textfield] = item
+        return item[1]
 
 
 # Create your models here.
+class TagOccurrence(models.Model):
+    """One reference to a tag in a tagged text field of a TagtextModel instance
+
+    This is a reverse index of the tagged texts, kept up to date by TagtextModel.save(), retag() and delete().
+    """
+
+    # [1] The class of the tag (app_label.modelname) and its id
+    tagtype = models.CharField("Tag type", max_length=100)
+    tagid = models.IntegerField("Tag id")
+    # [1] The class of the object (app_label.modelname), its id and the tagged text field
+    model = models.CharField("Model", max_length=100)
+    objid = models.IntegerField("Object id")
+    field = models.CharField("Field", max_length=100)
+    # [1] The index of the tag in the segments of the tagged text
+    segment = models.IntegerField("Segment", default=0)
+    # [1] The keyword-in-context snippet: the tag as it is written, and the text before and after it (see get_kwic_size)
+    value = models.TextField("Value", default="")
+    before = models.TextField("Before", default="")
+    after = models.TextField("After", default="")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tagtype', 'tagid', 'model', 'field']),
+            models.Index(fields=['model', 'objid'])
+            ]
+
+    def __str__(self):
+        sBack = "{}:{} in {}:{}.{}".format(self.tagtype, self.tagid, self.model, self.objid, self.field)
+        return sBack
+
+    @staticmethod
+    def get_tagtype(cls):
+        """Get the name by which the tag class (or TagtextModel class) [cls] is known in the index"""
+        return cls._meta.label_lower
+
+    @classmethod
+    def get_counts(cls, tagcls, lTagid):
+        """Count the objects that use each of the tags [lTagid] (class [tagcls]), with one grouped query
+
+        Returns a dictionary: {tagid: {(model, field): number of objects}}
+        """
+
+        oBack = { x: {} for x in lTagid }
+        if len(oBack) > 0:
+            qs = cls.objects.filter(tagtype=cls.get_tagtype(tagcls), tagid__in=list(oBack))
+            qs = qs.values('tagid', 'model', 'field').annotate(count=models.Count('objid', distinct=True))
+            for item in qs.order_by():
+                oBack[item['tagid']][(item['model'], item['field'])] = item['count']
+        return oBack
+
+    @classmethod
+    def get_snippets(cls, tagcls, tagid, modelcls, field, lObjid):
+        """Get the keyword-in-context snippets of tag [tagid] in [field] of the objects [lObjid] (class [modelcls])
+
+        Returns a dictionary: {objid: [(value, before, after)]}, in the order of the segments
+        """
+
+        oBack = {}
+        if len(lObjid) > 0:
+            qs = cls.objects.filter(tagtype=cls.get_tagtype(tagcls), tagid=tagid, model=cls.get_tagtype(modelcls), 
+                                    field=field, objid__in=lObjid)
+            for objid, value, before, after in qs.order_by('objid', 'segment').values_list('objid', 'value', 'before', 'after'):
+                oBack.setdefault(objid, []).append((value, before, after))
+        return oBack
+
+    @classmethod
+    def get_objects(cls, tagcls, tagid):
+        """Get the ids of the objects that use tag [tagid] (class [tagcls]): {(model, field): [objid]}"""
+
+        oBack = {}
+        qs = cls.objects.filter(tagtype=cls.get_tagtype(tagcls), tagid=tagid)
+        for model, field, objid in qs.order_by('objid').values_list('model', 'field', 'objid').distinct():
+            oBack.setdefault((model, field), []).append(objid)
+        return oBack
+
+    @classmethod
+    def on_delete_object(cls, sender, instance, **kwargs):
+        """Remove the occurrences in a TagtextModel instance that is deleted (also by a cascade or a queryset)"""
+        cls.objects.filter(model=cls.get_tagtype(sender), objid=instance.id).delete()
+
+    @classmethod
+    def on_delete_tag(cls, sender, instance, **kwargs):
+        """Remove the occurrences of a tag that is deleted"""
+        cls.objects.filter(tagtype=cls.get_tagtype(sender), tagid=instance.id).delete()
+
+
 class TagtextModel(models.Model):
     """A models.Model adaptation that deals with tagged text fields"""
 
     class Meta:
         abstract = True
 
+    # Rendered HTML of the tagged text fields (JSON): {version: render_version, fields: {textfield: [key, html]}}
+    rendered = models.TextField("Rendered HTML", blank=True, null=True)
+
     mixed_tag_fields = [ ]
+    fulltext_index = False      # Keep the 'textflat' fields in a full-text index
+    search_keys = {}            # Fields with a normalised copy for searching: {field: search key field}
+    render_version = 1          # Increment when render_display() changes: stored HTML is then rendered again
+    denormalised_fields = []    # Fields kept up to date by adapt_denormalised() (e.g. sort keys)
+    retag_related = []          # Relations that adapt_denormalised() needs (select_related when retagging in bulk)
 
 
-    def __init__(self, *args, **kwargs):
-        # Perform standard initialisations
-        response = super(TagtextModel, self).__init__(*args, **kwargs)
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Each tagged text field gets a get_FIELD_display that is only rendered when it is used
+        for item in cls.mixed_tag_fields:
+            textfield = item['textfield']
+            setattr(cls, "get_{}_display".format(textfield), TagtextDisplay(textfield, item.get('url')))
+
+    def adapt_display(self, textfield, sText,  url=None, debug=False):
+        """Make sure the get_FIELD_display of [textfield] is rendered anew (when it is used)"""
 
+        if debug:
+            self.Status("TagtextModel.adapt_display url={}".format(url))
+        self.__dict__.get(TagtextDisplay.memo, {}).pop(textfield, None)
+        return True
+
+    def render_display(self, sText, url=None):
+        """Render the (stringified JSON) tagged text [sText] into HTML"""
+
+        showvalue = ""
         try:
-            for item in self.mixed_tag_fields:
-                textfield = item['textfield']
-                textvalue = getattr(self, textfield)
-                url = None if 'url' not in item else item['url']
-                # Make sure the get_FIELD_display is set
-                self.adapt_display(textfield, textvalue, url)
+            showvalue = render_tagtext(sText, url)
         except:
             sMsg = self.get_error_message()
+        return showvalue
 
-        # Return our initial response
-        return response
+    def get_rendered_fields(self):
+        """Get the current stored HTML per field: {textfield: [key, html]}, or None if 'rendered' is not loaded"""
 
-    def adapt_display(self, textfield, sText,  url=None, debug=False):
+        if "rendered" in self.get_deferred_fields():
+            return None
+        oCache = self.__dict__.get("_tagtext_rendered")
+        if oCache is None or oCache[0] != self.rendered:
+            oFields = {}
+            try:
+                if self.rendered:
+                    oRendered = json.loads(self.rendered)
+                    if oRendered.get('version') == self.render_version:
+                        oFields = oRendered['fields']
+            except:
+                sMsg = self.get_error_message()
+            oCache = (self.rendered, oFields)
+            self.__dict__["_tagtext_rendered"] = oCache
+        return oCache[1]
+
+    def get_rendered(self, textfield, sText, url=None):
+        """Get the HTML of [sText] in [textfield]: stored if possible, otherwise rendered (and stored)"""
+
+        if sText == None or sText == "" or sText[0] != "[":
+            # Nothing to be rendered
+            return self.render_display(sText, url)
+        sKey = get_text_key(sText)
+        oFields = self.get_rendered_fields()
+        if oFields != None and textfield in oFields and oFields[textfield][0] == sKey:
+            return oFields[textfield][1]
+
+        # The stored HTML is missing or outdated
+        html = self.render_display(sText, url)
+        if oFields != None and self.pk and getattr(self, textfield) == sText:
+            try:
+                oFields = dict(oFields)
+                oFields[textfield] = [sKey, html]
+                self.rendered = json.dumps(dict(version=self.render_version, fields=oFields))
+                # NOTE: the stored HTML is not in the cached counts or result ids, so these stay valid
+                self.__class__._base_manager.filter(pk=self.pk).update(rendered=self.rendered)
+            except:
+                sMsg = self.get_error_message()
+        return html
+
+    def adapt_rendered(self, oHtml=None):
+        """Make sure the 'rendered' field holds the HTML of all tagged text fields; return True if it changed
         
-        try:
-            if debug:
-                self.Status("TagtextModel.adapt_display url={}".format(url))
+        The optional [oHtml] has HTML that has already been rendered: {(key, url): html}
+        """
 
-            # Make sure the get_FIELD_display is adapted
-            if sText == None or sText == "":
-                showvalue = ""
-            elif sText[0] != "[":
-                # Plain text, not something else...
-                showvalue = sText
+        oStored = self.get_rendered_fields() or {}
+        oFields = {}
+        for item in self.mixed_tag_fields:
+            textfield = item['textfield']
+            sText = getattr(self, textfield)
+            if sText == None or sText == "" or sText[0] != "[":
+                continue
+            sKey = get_text_key(sText)
+            if textfield in oStored and oStored[textfield][0] == sKey:
+                oFields[textfield] = oStored[textfield]
+            elif oHtml != None and oHtml.get((sKey, item.get('url'))) != None:
+                oFields[textfield] = [sKey, oHtml[(sKey, item.get('url'))]]
             else:
-                # Double check: are there parts in here?
-                if "{" not in sText:
-                    # Automatically convert into one huge part
-                    item = dict(type="text", value=sText)
-                    sText = json.dumps([item])
-                arPart = json.loads(sText)
-                html = []
-                for item in arPart:
-                    # Make sure to get the markdown of the item
-                    mditem = item['value']
-                    # Now look further...
-                    if item['type'] == "text":
-                        html.append(mditem)
-                    elif item['type'] == "new":
-                        html.append('@{}@'.format(mditem))
-                    else:
-                        # This means the field type is 'tag'
-                        if url:
-                            href = reverse(url, kwargs= {'pk': item['tagid']})
-                            if 'style' in item and item['style'] == "italic":
-                                html.append('<span tagid="{}" contenteditable="false"><a href="{}"><i>{}</i></a></span>'.format(item['tagid'], href, mditem))
-                            else:
-                                html.append('<span tagid="{}" contenteditable="false"><a href="{}">{}</a></span>'.format(item['tagid'], href, mditem))
-                        else:
-                            if 'style' in item and item['style'] == "italic":
-                                html.append('<span tagid="{}" contenteditable="false"><i>{}</i></span>'.format(item['tagid'], mditem))
-                            else:
-                                html.append('<span tagid="{}" contenteditable="false">{}</span>'.format(item['tagid'], mditem))
-                showvalue = "".join(html)
-                # Now perform MD
-                showvalue = markdown(showvalue).replace("<p>", "").replace("</p>", "")
-            setattr(self, "get_{}_display".format(textfield), showvalue)
+                oFields[textfield] = [sKey, self.render_display(sText, item.get('url'))]
+        sRendered = json.dumps(dict(version=self.render_version, fields=oFields))
+        if sRendered != self.rendered:
+            self.rendered = sRendered
             return True
-        except:
-            sMsg = self.get_error_message()
-            return False
+        return False
+
+    @classmethod
+    def rendered_rebuild(cls, chunk=500, force=True, progress=None):
+        """Store the HTML of the tagged text fields of all instances anew, in chunks of [chunk]
+        
+        Without [force] the HTML that is still current is kept, otherwise everything is rendered again
+        (e.g. when the URLs have changed). The optional [progress] function is called with the number of instances done.
+        """
+
+        iChanged = 0
+        lField = ["id", "rendered"] + [x['textfield'] for x in cls.mixed_tag_fields]
+        qs = cls.objects.all().only(*lField).order_by("id")
+        iLast = 0
+        iDone = 0
+        while True:
+            lObj = list(qs.filter(id__gt=iLast)[:chunk])
+            if len(lObj) == 0: break
+            lChanged = []
+            for obj in lObj:
+                if force:
+                    obj.__dict__["_tagtext_rendered"] = (obj.rendered, {})
+                if obj.adapt_rendered():
+                    lChanged.append(obj)
+            if len(lChanged) > 0:
+                cls.objects.bulk_update(lChanged, ["rendered"])
+            iChanged += len(lChanged)
+            iLast = lObj[-1].id
+            iDone += len(lObj)
+            if progress != None: progress(iDone)
+        return iChanged
+
+    def get_occurrences(self):
+        """Get the (unsaved) TagOccurrence objects of all tags in the tagged text fields of this instance, with their snippets"""
+
+        lBack = []
+        sModel = TagOccurrence.get_tagtype(self.__class__)
+        size = get_kwic_size()
+        for item in self.mixed_tag_fields:
+            sText = getattr(self, item['textfield'])
+            if sText == None or sText == "" or sText[0] != "[":
+                continue
+            sTagtype = TagOccurrence.get_tagtype(item['class'])
+            segments = get_tagtext_parsed(sText).segments
+            for idx, segment in enumerate(segments):
+                if segment.type == "tag" and segment.tagid != None:
+                    try:
+                        tagid = int(segment.tagid)
+                    except (TypeError, ValueError):
+                        continue
+                    # The keyword-in-context snippet is computed once, here
+                    sBefore, sAfter = get_tagtext_context(segments, idx, size)
+                    lBack.append(TagOccurrence(tagtype=sTagtype, tagid=tagid, model=sModel, objid=self.id,
+                                               field=item['textfield'], segment=idx, value=segment.value,
+                                               before=sBefore, after=sAfter))
+        return lBack
+
+    @classmethod
+    def occurrence_update(cls, lObj):
+        """Make sure the TagOccurrence index has exactly the tags of the (saved) instances [lObj]"""
+
+        lId = [x.id for x in lObj if x.id != None]
+        if len(cls.mixed_tag_fields) > 0 and len(lId) > 0:
+            TagOccurrence.objects.filter(model=TagOccurrence.get_tagtype(cls), objid__in=lId).delete()
+            lOccurrence = []
+            for obj in lObj:
+                if obj.id != None: lOccurrence.extend(obj.get_occurrences())
+            TagOccurrence.objects.bulk_create(lOccurrence, batch_size=500)
+        return True
+
+    @classmethod
+    def occurrence_rebuild(cls, chunk=500, progress=None):
+        """Fill the TagOccurrence index anew for all instances, in chunks of [chunk]
+
+        The optional [progress] function is called with the number of instances done.
+        """
+
+        lField = ["id"] + [x['textfield'] for x in cls.mixed_tag_fields]
+        qs = cls.objects.all().only(*lField).order_by("id")
+        iLast = 0
+        iDone = 0
+        while True:
+            lObj = list(qs.filter(id__gt=iLast)[:chunk])
+            if len(lObj) == 0: break
+            with transaction.atomic():
+                cls.occurrence_update(lObj)
+            iLast = lObj[-1].id
+            iDone += len(lObj)
+            if progress != None: progress(iDone)
+        return iDone
+
+    def adapt_denormalised(self):
+        """Make sure the denormalised_fields are up to date: returns True if any has changed"""
+        return False
+
+    @classmethod
+    def retag(cls, lObj, pool=None, render=False):
+        """Process the tagged texts of the instances [lObj] in bulk, and write back what has changed
+        
+        This does what save() does for the tagged texts (tags, m2m links, flat texts, search keys, 
+        denormalised fields and rendered HTML), but with set-based queries for all instances at once.
+        The HTML is rendered in the process [pool] if given; with [render] all HTML is rendered anew.
+        Returns the number of instances that changed.
+        """
+
+        oChanged = {}
+        bLinked = False
+        lField = cls.get_tagtext_fields()
+        for item in cls.mixed_tag_fields:
+            textfield = item['textfield']
+            textflat = item.get('textflat')
+
+            # Parse all texts that have (possibly) tags
+            lText = []
+            for obj in lObj:
+                sText = getattr(obj, textfield)
+                if sText == None or sText == "" or sText[0] != "[":
+                    continue
+                if "{" in sText:
+                    try:
+                        lText.append((obj, get_tagtext_parsed(sText).get_parts()))
+                    except:
+                        sMsg = obj.get_error_message()
+                else:
+                    # This is flat text: code it
+                    setattr(obj, textfield, json.dumps([ dict(type="text", value=sText) ]))
+                    oChanged[obj.id] = obj
+
+            # Resolve all tags at once and link exactly those
+            lTaglist = resolve_tagtext(item['class'], [x[1] for x in lText])
+            oWanted = { obj.id: set(taglist) for (obj, arPart), taglist in zip(lText, lTaglist) }
+            field = cls._meta.get_field(item['m2mfield'])
+            through = field.remote_field.through
+            sSource = field.m2m_field_name() + "_id"
+            sTarget = field.m2m_reverse_field_name() + "_id"
+            oHave = {}
+            lRemove = []
+            for link_id, source_id, target_id in through.objects.filter(**{sSource + "__in": list(oWanted)}).values_list("id", sSource, sTarget):
+                if target_id in oWanted[source_id]:
+                    oHave.setdefault(source_id, set()).add(target_id)
+                else:
+                    lRemove.append(link_id)
+            if len(lRemove) > 0:
+                through.objects.filter(id__in=lRemove).delete()
+            lAdd = [through(**{sSource: obj_id, sTarget: tag_id}) for obj_id, tagids in oWanted.items() 
+                    for tag_id in tagids - oHave.get(obj_id, set())]
+            through.objects.bulk_create(lAdd)
+            if len(lRemove) > 0 or len(lAdd) > 0: bLinked = True
+
+            # Fix the stringified texts
+            for obj, arPart in lText:
+                sText = json.dumps(strip_tagtext(arPart))
+                if getattr(obj, textfield) != sText:
+                    setattr(obj, textfield, sText)
+                    obj.adapt_display(textfield, sText)
+                    oChanged[obj.id] = obj
+
+            # Possibly process [textflat]
+            if textflat != None:
+                for obj in lObj:
+                    bOkay, sFlat = obj.get_flat(textfield)
+                    if bOkay and getattr(obj, textflat) != sFlat:
+                        setattr(obj, textflat, sFlat)
+                        oChanged[obj.id] = obj
+
+        # Render the HTML that is not current (in the pool if possible)
+        oHtml = {}
+        for obj in lObj:
+            if render:
+                obj.__dict__["_tagtext_rendered"] = (obj.rendered, {})
+            oStored = obj.get_rendered_fields() or {}
+            for item in cls.mixed_tag_fields:
+                sText = getattr(obj, item['textfield'])
+                if sText == None or sText == "" or sText[0] != "[": continue
+                sKey = get_text_key(sText)
+                if oStored.get(item['textfield'], [None])[0] != sKey:
+                    oHtml[(sKey, item.get('url'))] = sText
+        if pool != None and len(oHtml) > 0:
+            lJob = [(sText, url) for (sKey, url), sText in oHtml.items()]
+            oHtml = dict(zip(oHtml.keys(), pool.map(render_tagtext_job, lJob, chunksize=50)))
+        else:
+            oHtml = {}
+
+        for obj in lObj:
+            bChanged = obj.adapt_search_keys()
+            if obj.adapt_denormalised(): bChanged = True
+            if obj.adapt_rendered(oHtml): bChanged = True
+            if bChanged: oChanged[obj.id] = obj
+
+        if len(oChanged) > 0:
+            cls.objects.bulk_update(list(oChanged.values()), lField)
+        # Keep the index of the tag occurrences up to date
+        cls.occurrence_update(lObj)
+        if bLinked or len(oChanged) > 0:
+            bump_data_generation()
+        return len(oChanged)
+
+    @classmethod
+    def retag_all(cls, chunk=500, workers=0, render=False, progress=None, failed=None):
+        """Process the tagged texts of all instances in bulk: see retag()
+        
+        The instances are read in chunks of [chunk], each written in its own transaction.
+        With [workers] > 1 the HTML is rendered in a pool of that many processes.
+        The optional [progress] function is called with (number done, number changed) after each chunk.
+        If a list [failed] is given, a chunk that fails is rolled back and added to it as (first id, last id, message), 
+        and the next chunks are processed; otherwise the error is raised.
+        """
+
+        iChanged = 0
+        pool = None
+        if workers > 1:
+            sMethod = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(sMethod),
+                                       initializer=init_tagtext_worker)
+        try:
+            # Note: chunks are read by id, since SQLite has no isolation between a running cursor and writes
+            qs = cls.objects.all().order_by("id")
+            if len(cls.retag_related) > 0:
+                qs = qs.select_related(*cls.retag_related)
+            iLast = 0
+            iDone = 0
+            while True:
+                lObj = list(qs.filter(id__gt=iLast)[:chunk])
+                if len(lObj) == 0: break
+                try:
+                    with transaction.atomic():
+                        iChanged += cls.retag(lObj, pool=pool, render=render)
+                except:
+                    if failed == None: raise
+                    failed.append((lObj[0].id, lObj[-1].id, lObj[0].get_error_message()))
+                iLast = lObj[-1].id
+                iDone += len(lObj)
+                if progress != None: progress(iDone, iChanged)
+        finally:
+            if pool != None: pool.shutdown()
+        if iChanged > 0 and cls.fulltext_index:
+            cls.fulltext_rebuild()
+        return iChanged
 
     def delete(self, using=None, keep_parents=False):
+        id = self.id
         response = super(TagtextModel, self).delete(using=using, keep_parents=keep_parents)
+        # Remove this instance from the full-text index (the tag occurrences go through a signal)
+        self.fulltext_update(id, delete=True)
         return response
+
+    @staticmethod
+    def get_search_key(sValue):
+        """Normalise the value of a field in [search_keys] (to be defined by the model)"""
+        return sValue
+
+    def adapt_search_keys(self):
+        """Make sure the search key fields are up to date: returns True if any has changed"""
+
+        bChanged = False
+        for field, keyfield in self.search_keys.items():
+            sKey = self.get_search_key(getattr(self, field))
+            if getattr(self, keyfield) != sKey:
+                setattr(self, keyfield, sKey)
+                bChanged = True
+        return bChanged
+
+    @classmethod
+    def get_fulltext_fields(cls):
+        """Get the flat text fields that are kept in the full-text index (or their search key fields)"""
+        lField = [x['textflat'] for x in cls.mixed_tag_fields if x.get('textflat')]
+        return [cls.search_keys.get(x, x) for x in lField]
+
+    @classmethod
+    def get_fulltext_table(cls):
+        return "{}_fts".format(cls._meta.db_table)
+
+    @classmethod
+    def fulltext_ready(cls):
+        """Make sure the full-text index of this model exists, creating and filling it if needed"""
+
+        if cls not in fulltext_tables:
+            bReady = False
+            try:
+                lField = cls.get_fulltext_fields()
+                if cls.fulltext_index and len(lField) > 0 and connection.vendor == "sqlite":
+                    sTable = cls.get_fulltext_table()
+                    sTokenizer = get_fulltext_tokenizer()
+                    sFields = ", ".join(lField)
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=%s", [sTable])
+                        row = cursor.fetchone()
+                        if row != None and "fts5({}, tokenize='{}')".format(sFields, sTokenizer) not in row[0]:
+                            # The index was made with other fields or another tokenizer
+                            cursor.execute('DROP TABLE "{}"'.format(sTable))
+                            row = None
+                        if row == None:
+                            cursor.execute("CREATE VIRTUAL TABLE \"{}\" USING fts5({}, tokenize='{}')".format(
+                                sTable, sFields, sTokenizer))
+                            cursor.execute('INSERT INTO "{}"(rowid, {}) SELECT id, {} FROM "{}"'.format(
+                                sTable, sFields, sFields, cls._meta.db_table))
+                    bReady = True
+            except:
+                sMsg = cls.get_error_message(cls)
+                print("TagtextModel/fulltext_ready: {}".format(sMsg), file=sys.stderr)
+            fulltext_tables[cls] = bReady
+        return fulltext_tables[cls]
+
+    @classmethod
+    def fulltext_filter(cls, fields, val):
+        """Get a Q-object for the rows whose [fields] may match search value [val], or None if there is none
+        
+        The [val] may also be a dictionary with the search value per field
+        """
+
+        q_back = None
+        if cls.fulltext_ready():
+            lField = cls.get_fulltext_fields()
+            if len(fields) > 0 and all(x in lField for x in fields):
+                # Fields with the same search value are combined
+                oValue = {}
+                for field in fields:
+                    sValue = val[field] if isinstance(val, dict) else val
+                    oValue.setdefault(sValue, []).append(field)
+                lQuery = []
+                for sValue, lValueField in oValue.items():
+                    sQuery = get_fulltext_query(sValue, get_fulltext_tokenizer())
+                    if sQuery == "":
+                        # These rows can not be narrowed down
+                        lQuery = []
+                        break
+                    lQuery.append("{{{}}} : ({})".format(" ".join(lValueField), sQuery))
+                if len(lQuery) > 0:
+                    sTable = cls.get_fulltext_table()
+                    sSql = 'SELECT rowid FROM "{}" WHERE "{}" MATCH %s'.format(sTable, sTable)
+                    q_back = Q(id__in=RawSQL(sSql, (" OR ".join(lQuery),)))
+        return q_back
+
+    @classmethod
+    def fulltext_rebuild(cls):
+        """Fill the full-text index anew from the flat text fields
+        
+        The table is filled in place (not dropped): other processes have cached that it is ready.
+        """
+
+        if cls.fulltext_ready():
+            sTable = cls.get_fulltext_table()
+            sFields = ", ".join(cls.get_fulltext_fields())
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute('DELETE FROM "{}"'.format(sTable))
+                    cursor.execute('INSERT INTO "{}"(rowid, {}) SELECT id, {} FROM "{}"'.format(
+                        sTable, sFields, sFields, cls._meta.db_table))
+        return True
+
+    def fulltext_update(self, id=None, delete=False):
+        """Copy the flat text fields of this instance to the full-text index"""
+
+        if id == None: id = self.id
+        if id != None and self.fulltext_ready():
+            sTable = self.get_fulltext_table()
+            lField = self.get_fulltext_fields()
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM "{}" WHERE rowid = %s'.format(sTable), [id])
+                if not delete:
+                    cursor.execute('INSERT INTO "{}"(rowid, {}) VALUES (%s{})'.format(
+                        sTable, ", ".join(lField), ", %s" * len(lField)), 
+                        [id] + [getattr(self, x) for x in lField])
+        return True
     
     def get_error_message(self):
         arInfo = sys.exc_info()
@@ -100,119 +1038,38 @@ class TagtextModel(models.Model):
         """Get the flat text"""
 
         try:
-            sText = getattr(self, textfield)
-            if sText != None and sText != "" and sText[0] == "[":
-
-                # Parse the string into a list
-                arPart = json.loads(sText)
-                lFlat = []
-                # Add new tags where appropriate
-                for tagobj in arPart:
-                    # Get the value
-                    tagname = tagobj['value']
-                    lFlat.append(tagname)
-                # Combine to get the text
-                sText = " ".join(lFlat)
-                sText = sText.strip()
-                # Double check if there is anything in the text
-                if sText in "-": sText = ""
-            return True, sText
+            oParsed = get_tagtext_parsed(getattr(self, textfield))
+            if oParsed.tagged and oParsed.flat == None:
+                return False, "No valid tagged text in {}".format(textfield)
+            return True, oParsed.flat
         except:
             sMsg = self.get_error_message()
             return False, sMsg
 
-    def process_tags(self, textfield, tagitems, cls, url=None):
-        """Extract the tags from [sText] and then make sure that the many-to-many field [m2m] only has these tags
+    def prepare_tags(self, textfield, cls, url=None):
+        """Extract the tags (class [cls]) from the tagged text in [textfield], without linking them yet
         
         This assumes we receive a (stringified) JSON list with three types of elements:
         1 - text            {"type": "text",    "value": "this is some text"                }
         2 - existing tag    {"type": "tag",     "value": "my tag text",      "tagid": 21, "style": "italic"   }
         3 - new tag         {"type": "new",     "value": "new tag text"                     }
+
+        Returns (okay, processed text, ids of the tags in it), where the ids are None if there are no tags to link.
         """
 
         try:
+            taglist = None
             sText = getattr(self, textfield)
             if sText != None and sText != "" and sText[0] == "[":
 
                 if sText[0] == "[" and "{" in sText:
 
-                    # Parse the string into a list
-                    arPart = json.loads(sText)
-
-                    # Start a list of tag ids that are in this text
-                    taglist = []
-
-                    # Add new tags where appropriate
-                    for tagobj in arPart:
-                        # Get the value
-                        tagname = tagobj['value']
-                        # Check if this is a new tag or an existing tag
-                        if tagobj['type'] == "new":
-                            # Check if there is a representation followed by a lexical entry
-                            arTagname = tagname.split("|")
-                            visual = ""
-                            if len(arTagname) > 1:
-                                tagname = arTagname[1]
-                                visual = arTagname[0]
-                                tagobj['value'] = visual
-                            # Add this tag, if the lower case comparison yields nothing
-                            obj = cls.objects.filter(name__iexact=tagname.lower()).first()
-                            if obj == None:
-                                # Create a new tag
-                                obj = cls.objects.create(name=tagname)
-                            # Add the tag to the list
-                            taglist.append(obj)
-                            # Repair the entry in arPart
-                            tagobj['tagid'] = obj.id
-                            tagobj['type'] = "tag"
-                            style = obj.get_style()
-                            if style != None and style != "": tagobj['style'] = style
-                            # Make sure to add it to [tagitems]
-                            tagitems.add(obj)
-                        elif tagobj['type'] == "tag":
-                            obj = cls.objects.filter(id=tagobj['tagid']).first()
-                            if obj == None:
-                                # Need to create it anyway
-                                obj = cls.objects.create(name=tagname)
-                                # Repair the id
-                                tagobj['tagid'] = obj.id
-                                style = obj.get_style()
-                                if style != None and style != "": tagobj['style'] = style
-                            else:
-                                style = obj.get_style()
-                                if style != None and style != "": tagobj['style'] = style
-                            taglist.append(obj)
-                            # Check if it is in the m2m tagitems
-                            if obj not in tagitems.all():
-                                tagitems.add(obj)
-                        # Note: no need to do anything with the text items
-
-                    # Break the link with tags that are *not* in my current list
-                    tagids = [x.id for x in taglist]
-                    for obj in tagitems.all():
-                        if obj.id not in tagids:
-                            # Must be broken
-                            tagitems.remove(obj)
-
-                    # Process the *first* in the list
-                    if len(arPart) > 0:
-                        item = arPart[0]
-                        if item['type'] == "text":
-                            sValue = item['value']
-                            sStripped = sValue.lstrip()
-                            if sValue != sStripped:
-                                item['value'] = sStripped
-
-                    # Process the *last* in the list if the list is larger
-                    if len(arPart) > 1:
-                        item = arPart[-1]
-                        if item['type'] == "text":
-                            sValue = item['value']
-                            sStripped = sValue.rstrip()
-                            if sValue != sStripped:
-                                item['value'] = sStripped
-                                bChanged = True
+                    # Get the parts as a list (that can be changed)
+                    arPart = get_tagtext_parsed(sText).get_parts()
 
+                    # Resolve the tags
+                    taglist = resolve_tagtext(cls, [arPart])[0]
+                    strip_tagtext(arPart)
 
                     # Fix the stringified text
                     sText = json.dumps(arPart)
@@ -223,51 +1080,107 @@ class TagtextModel(models.Model):
             # Make sure the get_FIELD_display is adapted
             self.adapt_display(textfield, sText, url)
         
-            return True, sText
+            return True, sText, taglist
         except:
             sMsg = self.get_error_message()
-            return False, sMsg
+            return False, sMsg, None
+
+    def process_tags(self, textfield, tagitems, cls, url=None):
+        """Extract the tags from [sText] and then make sure that the many-to-many field [m2m] only has these tags"""
+
+        bOkay, sText, taglist = self.prepare_tags(textfield, cls, url)
+        if bOkay and taglist != None:
+            tagitems.set(set(taglist))
+        return bOkay, sText
+
+    def adapt_tagtexts(self):
+        """Process all the tagged texts before writing: the texts, flat texts, search keys, denormalised fields and HTML
+        
+        Returns a list of (m2mfield, tag ids) with the tags that must be linked after writing.
+        """
+
+        lLink = []
+        for item in self.mixed_tag_fields:
+            textfield = item['textfield']
+            textflat = item.get('textflat')
+
+            bOkay, sText, taglist = self.prepare_tags(textfield, item['class'], item.get('url'))
+            if bOkay:
+                setattr(self, textfield, sText)
+                if taglist != None:
+                    lLink.append((item['m2mfield'], taglist))
+            # Possibly process [textflat]
+            if textflat != None:
+                bOkay, sFlat = self.get_flat(textfield)
+                if bOkay:
+                    setattr(self, textflat, sFlat)
+
+        # The search keys may depend on the flat text
+        self.adapt_search_keys()
+        self.adapt_denormalised()
+        # Store the HTML of the (processed) tagged texts
+        self.adapt_rendered()
+        return lLink
+
+    @classmethod
+    def get_tagtext_fields(cls):
+        """Get the names of all fields that adapt_tagtexts() may change"""
+
+        lField = ["rendered"] + list(cls.search_keys.values()) + list(cls.denormalised_fields)
+        for item in cls.mixed_tag_fields:
+            lField.append(item['textfield'])
+            if item.get('textflat') != None: lField.append(item['textflat'])
+        return lField
+
+    def adapt_related(self):
+        """Make sure the fields that depend on m2m relations (or other objects) are up to date
+        
+        This is called once after the transaction of save() has been committed (when the m2m fields are final).
+        Returns a list of the fields that have changed: only these are written.
+        """
+        return []
+
+    def defer_related(self):
+        """Make sure adapt_related() is called after the current transaction has been committed"""
+
+        if self.pk == None: return
+        RelatedPending.add(self)
 
     def save(self, force_insert = False, force_update = False, using = None, update_fields = None):
 
         response = None
         try:
-            # Perform the actual saving
+            lLink = None
+            lField = self.get_tagtext_fields()
+            lText = [x['textfield'] for x in self.mixed_tag_fields] + [x['textflat'] for x in self.mixed_tag_fields if x.get('textflat')]
+            if update_fields == None or any(x in update_fields for x in lText):
+                # Everything that is derived from the tagged texts is computed before writing
+                lLink = self.adapt_tagtexts()
+                if update_fields != None:
+                    update_fields = set(update_fields) | set(lField)
+            else:
+                # Only the search keys and denormalised fields (e.g. the sort key of a name) may depend on [update_fields]
+                update_fields = set(update_fields)
+                if self.adapt_search_keys():
+                    update_fields |= set(self.search_keys.values())
+                if self.adapt_denormalised():
+                    update_fields |= set(self.denormalised_fields)
+
+            # Perform the actual saving: one single write
             response = super(TagtextModel, self).save(force_insert, force_update, using, update_fields)
 
-            bChanged = False
-            # Process all the mixed_tag_fields
-            for item in self.mixed_tag_fields:
-                textfield = item['textfield']
-                m2mfield = item['m2mfield']
-                textflat = item.get('textflat')
-                cls = item['class']
-                url = None if 'url' not in item else item['url']
-
-                # Note: this is only possible of there already is a saved ID
-                if self.id:
-                    bOkay, sText = self.process_tags(textfield, getattr(self, m2mfield), cls, url)
-                    if bOkay:
-                        if getattr(self, textfield) != sText:
-                            setattr(self, textfield, sText)
-                            bChanged  = True
-                    else:
-                        # SOmething is not okay
-                        err = "Notokay"
-                    # Possibly process [textflat]
-                    if textflat != None:
-                        bOkay, sFlat = self.get_flat(textfield)
-                        if bOkay:
-                            if getattr(self, textflat) != sFlat:
-                                setattr(self, textflat, sFlat)
-                                bChanged = True
-                        else:
-                            err = "Notokay"
+            if lLink != None:
+                # Link exactly the tags that are in the texts (this needs an id)
+                for m2mfield, taglist in lLink:
+                    getattr(self, m2mfield).set(set(taglist))
+                self.occurrence_update([self])
 
-        
-            # Perform additional saving if something changed
-            if bChanged:
-                response = super(TagtextModel, self).save(force_insert, force_update, using, update_fields)
+            # Fields that depend on m2m relations are adapted after the transaction
+            self.defer_related()
+
+            # Keep the full-text index up to date
+            if self.fulltext_index:
+                self.fulltext_update()
         except:
             sMsg = self.get_error_message()
             response = None
@@ -41,6 +41,7 @@ urlpatterns = [
 
     re_path(r'^api/tagtext/', lentensermons.seeker.views.get_tributes, name='api_tributes'),
     re_path(r'^api/params/', lentensermons.seeker.views.get_params, name='api_params'),
+    re_path(r'^api/search/', lentensermons.seeker.views.search_global, name='api_search'),
 
     re_path(r'^location/list', LocationListView.as_view(), name='location_list'),
     re_path(r'^location/details(?:/(?P<pk>\d+))?/$', LocationDetailsView.as_view(), name='location_details'),